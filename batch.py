@@ -0,0 +1,252 @@
+'''
+file that contains the batched simulation engine: R independent replicates
+of one scenario advanced together in one (R, N, 15) array, so the numpy
+calls of a time step are shared by all replicates in stead of repeated
+for each of them
+'''
+
+import numpy as np
+
+from infection import find_contacts
+from tracker import Population_trackers
+
+
+class Batched_Simulation():
+    __slots__ = ['config',
+                 'virus',
+                 'society',
+                 'speed',
+                 'replicates',
+                 'population',
+                 'ids',
+                 'rngs',
+                 'trackers',
+                 'finished',
+                 'mortality_table',
+                 'frame']
+
+    '''R replicates of a scenario in one (R, N, 15) array
+
+    Every replicate has the columns of the population matrix (see Population)
+    and its own random generator, seeded from a SeedSequence, so a replicate
+    does not depend on the other replicates in the batch. Motion, infection
+    and recovery are computed with one set of numpy calls for all running
+    replicates. Contacts are found with a single Spatial_Grid (or kd-tree) over
+    all replicates, in which each replicate is shifted along the x axis so
+    replicates never meet.
+
+    A replicate stops when config.endif_no_infections ends it: its final
+    population is moved to 'finished' and it is dropped from the array, so
+    the remaining replicates keep running without it.
+
+    Supports the scenario of a wandering population: destinations
+    (self-isolation) and lockdowns are not supported, and infections follow
+    the same odds as Virus.infect but treatment beds go to the new infections
+    in order of their index in stead of their order of infection.
+    '''
+    def __init__(self, config, vir, pop, soc, replicates=8, seed=100):
+        '''initializes the population of every replicate
+
+        Keyword arguments
+        -----------------
+        config : Configuration
+            configuration shared by all replicates, holds the current frame
+
+        vir : Virus
+            the virus
+
+        pop : Population
+            template population: initialize_population_matrix is called once
+            per replicate, with numpy's random generator seeded for that replicate
+
+        soc : Society
+            the society, self_isolate and lockdown are not supported
+
+        replicates : int
+            the number of replicates R
+
+        seed : int
+            the seed from which the seeds of all replicates are derived
+        '''
+        if soc.self_isolate or soc.lockdown:
+            raise ValueError('the batched engine does not support self_isolate and lockdown, use Simulation')
+
+        self.config = config
+        self.virus = vir
+        self.society = soc
+        self.speed = pop.speed
+        self.replicates = replicates
+        self.frame = config.frame
+
+        seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(replicates)]
+        self.population = np.zeros((replicates, pop.pop_size, 15))
+        for r, replicate_seed in enumerate(seeds):
+            np.random.seed(replicate_seed)
+            pop.initialize_population_matrix()
+            self.population[r] = pop.population
+        self.rngs = [np.random.default_rng(replicate_seed) for replicate_seed in seeds]
+
+        self.ids = np.arange(replicates) #replicate number of each row of population
+        self.trackers = [Population_trackers() for r in range(replicates)]
+        self.finished = [None] * replicates
+        self.mortality_table = vir.mortality_by_age(pop)
+
+    def _uniform(self, counts):
+        '''draws counts[r] uniform numbers from the generator of each running replicate'''
+        return np.concatenate([self.rngs[r].random(count) for r, count in zip(self.ids, counts)])
+
+    def _normal(self, counts, loc, scale):
+        '''draws counts[r] gaussian numbers from the generator of each running replicate'''
+        return np.concatenate([self.rngs[r].normal(loc, scale, count) for r, count in zip(self.ids, counts)])
+
+    def _bounce(self, position, heading, lower, upper):
+        '''turns those at a bound and heading outward back inward'''
+        low = (position <= lower) & (heading < 0)
+        heading[low] = np.clip(self._normal(low.sum(axis=1), 0.5, 0.5/3), 0.05, 1)
+        high = (position >= upper) & (heading > 0)
+        heading[high] = np.clip(-self._normal(high.sum(axis=1), 0.5, 0.5/3), -1, -0.05)
+
+    def _randomize(self, column, update_chance, loc, scale):
+        '''redraws column from a gaussian for a random selection of members'''
+        update = self._uniform(np.full(len(self.ids), column.shape[1])).reshape(column.shape) <= update_chance
+        column[update] = self._normal(update.sum(axis=1), loc, scale)
+
+    def move(self, heading_update_chance=0.02):
+        '''out of bounds, update_randoms and update_positions for all replicates'''
+        population = self.population
+        self._bounce(population[:,:,1], population[:,:,3],
+                     self.config.xbounds[0] + 0.02, self.config.xbounds[1] - 0.02)
+        self._bounce(population[:,:,2], population[:,:,4],
+                     self.config.ybounds[0] + 0.02, self.config.ybounds[1] - 0.02)
+
+        self._randomize(population[:,:,3], heading_update_chance, 0, 1/3)
+        self._randomize(population[:,:,4], heading_update_chance, 0, 1/3)
+        self._randomize(population[:,:,5], heading_update_chance, self.speed, self.speed / 3)
+        np.clip(population[:,:,5], 0.0001, 0.05, out = population[:,:,5])
+
+        #dead do not move
+        dead = population[:,:,6] == 3
+        population[:,:,3][dead] = 0
+        population[:,:,4][dead] = 0
+
+        population[:,:,1] += population[:,:,3] * population[:,:,5]
+        population[:,:,2] += population[:,:,4] * population[:,:,5]
+
+    def infect(self):
+        '''finds new infections in all replicates, see Virus.infect'''
+        population = self.population
+        replicates, pop_size = population.shape[:2]
+        flat = population.reshape(replicates * pop_size, 15)
+        infected = np.flatnonzero(flat[:,6] == 1)
+        healthy = np.flatnonzero(flat[:,6] == 0)
+
+        #shift every replicate along x, so they are far apart in one search
+        spacing = 2 * (self.config.xbounds[1] - self.config.xbounds[0]) + 1
+        positions = np.zeros((len(flat), 3))
+        positions[:,1] = flat[:,1] + (np.arange(len(flat)) // pop_size) * spacing
+        positions[:,2] = flat[:,2]
+        backend = 'tree' if self.config.infection_backend == 'tree' else 'grid'
+        sources, contacts = find_contacts(positions, infected, healthy, self.virus.infection_range,
+                                          backend = backend, shape = self.config.infection_shape)
+
+        #odds of infection per healthy person with k infected nearby: 1 - (1 - chance)^k
+        #if less than half of the replicate is infected (one die per contact, as Virus.infect),
+        #else chance * k
+        nearby = np.bincount(contacts, minlength = len(flat)).reshape(replicates, pop_size)
+        chance = self.virus.infection_chance
+        few_infected = (population[:,:,6] == 1).sum(axis=1) < (pop_size // 2)
+        odds = np.where(few_infected[:,None], 1 - (1 - chance) ** nearby, chance * nearby)
+
+        at_risk = nearby > 0
+        new = np.zeros((replicates, pop_size), dtype=bool)
+        new[at_risk] = self._uniform(at_risk.sum(axis=1)) < odds[at_risk]
+
+        population[:,:,6][new] = 1
+        population[:,:,8][new] = self.frame
+
+        #fill the remaining treatment beds, in order of index
+        beds = np.maximum(self.society.healthcare_capacity - (population[:,:,10] == 1).sum(axis=1) + 1, 0)
+        treated = new & (np.cumsum(new, axis=1) <= beds[:,None])
+        population[:,:,10][treated] = 1
+
+    def recover_or_die(self):
+        '''resolves everyone whose illness ends this frame, see Virus.recover_or_die'''
+        population = self.population
+        soc = self.society
+        duration = self.virus.recovery_duration
+
+        recovery_odds = np.clip((self.frame - population[:,:,8] - duration[0]) / np.ptp(duration),
+                                a_min = 0, a_max = None)
+        resolved = (population[:,:,6] == 1) & (recovery_odds >= population[:,:,9])
+
+        ages = np.clip(np.int64(population[:,:,7][resolved]), 0, len(self.mortality_table) - 1)
+        mortality_chance = self.mortality_table[ages]
+        if soc.treatment_dependent_risk:
+            mortality_chance = mortality_chance * np.where(population[:,:,10][resolved] == 1,
+                                                           soc.treatment_factor,
+                                                           soc.no_treatment_factor)
+
+        dies = self._uniform(resolved.sum(axis=1)) <= mortality_chance
+        population[:,:,6][resolved] = np.where(dies, 3, 2)
+        population[:,:,10][resolved] = 0
+
+    def step(self):
+        '''advances all running replicates one frame, returns the running replicate numbers'''
+        self.move()
+        self.infect()
+        self.recover_or_die()
+
+        states = self.population[:,:,6]
+        counts = np.stack([(states == state).sum(axis=1) for state in range(5)], axis=1)
+        for r, count in zip(self.ids, counts):
+            tracker = self.trackers[r]
+            tracker.infectious.append(int(count[1]))
+            tracker.recovered.append(int(count[2]))
+            tracker.fatalities.append(int(count[3]))
+            tracker.susceptible.append(self.population.shape[1] - int(count[1] + count[2] + count[3]))
+
+        if self.frame == 1:
+            #same first infections as the callback in simulation.py
+            self.population[:,0:2,6] = 1
+            self.population[:,0,8] = 50
+            self.population[:,1,8] = 20
+            self.population[:,0:2,10] = 1
+
+        running = self.ids
+        self.frame += 1
+        self.config.frame = self.frame
+
+        if self.config.endif_no_infections and self.frame >= 500:
+            done = (counts[:,1] + counts[:,4]) == 0
+            self._finish(done)
+        return running
+
+    def _finish(self, done):
+        '''moves the replicates that are done out of the population array'''
+        if not done.any():
+            return
+        for r, population in zip(self.ids[done], self.population[done]):
+            self.finished[r] = population
+        self.ids = self.ids[~done]
+        self.population = self.population[~done]
+
+    def run(self, n=None):
+        '''runs n frames (default config.simulation_steps) or until all replicates are done
+
+        Returns
+        -------
+        the Population_trackers of the replicates
+        '''
+        if n is None:
+            n = self.config.simulation_steps
+        for i in range(n):
+            if len(self.ids) == 0:
+                break
+            self.step()
+        return self.trackers
+
+    def final_population(self, replicate):
+        '''the population matrix of a replicate, at its end or at the current frame'''
+        if self.finished[replicate] is not None:
+            return self.finished[replicate]
+        return self.population[np.flatnonzero(self.ids == replicate)[0]]
@@ -0,0 +1,62 @@
+'''
+throughput of the batched engine (Batched_Simulation) against running
+the replicates one after the other with Simulation, for the small
+populations of run_model, and the mean outcome of both.
+
+run with: python bench_batch.py
+'''
+
+import time
+
+import numpy as np
+
+from batch import Batched_Simulation
+from config import Configuration
+from simulation import Simulation
+from society import Society
+from stratifiedPopulation import Stratified_Population
+from virusLethal import Virus_Lethal
+
+
+def scenario(pop_size, steps):
+    config = Configuration(visualise = False, verbose = False, infection_backend = 'grid',
+                           simulation_steps = steps)
+    pop = Stratified_Population(pop_size = pop_size)
+    pop.initialize_destination_matrix(total_destinations = 1)
+    return config, Virus_Lethal(), pop, Society()
+
+
+def run_sequential(pop_size, replicates, steps):
+    '''returns the duration and the final (infectious, recovered, fatalities) per replicate'''
+    outcomes = []
+    start = time.perf_counter()
+    for r in range(replicates):
+        np.random.seed(r)
+        config, vir, pop, soc = scenario(pop_size, steps)
+        pop.initialize_population_matrix()
+        record = Simulation(config, vir, pop, soc).run()
+        outcomes.append((record['infectious'], record['recovered'], record['fatalities']))
+    return time.perf_counter() - start, np.array(outcomes)
+
+
+def run_batched(pop_size, replicates, steps):
+    '''returns the duration and the final (infectious, recovered, fatalities) per replicate'''
+    start = time.perf_counter()
+    config, vir, pop, soc = scenario(pop_size, steps)
+    batch = Batched_Simulation(config, vir, pop, soc, replicates = replicates)
+    trackers = batch.run()
+    outcomes = [(t.infectious[-1], t.recovered[-1], t.fatalities[-1]) for t in trackers]
+    return time.perf_counter() - start, np.array(outcomes)
+
+
+if __name__ == '__main__':
+    steps = 300
+    print('%8s %10s %14s %14s %28s %28s' %('pop_size', 'replicates', 'sequential (s)', 'batched (s)',
+                                           'sequential mean (I, R, F)', 'batched mean (I, R, F)'))
+    for pop_size in [500, 2000]:
+        for replicates in [8, 32]:
+            sequential, sequential_outcomes = run_sequential(pop_size, replicates, steps)
+            batched, batched_outcomes = run_batched(pop_size, replicates, steps)
+            print('%8i %10i %14.2f %14.2f %28s %28s' %(pop_size, replicates, sequential, batched,
+                                                      np.round(sequential_outcomes.mean(axis=0), 1),
+                                                      np.round(batched_outcomes.mean(axis=0), 1)))
@@ -0,0 +1,57 @@
+'''
+memory and time step report of the column store (column_store=True)
+against the float64 population matrix, for several population sizes.
+
+run with: python bench_columns.py
+'''
+
+import contextlib
+import io
+import time
+
+import numpy as np
+
+from config import Configuration
+from simulation import tstep
+from society import Society
+from stratifiedPopulation import Stratified_Population
+from tracker import Population_trackers
+from virusLethal import Virus_Lethal
+
+
+def run_steps(pop_size, column_store, steps=10, infected_fraction=0.05):
+    '''returns the population size in bytes, the mean duration of a time step
+    and of a scan of the state column, both in seconds'''
+    np.random.seed(100)
+    config = Configuration(visualise = False, verbose = False, infection_backend = 'grid',
+                           frame = 2)
+    pop = Stratified_Population(pop_size = pop_size, column_store = column_store)
+    pop.initialize_population_matrix()
+    pop.initialize_destination_matrix(total_destinations = 1)
+    #start from an ongoing outbreak
+    pop.set_state(np.arange(int(pop_size * infected_fraction)), 1)
+    vir = Virus_Lethal()
+    soc = Society()
+    pop_tracker = Population_trackers()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for i in range(steps):
+            tstep(config, vir, pop, pop_tracker, soc, None, None, None, None)
+        step = (time.perf_counter() - start) / steps
+
+    start = time.perf_counter()
+    for i in range(steps):
+        np.count_nonzero(pop.population[:,6] == 1)
+    scan = (time.perf_counter() - start) / steps
+
+    return pop.population.nbytes, step, scan
+
+
+if __name__ == '__main__':
+    print('%10s %8s %14s %14s %14s' %('pop_size', 'store', 'bytes/person', 'tstep (ms)', 'scan (ms)'))
+    for pop_size in [10000, 100000]:
+        for column_store in [False, True]:
+            nbytes, step, scan = run_steps(pop_size, column_store)
+            print('%10i %8s %14.1f %14.2f %14.3f' %(pop_size, 'columns' if column_store else 'matrix',
+                                                    nbytes / pop_size, step * 1000, scan * 1000))
@@ -0,0 +1,49 @@
+'''
+import time budget check of the command line entry point (run_model)
+
+Imports run_model in a fresh interpreter, reports the import time and
+fails (exit code 1) if it is over budget, or if matplotlib, numba or
+scipy were imported by a headless run.
+
+run with: python bench_import.py [budget in seconds]
+'''
+
+import subprocess
+import sys
+
+#modules that may only be imported when they are used
+LAZY_MODULES = ['matplotlib', 'numba', 'scipy']
+
+CHECK = '''
+import sys, time
+start = time.perf_counter()
+import run_model
+duration = time.perf_counter() - start
+print(duration)
+print(' '.join(module for module in %r if module in sys.modules))
+''' %(LAZY_MODULES,)
+
+
+def import_time(repeats=5):
+    '''returns the fastest import time of run_model and the lazy modules it imported'''
+    durations = []
+    for i in range(repeats):
+        output = subprocess.run([sys.executable, '-c', CHECK], capture_output = True,
+                                text = True, check = True).stdout.split('\n')
+        durations.append(float(output[0]))
+    return min(durations), output[1].split()
+
+
+if __name__ == '__main__':
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 0.25
+    duration, imported = import_time()
+    print('import run_model: %.3f s (budget %.3f s)' %(duration, budget))
+
+    failed = False
+    if duration > budget:
+        print('over budget!')
+        failed = True
+    if len(imported) > 0:
+        print('imported at start up: %s' %', '.join(imported))
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,57 @@
+'''
+speedup report of the numba kernels (Configuration(use_numba=True))
+against the NumPy code, for several population sizes.
+
+run with: python bench_jit.py
+'''
+
+import contextlib
+import io
+import time
+
+import numpy as np
+
+import jit
+from config import Configuration
+from simulation import tstep
+from society import Society
+from stratifiedPopulation import Stratified_Population
+from tracker import Population_trackers
+from virusLethal import Virus_Lethal
+
+
+def time_steps(pop_size, use_numba, steps=20, infected_fraction=0.05):
+    '''returns the mean duration of a time step in seconds'''
+    np.random.seed(100)
+    config = Configuration(visualise = False, verbose = False, infection_backend = 'grid',
+                           use_numba = use_numba, frame = 2)
+    pop = Stratified_Population(pop_size = pop_size)
+    pop.initialize_population_matrix()
+    pop.initialize_destination_matrix(total_destinations = 1)
+    #start from an ongoing outbreak
+    pop.population[:int(pop_size * infected_fraction),6] = 1
+    pop.build_state_index()
+    vir = Virus_Lethal()
+    soc = Society()
+    pop_tracker = Population_trackers()
+
+    #first step compiles the kernels (or loads them from cache)
+    with contextlib.redirect_stdout(io.StringIO()):
+        tstep(config, vir, pop, pop_tracker, soc, None, None, None, None)
+        start = time.perf_counter()
+        for i in range(steps):
+            tstep(config, vir, pop, pop_tracker, soc, None, None, None, None)
+
+    return (time.perf_counter() - start) / steps
+
+
+if __name__ == '__main__':
+    if not jit.NUMBA_AVAILABLE:
+        print('numba is not installed, nothing to compare')
+    else:
+        print('%10s %12s %12s %8s' %('pop_size', 'numpy (ms)', 'numba (ms)', 'speedup'))
+        for pop_size in [1000, 10000, 100000]:
+            numpy_step = time_steps(pop_size, use_numba = False)
+            numba_step = time_steps(pop_size, use_numba = True)
+            print('%10i %12.2f %12.2f %7.1fx' %(pop_size, numpy_step * 1000,
+                                                 numba_step * 1000, numpy_step / numba_step))
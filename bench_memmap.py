@@ -0,0 +1,33 @@
+'''
+initialization time and peak memory of a memory mapped population
+(Population(memmap_path=...)), that is generated chunk by chunk.
+
+run with: python bench_memmap.py [pop_size] [path]
+'''
+
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+from stratifiedPopulation import Stratified_Population
+
+
+if __name__ == '__main__':
+    pop_size = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    path = sys.argv[2] if len(sys.argv) > 2 else 'pop_data/population_memmap.npy'
+    os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+
+    np.random.seed(100)
+    pop = Stratified_Population(pop_size = pop_size, memmap_path = path)
+    start = time.perf_counter()
+    pop.initialize_population_matrix()
+    duration = time.perf_counter() - start
+
+    #ru_maxrss is in kilobytes on linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print('%i people initialized in %.1f s' %(pop_size, duration))
+    #resident memory includes pages of the mapped file, which can be evicted when memory is short
+    print('population file: %.0f MB, peak resident memory: %.0f MB' %(os.path.getsize(path) / 2**20, peak))
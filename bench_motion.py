@@ -0,0 +1,66 @@
+'''
+benchmark of the memory allocated by the motion part of a time step,
+comparing the separate out_of_bounds, update_randoms and update_positions
+calls with the preallocated Motion_Stage.
+
+run with: python bench_motion.py
+'''
+
+import time
+import tracemalloc
+
+import numpy as np
+
+from motion import Motion_Stage, out_of_bounds, update_positions, update_randoms
+from population import Population
+
+xbounds = [0.02 + 0.02, 0.498 - 0.02]
+ybounds = [0.02 + 0.02, 0.498 - 0.02]
+
+
+def separate_calls(pop):
+    '''motion as done in tstep before Motion_Stage'''
+    population = pop.population
+    if len(population[:,11] == 0) > 0:
+        _xbounds = np.array([xbounds] * len(population[population[:,11] == 0]))
+        _ybounds = np.array([ybounds] * len(population[population[:,11] == 0]))
+        population[population[:,11] == 0] = out_of_bounds(population[population[:,11] == 0],
+                                                          _xbounds, _ybounds)
+    population = update_randoms(population, pop.pop_size, pop.speed)
+    population[:,3:5][population[:,6] == 3] = 0
+    pop.population = update_positions(population)
+
+
+def motion_stage(pop):
+    pop.population = pop.motion_stage.update(pop.population, xbounds, ybounds, pop.speed)
+
+
+def measure(step, pop, steps=5):
+    '''returns (MB allocated per step, peak MB during a step, ms per step)'''
+    step(pop) #warm up
+    tracemalloc.start()
+    allocated = 0
+    peak = 0
+    start = time.perf_counter()
+    for i in range(steps):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        step(pop)
+        current, step_peak = tracemalloc.get_traced_memory()
+        allocated += step_peak - before
+        peak = max(peak, step_peak - before)
+    duration = (time.perf_counter() - start) / steps
+    tracemalloc.stop()
+    return allocated / steps / 1e6, peak / 1e6, duration * 1000
+
+
+if __name__ == '__main__':
+    print('%10s %-16s %14s %10s' %('pop_size', 'motion', 'MB per step', 'ms'))
+    for pop_size in [10000, 1000000]:
+        for name, step in [('separate calls', separate_calls), ('Motion_Stage', motion_stage)]:
+            np.random.seed(100)
+            pop = Population(pop_size = pop_size)
+            pop.initialize_population_matrix()
+            pop.motion_stage = Motion_Stage(pop_size)
+            allocated, peak, duration = measure(step, pop)
+            print('%10i %-16s %14.3f %10.1f' %(pop_size, name, allocated, duration))
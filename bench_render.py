@@ -0,0 +1,73 @@
+'''
+time per drawn frame of the live renderer (visualiser.Live_Renderer,
+artists made once and blitted) against draw_tstep (everything redrawn),
+with the Agg backend, and of the live renderer with a point per person
+against the density image (config.plot_density) for large populations.
+
+run with: python bench_render.py
+'''
+
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+from config import Configuration
+from society import Society
+from stratifiedPopulation import Stratified_Population
+from tracker import Population_trackers
+from visualiser import Live_Renderer, build_fig, draw_tstep
+
+
+def setup(pop_size):
+    np.random.seed(100)
+    config = Configuration(verbose = False)
+    pop = Stratified_Population(pop_size = pop_size)
+    pop.initialize_population_matrix()
+    pop.initialize_destination_matrix(total_destinations = 1)
+    pop.set_state(np.arange(pop_size // 10), 1)
+    pop_tracker = Population_trackers()
+    for frame in range(200):
+        pop_tracker.update_counts(pop.population, pop.state_index)
+    return config, pop, Society(), pop_tracker
+
+
+def time_draw_tstep(pop_size, frames):
+    config, pop, soc, pop_tracker = setup(pop_size)
+    fig, spec, ax1, ax2 = build_fig(config, pop)
+    start = time.perf_counter()
+    for frame in range(frames):
+        draw_tstep(config, soc, pop_size, pop.population, pop_tracker, frame, fig, spec,
+                   ax1, ax2, state_index = pop.state_index)
+    plt.close(fig)
+    return (time.perf_counter() - start) / frames
+
+
+def time_live(pop_size, frames, density=False):
+    config, pop, soc, pop_tracker = setup(pop_size)
+    config.plot_density = density
+    renderer = Live_Renderer(config, soc, pop)
+    renderer.draw(0, pop.population, pop_tracker, pop.state_index)
+    start = time.perf_counter()
+    for frame in range(frames):
+        pop.population[:,1:3] += 0.001
+        renderer.draw(frame, pop.population, pop_tracker, pop.state_index)
+    plt.close(renderer.fig)
+    return (time.perf_counter() - start) / frames
+
+
+if __name__ == '__main__':
+    print('%10s %16s %16s %8s' %('pop_size', 'draw_tstep (ms)', 'live (ms)', 'speedup'))
+    for pop_size in [1000, 10000]:
+        full = time_draw_tstep(pop_size, 10)
+        live = time_live(pop_size, 50)
+        print('%10i %16.1f %16.1f %8.1f' %(pop_size, full * 1000, live * 1000, full / live))
+
+    print()
+    print('%10s %16s %16s %8s' %('pop_size', 'points (ms)', 'density (ms)', 'speedup'))
+    for pop_size in [100000, 1000000]:
+        points = time_live(pop_size, 5)
+        density = time_live(pop_size, 5, density = True)
+        print('%10i %16.1f %16.1f %8.1f' %(pop_size, points * 1000, density * 1000, points / density))
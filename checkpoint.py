@@ -0,0 +1,210 @@
+'''
+file that contains the checkpoint and restore of the complete state of a
+simulation, so a long run can be resumed after a crash
+
+a checkpoint is one uncompressed .npz file (numpy arrays, read without
+pickle) that holds the population and destination matrices, the recovery
+calendar, the random state of numpy and of the Motion_Stage, the society,
+the tracker history, the event log (if one is recorded) and the frame. It
+is written to a temporary file in
+the same folder and moved over the old checkpoint, so a crash while
+writing never leaves a broken checkpoint behind.
+
+the scenario itself (virus, population parameters, configuration) is not
+stored: a checkpoint is restored into a simulation built from the same
+scenario, after which it continues exactly (bit for bit) as the
+uninterrupted run.
+'''
+
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from columns import Population_columns
+from events import Event_Log
+from motion import Motion_Stage
+
+CHECKPOINT_VERSION = 1
+
+#configuration that changes during a run (set_self_isolation changes the bounds)
+CONFIG_STATE = ['frame', 'tstep', 'xbounds', 'ybounds', 'x_plot', 'y_plot']
+
+
+def _to_json(value):
+    '''converts numpy values in the metadata to their python equivalent'''
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('%s can not be stored in a checkpoint' %type(value))
+
+
+def _pack(groups):
+    '''list of index arrays -> (concatenated indices, sizes)'''
+    sizes = np.array([len(group) for group in groups], dtype=np.int64)
+    if len(groups) == 0:
+        return np.zeros(0, dtype=np.int64), sizes
+    return np.concatenate(groups).astype(np.int64), sizes
+
+
+def _unpack(indices, sizes):
+    '''(concatenated indices, sizes) -> list of index arrays'''
+    return [np.array(group) for group in np.split(indices, np.cumsum(sizes)[:-1])] if len(sizes) > 0 else []
+
+
+def save_checkpoint(simulation, path):
+    '''writes the state of a simulation to path, atomically
+
+    Keyword arguments
+    -----------------
+    simulation : Simulation
+        the simulation to checkpoint, best saved between two frames (as
+        Simulation.step does with config.checkpoint_freq)
+
+    path : str
+        the file to write, numpy adds .npz if it has no extension
+    '''
+    pop = simulation.population
+    soc = simulation.society
+    tracker = simulation.tracker
+    calendar = pop.recovery_calendar
+
+    arrays = {'population' : np.asarray(pop.population)}
+    if getattr(pop, 'destinations', None) is not None:
+        arrays['destinations'] = pop.destinations
+
+    #the recovery calendar, buckets in the order of the heap
+    bucket_frames = []
+    bucket_groups = []
+    for frame in calendar.frames:
+        for group in calendar.buckets[frame]:
+            bucket_frames.append(frame)
+            bucket_groups.append(group)
+    arrays['calendar_heap'] = np.array(calendar.frames, dtype=np.int64)
+    arrays['calendar_bucket_frames'] = np.array(bucket_frames, dtype=np.int64)
+    arrays['calendar_bucket_indices'], arrays['calendar_bucket_sizes'] = _pack(bucket_groups)
+    arrays['calendar_pending_indices'], arrays['calendar_pending_sizes'] = _pack(calendar.pending)
+
+    #numpy's global random state (MT19937)
+    name, keys, position, has_gauss, cached_gaussian = np.random.get_state()
+    arrays['random_keys'] = keys
+
+    arrays['lockdown_vector'] = np.asarray(soc.lockdown_vector, dtype=np.float64)
+    for key in ['susceptible', 'infectious', 'recovered', 'fatalities']:
+        arrays['tracker_%s' %key] = np.array(getattr(tracker, key), dtype=np.int64)
+
+    #the event log, so a resumed run saves the log of the whole run
+    recorder = pop.recorder
+    if recorder is not None and recorder.initial is not None:
+        for key, array in recorder.arrays().items():
+            arrays['event_log_%s' %key] = array
+
+    stage = pop.motion_stage
+    meta = {'version' : CHECKPOINT_VERSION,
+            'pop_size' : pop.pop_size,
+            'speed' : pop.speed,
+            'calendar_initialized' : calendar.initialized,
+            'random' : [name, position, has_gauss, cached_gaussian],
+            'motion_stage' : None if stage is None else {'pop_size' : stage.pop_size,
+                                                        'chunk_size' : stage.chunk_size,
+                                                        'rng' : stage.rng.bit_generator.state},
+            'society' : {key : getattr(soc, key) for key in soc.__slots__
+                         if key != 'lockdown_vector'},
+            'lockdown_vector_is_list' : isinstance(soc.lockdown_vector, list),
+            'tracker_reinfect' : tracker.reinfect,
+            'config' : {key : getattr(simulation.config, key) for key in CONFIG_STATE}}
+    arrays['meta'] = np.array(json.dumps(meta, default = _to_json))
+
+    #write next to the old checkpoint and swap, so there is always a complete one
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok = True)
+    handle, temporary = tempfile.mkstemp(dir = folder, suffix = '.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def load_checkpoint(simulation, path):
+    '''restores the state saved by save_checkpoint into a simulation
+
+    Keyword arguments
+    -----------------
+    simulation : Simulation
+        a simulation built from the same scenario as the checkpointed one,
+        its population matrix needs to be initialized (the matrix type,
+        memmap or column store, is kept)
+
+    path : str
+        the checkpoint file
+    '''
+    pop = simulation.population
+    soc = simulation.society
+    tracker = simulation.tracker
+    calendar = pop.recovery_calendar
+
+    with np.load(path, allow_pickle = False) as checkpoint:
+        meta = json.loads(str(checkpoint['meta']))
+        if meta['version'] != CHECKPOINT_VERSION:
+            raise ValueError('checkpoint version %s not understood! Expected %i'
+                             %(meta['version'], CHECKPOINT_VERSION))
+        if meta['pop_size'] != pop.pop_size:
+            raise ValueError('checkpoint of %i people does not match the population of %i'
+                             %(meta['pop_size'], pop.pop_size))
+
+        #population, in the matrix type of the simulation
+        population = checkpoint['population']
+        if isinstance(pop.population, Population_columns):
+            pop.population = Population_columns.from_matrix(population)
+        elif isinstance(pop.population, np.memmap):
+            pop.population[:] = population
+            pop.population.flush()
+        else:
+            pop.population = population
+        if 'destinations' in checkpoint:
+            pop.destinations = checkpoint['destinations']
+        pop.speed = meta['speed']
+        pop.build_state_index()
+
+        #recovery calendar
+        calendar.buckets = {}
+        groups = _unpack(checkpoint['calendar_bucket_indices'], checkpoint['calendar_bucket_sizes'])
+        for frame, group in zip(checkpoint['calendar_bucket_frames'].tolist(), groups):
+            calendar.buckets.setdefault(frame, []).append(group)
+        calendar.frames = checkpoint['calendar_heap'].tolist()
+        calendar.pending = _unpack(checkpoint['calendar_pending_indices'],
+                                   checkpoint['calendar_pending_sizes'])
+        calendar.initialized = meta['calendar_initialized']
+
+        #random states
+        name, position, has_gauss, cached_gaussian = meta['random']
+        np.random.set_state((name, checkpoint['random_keys'], position, has_gauss, cached_gaussian))
+        stage = meta['motion_stage']
+        if stage is None:
+            pop.motion_stage = None
+        else:
+            pop.motion_stage = Motion_Stage(stage['pop_size'], seed = 0, chunk_size = stage['chunk_size'])
+            pop.motion_stage.rng.bit_generator.state = stage['rng']
+
+        #society
+        for key, value in meta['society'].items():
+            setattr(soc, key, value)
+        lockdown_vector = checkpoint['lockdown_vector']
+        soc.lockdown_vector = lockdown_vector.tolist() if meta['lockdown_vector_is_list'] else lockdown_vector
+
+        #tracker and configuration
+        for key in ['susceptible', 'infectious', 'recovered', 'fatalities']:
+            setattr(tracker, key, checkpoint['tracker_%s' %key].tolist())
+        tracker.reinfect = meta['tracker_reinfect']
+        if 'event_log_settings' in checkpoint:
+            pop.recorder = Event_Log.from_arrays({key[len('event_log_'):] : checkpoint[key]
+                                                  for key in checkpoint.files if key.startswith('event_log_')})
+        for key, value in meta['config'].items():
+            setattr(simulation.config, key, value)
@@ -14,7 +14,18 @@ class Configuration():
         'save_pop', #whether to save population matrix every 'save_pop_freq' timesteps
         'save_pop_freq', #population data will be saved every 'n' timesteps. Default: 10
         'save_pop_folder',#folder to write population timestep data to
+        'background_io', #whether saved populations, plots and data are written by a background thread (see writer.py)
+        'io_queue_size', #number of writes that can wait for the background thread before the simulation waits
+        'save_pop_format', #'trajectory': append to save_pop_folder/trajectory.bin (see trajectory.py), 'npy': a population_<frame>.npy per frame
         'endif_no_infections' ,#whether to stop simulation if no infections remain             
+        'infection_backend', #how contacts are found: 'naive' (box scan per patient), 'grid' (cell list) or 'tree' (kd-tree, needs scipy)
+        'infection_shape', #shape of the infection zone: 'square' or 'circle'
+        'schedule_recoveries', #whether to schedule recoveries in a calendar queue at infection time, in stead of checking all infected every step
+        'use_numba', #whether to run motion, infection and recovery as numba kernels (falls back to numpy if numba is absent)
+        'checkpoint_freq', #the full simulation state is checkpointed every 'n' timesteps, 0 for never
+        'checkpoint_path', #file the checkpoint is written to (see checkpoint.py)
+        'event_log_path', #if set, infections, recoveries, deaths and destination changes are logged and saved to this .npz file (see events.py)
+        'event_keyframe_freq', #coordinates are added to the event log every 'n' timesteps
 
         #world variables, defines where population can and cannot roam
         'xbounds', 
@@ -33,6 +44,9 @@ class Configuration():
         #if colorblind is enabled, set type of colorblindness
         #available: deuteranopia, protanopia, tritanopia. defauld=deuteranopia
         'colorblind_type',
+        'plot_density', #draw the people as a density image per state in stead of a point each (large populations)
+        'density_bins', #number of bins of the density image along each axis
+        'density_sample', #number of people that are also drawn as points over the density image
         'frame']
     
     def __init__(self, 
@@ -43,7 +57,18 @@ class Configuration():
         save_pop = False, 
         save_pop_freq = 10, 
         save_pop_folder = 'pop_data/' ,
+        save_pop_format = 'trajectory',
+        background_io = True,
+        io_queue_size = 8,
         endif_no_infections = True, 
+        infection_backend = 'naive',
+        infection_shape = 'square',
+        schedule_recoveries = False,
+        use_numba = False,
+        checkpoint_freq = 0,
+        checkpoint_path = 'checkpoint.npz',
+        event_log_path = None,
+        event_keyframe_freq = 100,
         xbounds = [0.02, 0.498],
         ybounds = [0.02, 0.498],
         visualise = True ,
@@ -55,6 +80,9 @@ class Configuration():
         plot_style = 'default' ,
         colorblind_mode = False,
         colorblind_type = 'deuteranopia',
+        plot_density = False,
+        density_bins = 200,
+        density_sample = 0,
         frame = 0):
         
         
@@ -66,7 +94,18 @@ class Configuration():
         self.save_pop = save_pop 
         self.save_pop_freq = save_pop_freq
         self.save_pop_folder = save_pop_folder
+        self.save_pop_format = save_pop_format
+        self.background_io = background_io
+        self.io_queue_size = io_queue_size
         self.endif_no_infections =endif_no_infections 
+        self.infection_backend = infection_backend
+        self.infection_shape = infection_shape
+        self.schedule_recoveries = schedule_recoveries
+        self.use_numba = use_numba
+        self.checkpoint_freq = checkpoint_freq
+        self.checkpoint_path = checkpoint_path
+        self.event_log_path = event_log_path
+        self.event_keyframe_freq = event_keyframe_freq
 
         self.xbounds = xbounds
         self.ybounds = ybounds
@@ -79,6 +118,9 @@ class Configuration():
         self.plot_style = plot_style
         self.colorblind_mode = colorblind_mode
         self.colorblind_type = colorblind_type
+        self.plot_density = plot_density
+        self.density_bins = density_bins
+        self.density_sample = density_sample
         self.frame = frame
         
         
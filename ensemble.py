@@ -0,0 +1,275 @@
+'''
+file that contains the streaming aggregator of ensemble output: per
+frame statistics over many runs (replicates) of a simulation, in memory
+that does not grow with the number of runs
+'''
+
+import numpy as np
+
+
+class Quantile_Sketch():
+    __slots__ = ['gamma',
+                 'offset',
+                 'counts',
+                 'zeros']
+
+    '''mergeable quantile sketch of a value per frame (DDSketch)
+
+    Positive values are counted in logarithmic bins: bin k holds the values
+    in (gamma^(k-1), gamma^k], with gamma = (1 + accuracy) / (1 - accuracy),
+    so every quantile is returned with a relative error of at most accuracy.
+    Values of zero and below are counted separately. The bins of all frames
+    are kept in one (frames, bins) array, that grows when new bins are used.
+    '''
+    def __init__(self, frames=0, accuracy=0.01):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.offset = 0 #bin number of the first column of counts
+        self.counts = np.zeros((frames, 0), dtype=np.int64)
+        self.zeros = np.zeros(frames, dtype=np.int64)
+
+    def _bins(self, values):
+        return np.ceil(np.log(values) / np.log(self.gamma)).astype(np.int64)
+
+    def _fit(self, low, high):
+        '''makes room for bins low to high (inclusive)'''
+        if self.counts.shape[1] == 0:
+            self.offset = low
+        first = min(low, self.offset)
+        last = max(high, self.offset + self.counts.shape[1] - 1)
+        if first == self.offset and last == self.offset + self.counts.shape[1] - 1:
+            return
+        counts = np.zeros((len(self.counts), last - first + 1), dtype=np.int64)
+        start = self.offset - first
+        counts[:,start:start + self.counts.shape[1]] = self.counts
+        self.counts, self.offset = counts, first
+
+    def resize(self, frames, row=None):
+        '''adds frames, with the counts of row (an other sketch of one frame) or empty'''
+        new = frames - len(self.counts)
+        if new <= 0:
+            return
+        if row is not None and row.counts.shape[1] > 0:
+            self._fit(row.offset, row.offset + row.counts.shape[1] - 1)
+        self.counts = np.concatenate((self.counts, np.zeros((new, self.counts.shape[1]), dtype=np.int64)))
+        self.zeros = np.concatenate((self.zeros, np.zeros(new, dtype=np.int64)))
+        if row is not None:
+            start = row.offset - self.offset
+            self.counts[-new:,start:start + row.counts.shape[1]] = row.counts[0]
+            self.zeros[-new:] = row.zeros[0]
+
+    def add(self, values, frames=None):
+        '''adds one value to each of the frames (default: the first len(values) frames)'''
+        values = np.asarray(values, dtype=np.float64)
+        if frames is None:
+            frames = np.arange(len(values))
+        positive = values > 0
+        self.zeros[frames[~positive]] += 1
+        if not positive.any():
+            return
+        bins = self._bins(values[positive])
+        self._fit(bins.min(), bins.max())
+        np.add.at(self.counts, (frames[positive], bins - self.offset), 1)
+
+    def merge(self, other):
+        '''adds the counts of other, that has the same number of frames'''
+        if other.counts.shape[1] > 0:
+            self._fit(other.offset, other.offset + other.counts.shape[1] - 1)
+            start = other.offset - self.offset
+            self.counts[:,start:start + other.counts.shape[1]] += other.counts
+        self.zeros += other.zeros
+
+    def copy(self):
+        sketch = Quantile_Sketch(0)
+        sketch.gamma = self.gamma
+        sketch.offset = self.offset
+        sketch.counts = self.counts.copy()
+        sketch.zeros = self.zeros.copy()
+        return sketch
+
+    def _value(self, frame, rank):
+        '''the value with the given (0 based) rank in frame'''
+        if rank < self.zeros[frame]:
+            return 0
+        k = np.searchsorted(np.cumsum(self.counts[frame]), rank - self.zeros[frame], side='right')
+        #midpoint of the bin, within the relative accuracy of every value in it
+        return 2 * self.gamma ** (self.offset + k) / (self.gamma + 1)
+
+    def quantile(self, q):
+        '''the q-th quantile (0 to 1) of every frame, nan for frames without values
+
+        Interpolates linearly between the values of the neighbouring ranks,
+        like np.quantile.
+        '''
+        totals = self.zeros + self.counts.sum(axis=1)
+        result = np.full(len(totals), np.nan)
+        for frame in np.flatnonzero(totals):
+            rank = q * (totals[frame] - 1)
+            lower = self._value(frame, np.floor(rank))
+            upper = self._value(frame, np.ceil(rank))
+            result[frame] = lower + (rank - np.floor(rank)) * (upper - lower)
+        return result
+
+
+class Ensemble_Aggregator():
+    __slots__ = ['padding',
+                 'count',
+                 'mean',
+                 'm2',
+                 'minimum',
+                 'maximum',
+                 'sketch',
+                 'tail']
+
+    '''streaming per frame statistics of the time series of many runs
+
+    Keeps per frame the count, running mean and variance (Welford), min,
+    max and a quantile sketch, so memory is O(frames) no matter how many
+    runs are added. Aggregators can be merged, so workers can aggregate
+    their own runs and a reducer merges the results.
+
+    Runs can have different lengths (for example when endif_no_infections
+    ends a run early). With padding None a frame only aggregates the runs
+    that reached it. With padding 'zero' or 'last' a run counts in every
+    frame, after its end with zero or with its last value. The pad values of
+    all runs are aggregated in 'tail' (an aggregator of one frame), which
+    initializes the frames added by longer runs later on.
+
+    With accuracy None no quantile sketch is kept (the sketch holds a
+    row of bins per frame, much more than the other statistics), for
+    aggregates of which only the mean, variance, min and max are used.
+    '''
+    def __init__(self, padding=None, accuracy=0.01):
+        '''
+        Keyword arguments
+        -----------------
+        padding : None or str
+            how frames after the end of a run count: None (not), 'zero' or 'last'
+
+        accuracy : float or None
+            relative accuracy of the quantiles, see Quantile_Sketch, or None
+            to keep no quantiles
+        '''
+        if padding not in [None, 'zero', 'last']:
+            raise ValueError('padding %s not understood! Must be None, \'zero\' or \'last\'' %padding)
+        self.padding = padding
+        self.count = np.zeros(0, dtype=np.int64)
+        self.mean = np.zeros(0)
+        self.m2 = np.zeros(0)
+        self.minimum = np.zeros(0)
+        self.maximum = np.zeros(0)
+        self.sketch = None if accuracy is None else Quantile_Sketch(0, accuracy)
+        self.tail = None
+        if padding is not None:
+            self.tail = Ensemble_Aggregator(None, accuracy)
+            self.tail.resize(1)
+
+    def __len__(self):
+        return len(self.count)
+
+    def resize(self, frames):
+        '''adds frames, that start with the statistics of the pad values so far'''
+        new = frames - len(self)
+        if new <= 0:
+            return
+        tail = self.tail
+        if tail is None or tail.count[0] == 0:
+            self.count = np.concatenate((self.count, np.zeros(new, dtype=np.int64)))
+            self.mean = np.concatenate((self.mean, np.zeros(new)))
+            self.m2 = np.concatenate((self.m2, np.zeros(new)))
+            self.minimum = np.concatenate((self.minimum, np.full(new, np.inf)))
+            self.maximum = np.concatenate((self.maximum, np.full(new, -np.inf)))
+            if self.sketch is not None:
+                self.sketch.resize(frames)
+        else:
+            self.count = np.concatenate((self.count, np.repeat(tail.count, new)))
+            self.mean = np.concatenate((self.mean, np.repeat(tail.mean, new)))
+            self.m2 = np.concatenate((self.m2, np.repeat(tail.m2, new)))
+            self.minimum = np.concatenate((self.minimum, np.repeat(tail.minimum, new)))
+            self.maximum = np.concatenate((self.maximum, np.repeat(tail.maximum, new)))
+            if self.sketch is not None:
+                self.sketch.resize(frames, tail.sketch)
+
+    def _update(self, frames, values):
+        '''adds one value to each of frames (Welford)'''
+        self.count[frames] += 1
+        delta = values - self.mean[frames]
+        self.mean[frames] += delta / self.count[frames]
+        self.m2[frames] += delta * (values - self.mean[frames])
+        self.minimum[frames] = np.minimum(self.minimum[frames], values)
+        self.maximum[frames] = np.maximum(self.maximum[frames], values)
+        if self.sketch is not None:
+            self.sketch.add(values, frames)
+
+    def add(self, series):
+        '''adds the time series of one run'''
+        series = np.asarray(series, dtype=np.float64)
+        if len(series) > len(self):
+            self.resize(len(series))
+        self._update(np.arange(len(series)), series)
+
+        if self.padding is not None:
+            pad = 0.0 if (self.padding == 'zero' or len(series) == 0) else series[-1]
+            frames = np.arange(len(series), len(self))
+            self._update(frames, np.full(len(frames), pad))
+            self.tail._update(np.zeros(1, dtype=np.int64), np.full(1, pad))
+
+    def merge(self, other):
+        '''adds the statistics of other (Chan et al.), which needs the same padding'''
+        if other.padding != self.padding:
+            raise ValueError('can not merge aggregators with padding %s and %s' %(self.padding, other.padding))
+        if (self.sketch is None) != (other.sketch is None):
+            raise ValueError('can not merge an aggregator with quantiles and one without (accuracy None)')
+        frames = max(len(self), len(other))
+        self.resize(frames)
+        other_count, other_mean, other_m2 = other.count, other.mean, other.m2
+        other_minimum, other_maximum, other_sketch = other.minimum, other.maximum, other.sketch
+        if len(other) < frames:
+            #extend a copy of other in stead of changing it
+            other = other.copy()
+            other.resize(frames)
+            other_count, other_mean, other_m2 = other.count, other.mean, other.m2
+            other_minimum, other_maximum, other_sketch = other.minimum, other.maximum, other.sketch
+
+        count = self.count + other_count
+        delta = other_mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(count > 0, other_count / count, 0)
+        self.mean = self.mean + delta * weight
+        self.m2 = self.m2 + other_m2 + delta ** 2 * self.count * weight
+        self.count = count
+        self.minimum = np.minimum(self.minimum, other_minimum)
+        self.maximum = np.maximum(self.maximum, other_maximum)
+        if self.sketch is not None:
+            self.sketch.merge(other_sketch)
+
+        if self.tail is not None:
+            self.tail.merge(other.tail)
+
+    def copy(self):
+        aggregator = Ensemble_Aggregator(self.padding)
+        aggregator.count = self.count.copy()
+        aggregator.mean = self.mean.copy()
+        aggregator.m2 = self.m2.copy()
+        aggregator.minimum = self.minimum.copy()
+        aggregator.maximum = self.maximum.copy()
+        aggregator.sketch = None if self.sketch is None else self.sketch.copy()
+        aggregator.tail = None if self.tail is None else self.tail.copy()
+        return aggregator
+
+    def variance(self):
+        '''sample variance per frame, nan for frames with less than two runs'''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, self.m2 / (self.count - 1), np.nan)
+
+    def std(self):
+        '''sample standard deviation per frame'''
+        return np.sqrt(self.variance())
+
+    def quantile(self, q):
+        '''the q-th quantile (0 to 1) per frame, see Quantile_Sketch'''
+        if self.sketch is None:
+            raise ValueError('quantile not understood! This aggregator keeps no quantiles (accuracy None)')
+        return self.sketch.quantile(q)
+
+    def median(self):
+        return self.quantile(0.5)
@@ -0,0 +1,182 @@
+'''
+file that contains the event log of a simulation: in stead of saving the
+population every frame (config.save_pop), only the changes that matter
+are recorded, as events of (frame, person, column, new value, infector):
+
+    6 state: infected, recovered (immune), died
+    10 in treatment: admitted and discharged
+    11 active destination: sent to a location and back
+    12 at destination: arrived and left
+
+together with the discrete columns at the start of the log and keyframes
+of the coordinates every keyframe_freq frames. Events are recorded by the
+transition methods of Population (set_state, set_treatment,
+set_active_destination and set_at_destination), so all code that changes
+these columns through them is logged. The state at any frame is rebuilt
+with Event_Log.reconstruct.
+'''
+
+import numpy as np
+
+EVENT_TYPE = np.dtype([('frame', np.int32),
+                       ('agent', np.int32),
+                       ('column', np.int8),
+                       ('value', np.int8),
+                       ('infector', np.int32)])
+
+#discrete columns of the population matrix that are logged
+EVENT_COLUMNS = [6, 10, 11, 12]
+
+
+class Event_Log():
+    __slots__ = ['keyframe_freq',
+                 'frame',
+                 'events',
+                 'size',
+                 'initial_frame',
+                 'initial',
+                 'infected_since',
+                 'keyframe_frames',
+                 'keyframes']
+
+    '''recorder of the epidemic events of a simulation, see the module doc
+
+    Set as pop.recorder (Simulation does this when config.event_log_path is
+    set). begin_frame is called at the start of every frame, it sets the
+    frame of the events that follow and takes the keyframes. Events are kept
+    in a growable array of EVENT_TYPE (14 bytes per event).
+    '''
+    def __init__(self, keyframe_freq=100):
+        '''
+        Keyword arguments
+        -----------------
+        keyframe_freq : int
+            the coordinates are saved every keyframe_freq frames
+        '''
+        self.keyframe_freq = keyframe_freq
+        self.frame = 0
+        self.events = np.zeros(1024, dtype=EVENT_TYPE)
+        self.size = 0
+        self.initial_frame = None
+        self.initial = None #discrete columns and infected_since when the log started
+        self.infected_since = None
+        self.keyframe_frames = []
+        self.keyframes = [] #(x, y) as float32 per keyframe
+
+    def __len__(self):
+        return self.size
+
+    def begin_frame(self, frame, population):
+        '''sets the frame of the next events, takes a keyframe if one is due'''
+        self.frame = frame
+        if self.initial is None:
+            self.initial_frame = frame
+            self.initial = np.stack([population[:,column] for column in EVENT_COLUMNS], axis=1).astype(np.int8)
+            self.infected_since = np.asarray(population[:,8], dtype=np.int32)
+        if (frame - self.initial_frame) % self.keyframe_freq == 0:
+            self.keyframe_frames.append(frame)
+            self.keyframes.append(np.stack((population[:,1], population[:,2]), axis=1).astype(np.float32))
+
+    def record(self, agents, column, value, infectors=None):
+        '''appends an event per agent: column changed to value
+
+        Keyword arguments
+        -----------------
+        agents : ndarray
+            indices of the people whose column changed
+
+        column : int
+            the column that changed (one of EVENT_COLUMNS)
+
+        value : int
+            the new value
+
+        infectors : ndarray
+            for infections, the person that infected each agent, -1 if unknown
+        '''
+        count = len(agents)
+        if count == 0 or self.initial is None:
+            return
+        if self.size + count > len(self.events):
+            grown = np.zeros(max(2 * len(self.events), self.size + count), dtype=EVENT_TYPE)
+            grown[:self.size] = self.events[:self.size]
+            self.events = grown
+        events = self.events[self.size:self.size + count]
+        events['frame'] = self.frame
+        events['agent'] = agents
+        events['column'] = column
+        events['value'] = value
+        events['infector'] = -1 if infectors is None else infectors
+        self.size += count
+
+    def infections(self):
+        '''the infection events: frame, agent and infector'''
+        events = self.events[:self.size]
+        return events[(events['column'] == 6) & (events['value'] == 1)]
+
+    def reconstruct(self, frame):
+        '''rebuilds the population at the end of frame
+
+        Returns a population matrix with the logged columns (6, 10, 11, 12)
+        and the id (0) of that frame, infected_since (8) as the frame of the
+        last infection event, and the coordinates (1, 2) of the last keyframe
+        at or before it. Other columns are zero.
+        '''
+        if self.initial is None or frame < self.initial_frame:
+            raise ValueError('frame %i not understood! The log starts at frame %s' %(frame, self.initial_frame))
+        pop_size = len(self.initial)
+        population = np.zeros((pop_size, 15))
+        population[:,0] = np.arange(pop_size)
+        population[:,EVENT_COLUMNS] = self.initial
+        population[:,8] = self.infected_since
+
+        #replay the events: the last change of each person per column counts
+        events = self.events[:self.size]
+        events = events[events['frame'] <= frame][::-1]
+        for column in EVENT_COLUMNS:
+            changes = events[events['column'] == column]
+            agents, last = np.unique(changes['agent'], return_index = True)
+            population[agents,column] = changes['value'][last]
+        infections = events[(events['column'] == 6) & (events['value'] == 1)]
+        agents, last = np.unique(infections['agent'], return_index = True)
+        population[agents,8] = infections['frame'][last]
+
+        keyframe = np.searchsorted(self.keyframe_frames, frame, side='right') - 1
+        population[:,1:3] = self.keyframes[keyframe]
+        return population
+
+    def arrays(self):
+        '''the log as a dict of arrays, for save and for checkpoints (see checkpoint.py)'''
+        if self.initial is None:
+            raise ValueError('event log not understood! It has not started, see begin_frame')
+        return {'events' : self.events[:self.size],
+                'initial' : self.initial,
+                'infected_since' : self.infected_since,
+                'keyframe_frames' : np.array(self.keyframe_frames, dtype=np.int64),
+                'keyframes' : np.array(self.keyframes, dtype=np.float32),
+                'settings' : np.array([self.keyframe_freq, self.initial_frame, self.frame])}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''rebuilds a log from the dict of arrays of arrays()'''
+        keyframe_freq, initial_frame, frame = arrays['settings'].tolist()
+        log = cls(keyframe_freq)
+        log.events = np.array(arrays['events'])
+        log.size = len(log.events)
+        log.initial_frame = initial_frame
+        log.frame = frame
+        log.initial = arrays['initial']
+        log.infected_since = arrays['infected_since']
+        log.keyframe_frames = arrays['keyframe_frames'].tolist()
+        log.keyframes = list(arrays['keyframes'])
+        return log
+
+    def save(self, path):
+        '''writes the log to an (uncompressed) .npz file'''
+        np.savez(path, **self.arrays())
+
+    @classmethod
+    def load(cls, path):
+        '''reads a log written by save'''
+        with np.load(path) as data:
+            return cls.from_arrays(data)
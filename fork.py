@@ -0,0 +1,167 @@
+'''
+file that contains scenario forking: a simulation runs the shared prefix
+of a set of scenarios once (for example the first 300 frames of an
+epidemic), after which it is forked into branches that each continue with
+their own intervention, for example:
+
+    sim = run_model.build_simulation(scenario, report = 'none')
+    sim.run(300)
+    results = fork_branches(sim, [{},
+                                  lambda sim: sim.society.set_lockdown(sim.population),
+                                  {'virus.infection_chance': 0.01}])
+
+on platforms with os.fork the branches run in forked worker processes,
+that get the prefix state from the parent copy-on-write in stead of
+through pickling. Every branch reseeds its random generators from
+(base_seed, branch number), so branches are independent random streams
+and results do not depend on the number of processes. Branches save
+their frames and event log next to those of the prefix, with the branch
+number in the path (see branch_paths).
+'''
+
+import copy
+import multiprocessing
+import os
+
+import numpy as np
+
+from motion import Motion_Stage
+from simulation import Simulation
+
+#(prefix simulation, branches) shared with the forked workers
+_shared = None
+
+
+def branch_seed(base_seed, branch_number):
+    '''deterministic seed of a branch, independent of the order branches are run in'''
+    return int(np.random.SeedSequence([base_seed, branch_number]).generate_state(1)[0])
+
+
+def apply_branch(simulation, branch):
+    '''applies the intervention of a branch to a simulation
+
+    Keyword arguments
+    -----------------
+    simulation : Simulation
+        the simulation to change
+
+    branch : dict or function
+        maps 'section.name' (section is population, society, virus or config)
+        to a new value, for example {'society.self_isolate_proportion': 0.9},
+        or a function that is called with the simulation and changes it
+    '''
+    if callable(branch):
+        branch(simulation)
+        return
+    sections = {'population' : simulation.population, 'society' : simulation.society,
+                'virus' : simulation.virus, 'config' : simulation.config}
+    for key, value in branch.items():
+        section, dot, name = key.partition('.')
+        if not dot or section not in sections:
+            raise ValueError('branch %s not understood! Use SECTION.NAME, with SECTION one of %s'
+                             %(key, ', '.join(sections)))
+        setattr(sections[section], name, value)
+
+
+def branch_paths(config, branch_number):
+    '''gives a branch its own save_pop_folder and event_log_path
+
+    The saved frames go to <save_pop_folder>/branch_<number>/ and the event
+    log to <event_log_path>_branch_<number>.npz, so branches do not write
+    over each other (or over the files of the prefix).
+    '''
+    config.save_pop_folder = os.path.join(config.save_pop_folder, 'branch_%i' %branch_number, '')
+    if config.event_log_path is not None:
+        root, extension = os.path.splitext(config.event_log_path)
+        config.event_log_path = '%s_branch_%i%s' %(root, branch_number, extension or '.npz')
+
+
+def run_branch(simulation, branch, seed, steps, branch_number=0):
+    '''reseeds a (copy of a) prefix simulation, applies the branch and runs it
+
+    The files of the branch are saved to their own paths, see branch_paths.
+    A branch can still set config.save_pop_folder or event_log_path itself.
+
+    Returns
+    -------
+    the last record of the branch (see Simulation.record) and its tracker
+    '''
+    np.random.seed(seed)
+    stage = simulation.population.motion_stage
+    if stage is not None:
+        simulation.population.motion_stage = Motion_Stage(stage.pop_size, chunk_size = stage.chunk_size)
+    #branches would overwrite each other's checkpoints and saved frames
+    simulation.config.checkpoint_freq = 0
+    branch_paths(simulation.config, branch_number)
+    apply_branch(simulation, branch)
+    record = simulation.run(steps)
+    return record, simulation.tracker
+
+
+def _run_forked(task):
+    '''runs a branch in a forked worker, on its copy-on-write copy of the prefix'''
+    branch_number, seed, steps = task
+    simulation, branches = _shared
+    return run_branch(simulation, branches[branch_number], seed, steps, branch_number)
+
+
+def fork_branches(simulation, branches, steps=None, processes=None, base_seed=None):
+    '''runs branches that continue from the current state of a simulation
+
+    The simulation itself is not changed, every branch continues from a
+    copy of its state, without observers (headless).
+
+    Keyword arguments
+    -----------------
+    simulation : Simulation
+        the simulation that ran the shared prefix, its population needs to be
+        in memory (not memmap_path)
+
+    branches : list
+        the intervention of every branch, see apply_branch ({} for none)
+
+    steps : int
+        the number of frames every branch runs, defaults to the frames left
+        until config.simulation_steps. A branch can end earlier, see Simulation.done
+
+    processes : int
+        the number of forked worker processes, defaults to the number of
+        branches. Branches run one after the other in this process with
+        processes=1, or where os.fork is not available
+
+    base_seed : int
+        seed from which the seed of every branch is derived (see branch_seed),
+        drawn from numpy's random generator if not given
+
+    Returns
+    -------
+    list with the last record and the Population_trackers of every branch
+    '''
+    global _shared
+    if isinstance(simulation.population.population, np.memmap):
+        raise ValueError('fork_branches needs a population in memory, memmap_path is not supported')
+    if steps is None:
+        steps = max(simulation.config.simulation_steps - simulation.config.frame, 0)
+    if base_seed is None:
+        base_seed = np.random.randint(0, 2**31 - 1)
+
+    prefix = Simulation(simulation.config, simulation.virus, simulation.population,
+                        simulation.society, simulation.tracker, callback = simulation.callback)
+    tasks = [(b, branch_seed(base_seed, b), steps) for b in range(len(branches))]
+
+    if processes == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        #run_branch reseeds numpy's random generator, of this process here
+        random_state = np.random.get_state()
+        try:
+            return [run_branch(copy.deepcopy(prefix), branches[b], seed, steps, b) for b, seed, steps in tasks]
+        finally:
+            np.random.set_state(random_state)
+
+    #a worker runs one branch and exits, so every branch is forked from the untouched prefix
+    _shared = (prefix, branches)
+    try:
+        with multiprocessing.get_context('fork').Pool(processes or len(branches),
+                                                      maxtasksperchild = 1) as pool:
+            return pool.map(_run_forked, tasks, chunksize = 1)
+    finally:
+        _shared = None
@@ -1,2 +1,224 @@
+'''
+file that contains functions used to find contacts between infected
+and healthy people, so that the virus only has to test those
+'''
 
+import numpy as np
 
+
+class Spatial_Grid():
+    __slots__ = ['cell_size',
+                 'origin',
+                 'shape',
+                 'ids',
+                 'x',
+                 'y',
+                 'cell_starts']
+
+    '''cell list over the x and y coordinates of (part of) the population
+
+    The world is divided in square cells of 'cell_size'. People are sorted
+    by the cell they are in, so that everyone within a box around a point
+    can be found by only looking at the neighbouring cells, in stead of
+    scanning the whole population. The grid is cheap to build and is meant
+    to be rebuilt every time step. build raises cell_size if the grid would
+    get much more cells than people, so a very small cell_size does not
+    allocate a huge, mostly empty grid.
+    '''
+    def __init__(self, cell_size=0.01):
+        self.cell_size = cell_size
+
+    def build(self, x, y, ids):
+        '''sorts the given people into the grid cells
+
+        Keyword arguments
+        -----------------
+        x, y : ndarray
+            the coordinates of the people to put in the grid
+
+        ids : ndarray
+            the indices of these people in the population matrix
+        '''
+        ids = np.asarray(ids, dtype=np.int64)
+
+        if len(ids) == 0:
+            self.origin = (0, 0)
+            self.shape = (1, 1)
+            self.ids = ids
+            self.x = np.zeros(0)
+            self.y = np.zeros(0)
+            self.cell_starts = np.zeros(2, dtype=np.int64)
+            return
+
+        self.origin = (x.min(), y.min())
+        #at most about 4 cells per person (and at least 32 by 32 cells)
+        extent = max(x.max() - self.origin[0], y.max() - self.origin[1])
+        self.cell_size = max(self.cell_size, extent / np.sqrt(4 * len(ids) + 1024))
+        if self.cell_size <= 0:
+            #everyone at the same point, in one cell
+            self.cell_size = 1.0
+        cell_x = np.int64((x - self.origin[0]) // self.cell_size)
+        cell_y = np.int64((y - self.origin[1]) // self.cell_size)
+        self.shape = (cell_x.max() + 1, cell_y.max() + 1)
+
+        keys = cell_x * self.shape[1] + cell_y
+        order = np.argsort(keys, kind='stable')
+        self.ids = ids[order]
+        self.x = x[order]
+        self.y = y[order]
+
+        #start of every cell in the sorted arrays, cell k is [starts[k], starts[k+1])
+        counts = np.bincount(keys, minlength=self.shape[0] * self.shape[1])
+        self.cell_starts = np.concatenate(([0], np.cumsum(counts)))
+
+    def query_box(self, x, y, half_width):
+        '''finds everyone in the grid within a box around each query point
+
+        The box test is the same as the one in Population.find_nearby:
+        (x - half_width) < x_other < (x + half_width), and likewise for y.
+
+        Keyword arguments
+        -----------------
+        x, y : ndarray
+            coordinates of the query points
+
+        half_width : float
+            half the width of the box around each query point
+
+        Returns
+        -------
+        (query, ids) pairs, with query the position of the point in x and y,
+        and ids the index of the person found near it. Pairs are sorted by
+        query first and id second.
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        reach = int(np.ceil(half_width / self.cell_size))
+        query_x = np.int64((x - self.origin[0]) // self.cell_size)
+        query_y = np.int64((y - self.origin[1]) // self.cell_size)
+
+        queries = []
+        found = []
+        for dx in range(-reach, reach + 1):
+            for dy in range(-reach, reach + 1):
+                cell_x = query_x + dx
+                cell_y = query_y + dy
+                q = np.flatnonzero((cell_x >= 0) & (cell_x < self.shape[0]) &
+                                   (cell_y >= 0) & (cell_y < self.shape[1]))
+                keys = cell_x[q] * self.shape[1] + cell_y[q]
+                starts = self.cell_starts[keys]
+                counts = self.cell_starts[keys + 1] - starts
+
+                #expand every (query, cell) into one entry per cell member
+                offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+                queries.append(np.repeat(q, counts))
+                found.append(np.arange(counts.sum()) + offsets)
+
+        queries = np.concatenate(queries)
+        found = np.concatenate(found)
+
+        inside = ((x[queries] - half_width < self.x[found]) &
+                  (self.x[found] < x[queries] + half_width) &
+                  (y[queries] - half_width < self.y[found]) &
+                  (self.y[found] < y[queries] + half_width))
+        queries = queries[inside]
+        ids = self.ids[found[inside]]
+
+        order = np.lexsort((ids, queries))
+        return queries[order], ids[order]
+
+
+def find_contacts(population, sources, targets, infection_range, backend='grid',
+                  shape='square'):
+    '''finds all targets within the infection zone of each source
+
+    With backend 'naive' all targets are scanned once per source, which costs
+    O(sources * N). With backend 'grid' a Spatial_Grid is built over the
+    targets and queried with the sources. With backend 'tree' a cKDTree is
+    built over both and all pairs are found in one bulk query, which keeps its
+    advantage when people are clustered (for example everyone in isolation).
+    Both of these cost about O(N + contacts) per time step.
+
+    Keyword arguments
+    -----------------
+    population : ndarray
+        the array containing all the population information
+
+    sources : ndarray
+        indices of the people at the center of the infection zones
+
+    targets : ndarray
+        indices of the people that can be found within the zones
+
+    infection_range : float
+        half the width of the square infection zone, or the radius of the
+        circular one
+
+    backend : str
+        can be 'naive', 'grid' or 'tree'. The 'tree' backend requires scipy
+
+    shape : str
+        can be 'square' (same zone as Population.find_nearby) or 'circle'
+
+    Returns
+    -------
+    (sources, targets) index pairs, sorted by source first and target second
+    '''
+    if shape not in ('square', 'circle'):
+        raise ValueError('infection zone shape %s not understood! Must be either \'square\' or \'circle\'' %shape)
+    if backend not in ('naive', 'grid', 'tree'):
+        raise ValueError('infection backend %s not understood! Must be \'naive\', \'grid\' or \'tree\'' %backend)
+
+    #an empty zone has no contacts (and a grid can not have cells of size 0)
+    if infection_range <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    if backend in ('naive', 'grid'):
+        if backend == 'naive':
+            #scan all targets once per source
+            x = population[targets,1]
+            y = population[targets,2]
+            found = [targets[(population[source,1] - infection_range < x) &
+                             (x < population[source,1] + infection_range) &
+                             (population[source,2] - infection_range < y) &
+                             (y < population[source,2] + infection_range)] for source in sources]
+            counts = [len(f) for f in found]
+            contacts = np.concatenate(found) if len(found) > 0 else np.zeros(0, dtype=np.int64)
+            sources = np.repeat(sources, counts)
+        else:
+            grid = Spatial_Grid(cell_size = infection_range)
+            grid.build(population[targets,1], population[targets,2], targets)
+            queries, contacts = grid.query_box(population[sources,1], population[sources,2],
+                                               infection_range)
+            sources = sources[queries]
+
+        if shape == 'circle':
+            inside = (((population[sources,1] - population[contacts,1]) ** 2 +
+                       (population[sources,2] - population[contacts,2]) ** 2) < infection_range ** 2)
+            sources, contacts = sources[inside], contacts[inside]
+
+        return sources, contacts
+
+    elif backend == 'tree':
+        #scipy is only imported when the tree backend is used
+        try:
+            from scipy.spatial import cKDTree
+        except ImportError:
+            raise ImportError('the \'tree\' infection backend requires scipy, install it or use \'grid\'')
+
+        if len(sources) == 0 or len(targets) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        source_tree = cKDTree(population[sources,1:3])
+        target_tree = cKDTree(population[targets,1:3])
+        #chebyshev distance (p = inf) gives the square zone, euclidean (p = 2) the circle
+        pairs = source_tree.sparse_distance_matrix(target_tree, infection_range,
+                                                   p = np.inf if shape == 'square' else 2,
+                                                   output_type = 'ndarray')
+        #the tree includes the zone edge, find_nearby does not
+        pairs = pairs[pairs['v'] < infection_range]
+        found_sources = np.asarray(sources, dtype=np.int64)[pairs['i']]
+        contacts = np.asarray(targets, dtype=np.int64)[pairs['j']]
+
+        order = np.lexsort((contacts, found_sources))
+        return found_sources[order], contacts[order]
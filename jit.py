@@ -0,0 +1,272 @@
+'''
+file that contains numba compiled kernels for the hot parts of a
+simulation time step: motion (out_of_bounds, update_randoms and
+update_positions), finding new infections and recovering or dying.
+
+Each kernel is a single loop over the population that runs without
+the GIL, in stead of many small NumPy operations. numba is optional:
+if it is not installed NUMBA_AVAILABLE is False and the simulation
+uses the NumPy code.
+'''
+
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        '''stand-in for numba.njit, kernels stay plain python functions'''
+        def decorator(function):
+            return function
+        return decorator
+
+
+def enabled(config, population=None):
+    '''whether the numba kernels should be used for this simulation
+
+    True if config.use_numba is set and numba is installed, so the
+    simulation falls back to NumPy when numba is absent. The kernels work
+    on the population matrix, so with a column store (Population_columns)
+    the NumPy code is used as well.
+    '''
+    return (config.use_numba and NUMBA_AVAILABLE and
+            (population is None or isinstance(population, np.ndarray)))
+
+
+def new_seed():
+    '''draws a seed for the numba random generator from numpy's global one
+
+    numba keeps its own random state, seeding every kernel call from the
+    global NumPy generator keeps runs reproducible with np.random.seed
+    '''
+    return np.random.randint(0, 2**31 - 1)
+
+
+@njit(nogil=True, cache=True)
+def _update_motion(population, seed, xmin, xmax, ymin, ymax, speed,
+                   update_chance, randomize):
+    np.random.seed(seed)
+
+    for i in range(population.shape[0]):
+        #out of bounds, only for those without a destination
+        if population[i,11] == 0:
+            if population[i,1] <= xmin and population[i,3] < 0:
+                population[i,3] = min(max(np.random.normal(0.5, 0.5 / 3), 0.05), 1)
+            elif population[i,1] >= xmax and population[i,3] > 0:
+                population[i,3] = min(max(-np.random.normal(0.5, 0.5 / 3), -1), -0.05)
+
+            if population[i,2] <= ymin and population[i,4] < 0:
+                population[i,4] = min(max(np.random.normal(0.5, 0.5 / 3), 0.05), 1)
+            elif population[i,2] >= ymax and population[i,4] > 0:
+                population[i,4] = min(max(-np.random.normal(0.5, 0.5 / 3), -1), -0.05)
+
+        #update randoms
+        if randomize:
+            if np.random.random() <= update_chance:
+                population[i,3] = np.random.normal(0, 1 / 3)
+            if np.random.random() <= update_chance:
+                population[i,4] = np.random.normal(0, 1 / 3)
+            if np.random.random() <= update_chance:
+                population[i,5] = np.random.normal(speed, speed / 3)
+            population[i,5] = min(max(population[i,5], 0.0001), 0.05)
+
+        #dead do not move
+        if population[i,6] == 3:
+            population[i,3] = 0
+            population[i,4] = 0
+
+        #update positions
+        population[i,1] = population[i,1] + population[i,3] * population[i,5]
+        population[i,2] = population[i,2] + population[i,4] * population[i,5]
+
+
+def update_motion(population, xbounds, ybounds, speed, randomize=True,
+                  heading_update_chance=0.02):
+    '''fused out_of_bounds, update_randoms and update_positions
+
+    Keyword arguments
+    -----------------
+    population : ndarray
+        the array containing all the population information
+
+    xbounds, ybounds : list or tuple
+        lower and upper bounds of the world [min, max]
+
+    speed : int or float
+        mean speed of population members
+
+    randomize : bool
+        whether to randomly update headings and speeds (False during lockdown)
+
+    heading_update_chance : float
+        the odds of updating heading and speed of each member, each time step
+    '''
+    _update_motion(population, new_seed(), xbounds[0], xbounds[1], ybounds[0], ybounds[1],
+                   speed, heading_update_chance, randomize)
+    return population
+
+
+@njit(nogil=True, cache=True)
+def _build_cells(population, cell_size):
+    n = population.shape[0]
+    xmin = population[:,1].min()
+    ymin = population[:,2].min()
+    ny = np.int64((population[:,2].max() - ymin) // cell_size) + 1
+    nx = np.int64((population[:,1].max() - xmin) // cell_size) + 1
+
+    cells = np.empty(n, dtype=np.int64)
+    starts = np.zeros(nx * ny + 1, dtype=np.int64)
+    for i in range(n):
+        cells[i] = (np.int64((population[i,1] - xmin) // cell_size) * ny +
+                    np.int64((population[i,2] - ymin) // cell_size))
+        starts[cells[i] + 1] += 1
+    for c in range(nx * ny):
+        starts[c + 1] += starts[c]
+
+    #counting sort of everyone by cell
+    members = np.empty(n, dtype=np.int64)
+    fill = starts[:-1].copy()
+    for i in range(n):
+        members[fill[cells[i]]] = i
+        fill[cells[i]] += 1
+
+    return xmin, ymin, nx, ny, starts, members
+
+
+@njit(nogil=True, cache=True)
+def _in_zone(population, i, j, infection_range, circle):
+    dx = population[j,1] - population[i,1]
+    dy = population[j,2] - population[i,2]
+    if circle:
+        return dx * dx + dy * dy < infection_range * infection_range
+    return abs(dx) < infection_range and abs(dy) < infection_range
+
+
+@njit(nogil=True, cache=True)
+def _find_infections(population, seed, infection_range, infection_chance,
+                     traveling_infects, circle):
+    np.random.seed(seed)
+    n = population.shape[0]
+    new_infections = np.empty(n, dtype=np.int64)
+    k = 0
+
+    infected_previous_step = population[:,6] == 1
+    infected_count = infected_previous_step.sum()
+    if infected_count == 0:
+        return new_infections[:0]
+
+    xmin, ymin, nx, ny, starts, members = _build_cells(population, infection_range)
+
+    for i in range(n):
+        #if less than half are infected, loop over patients, else over the healthy
+        if infected_count < (n // 2):
+            if not infected_previous_step[i]:
+                continue
+            if not traveling_infects and population[i,11] != 0:
+                continue
+        elif population[i,6] != 0:
+            continue
+
+        cx = np.int64((population[i,1] - xmin) // infection_range)
+        cy = np.int64((population[i,2] - ymin) // infection_range)
+        infected_nearby = 0
+
+        for ax in range(max(cx - 1, 0), min(cx + 2, nx)):
+            for ay in range(max(cy - 1, 0), min(cy + 2, ny)):
+                cell = ax * ny + ay
+                for m in range(starts[cell], starts[cell + 1]):
+                    j = members[m]
+                    if infected_count < (n // 2):
+                        #roll a die for every healthy contact
+                        if population[j,6] == 0 and _in_zone(population, i, j, infection_range, circle):
+                            if np.random.random() < infection_chance:
+                                population[j,6] = 1
+                                new_infections[k] = j
+                                k += 1
+                    elif infected_previous_step[j] and _in_zone(population, i, j, infection_range, circle):
+                        infected_nearby += 1
+
+        if infected_nearby > 0:
+            #odds of infection scale with the number of infected nearby
+            if np.random.random() < infection_chance * infected_nearby:
+                population[i,6] = 1
+                new_infections[k] = i
+                k += 1
+
+    return new_infections[:k]
+
+
+def find_infections(population, infection_range, infection_chance,
+                    traveling_infects=False, shape='square'):
+    '''finds and marks new infections, see Virus.infect
+
+    Returns
+    -------
+    indices of the newly infected, in order of infection. Their state
+    (column 6) has been set to infected.
+    '''
+    return _find_infections(population, new_seed(), infection_range, infection_chance,
+                            traveling_infects, shape == 'circle')
+
+
+@njit(nogil=True, cache=True)
+def _recover_or_die(population, seed, frame, recovery_start, recovery_range,
+                    mortality_by_age, treatment_dependent_risk, treatment_factor,
+                    no_treatment_factor):
+    np.random.seed(seed)
+    n = population.shape[0]
+    recovered = np.empty(n, dtype=np.int64)
+    fatalities = np.empty(n, dtype=np.int64)
+    r = 0
+    f = 0
+
+    for i in range(n):
+        if population[i,6] != 1:
+            continue
+
+        recovery_odds = max((frame - population[i,8] - recovery_start) / recovery_range, 0)
+        if recovery_odds < population[i,9]:
+            continue
+
+        mortality_chance = mortality_by_age[min(max(np.int64(population[i,7]), 0), len(mortality_by_age) - 1)]
+        if treatment_dependent_risk:
+            if population[i,10] == 0:
+                mortality_chance = mortality_chance * no_treatment_factor
+            elif population[i,10] == 1:
+                mortality_chance = mortality_chance * treatment_factor
+
+        if np.random.random() <= mortality_chance:
+            population[i,6] = 3
+            fatalities[f] = i
+            f += 1
+        else:
+            population[i,6] = 2
+            recovered[r] = i
+            r += 1
+        population[i,10] = 0
+
+    return recovered[:r], fatalities[:f]
+
+
+def recover_or_die(population, frame, recovery_duration, mortality_by_age, soc):
+    '''resolves everyone whose illness ends this frame, see Virus.recover_or_die
+
+    Keyword arguments
+    -----------------
+    mortality_by_age : ndarray
+        mortality chance for every age, as returned by Virus.mortality_by_age
+
+    soc : Society
+        used for the (no) treatment factors
+
+    Returns
+    -------
+    indices of the recovered and of the fatalities
+    '''
+    return _recover_or_die(population, new_seed(), frame, recovery_duration[0],
+                           np.ptp(recovery_duration), mortality_by_age,
+                           soc.treatment_dependent_risk, soc.treatment_factor,
+                           soc.no_treatment_factor)
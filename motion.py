@@ -5,6 +5,8 @@ and related computations
 
 import numpy as np
 
+from sampling import sample_indices
+
 def update_positions(population):
     '''update positions of all people
 
@@ -86,7 +88,8 @@ def update_randoms(population, pop_size, speed=0.01, heading_update_chance=0.02,
     '''updates random states such as heading and speed
     
     Function that randomized the headings and speeds for population members
-    with settable odds.
+    with settable odds. Members are selected with sample_indices, so the
+    random numbers drawn scale with the number of updates.
 
     Keyword arguments
     -----------------
@@ -115,23 +118,20 @@ def update_randoms(population, pop_size, speed=0.01, heading_update_chance=0.02,
 
     #randomly update heading
     #x
-    update = np.random.random(size=(pop_size,))
-    shp = update[update <= heading_update_chance].shape
-    population[:,3][update <= heading_update_chance] = np.random.normal(loc = 0, 
-                                                        scale = 1/3,
-                                                        size = shp) * heading_multiplication
+    update = sample_indices(pop_size, heading_update_chance)
+    population[update,3] = np.random.normal(loc = 0, 
+                                            scale = 1/3,
+                                            size = len(update)) * heading_multiplication
     #y
-    update = np.random.random(size=(pop_size,))
-    shp = update[update <= heading_update_chance].shape
-    population[:,4][update <= heading_update_chance] = np.random.normal(loc = 0, 
-                                                        scale = 1/3,
-                                                        size = shp) * heading_multiplication
+    update = sample_indices(pop_size, heading_update_chance)
+    population[update,4] = np.random.normal(loc = 0, 
+                                            scale = 1/3,
+                                            size = len(update)) * heading_multiplication
     #randomize speeds
-    update = np.random.random(size=(pop_size,))
-    shp = update[update <= heading_update_chance].shape
-    population[:,5][update <= heading_update_chance] = np.random.normal(loc = speed, 
-                                                        scale = speed / 3,
-                                                        size = shp) * speed_multiplication
+    update = sample_indices(pop_size, speed_update_chance)
+    population[update,5] = np.random.normal(loc = speed, 
+                                            scale = speed / 3,
+                                            size = len(update)) * speed_multiplication
 
     population[:,5] = np.clip(population[:,5], a_min=0.0001, a_max=0.05)
     return population
@@ -157,3 +157,131 @@ def get_motion_parameters(xmin, ymin, xmax, ymax):
     y_wander = (ymax - ymin) / 2
 
     return x_center, y_center, x_wander, y_wander
+
+
+class Motion_Stage():
+    __slots__ = ['pop_size',
+                 'chunk_size',
+                 'rng',
+                 'free',
+                 'mask',
+                 'scratch',
+                 'step']
+
+    '''out_of_bounds, update_randoms and update_positions in one stage
+
+    Does the same as calling out_of_bounds (for those without destination),
+    update_randoms and update_positions, but with scalar bounds and scratch
+    buffers that are allocated once, so a time step updates the population
+    in place and allocates (next to) nothing. Random numbers come from a
+    numpy Generator, seeded from numpy's global random state so 
+    np.random.seed keeps runs reproducible, and members to update are
+    selected with sample_indices.
+
+    If chunk_size is given the population is moved in blocks of chunk_size
+    people, and the buffers are only chunk_size long. Blocks of a population
+    that is not an in-memory ndarray (a memmap, see Population.memmap_path)
+    are copied to memory, moved and written back.
+    '''
+    def __init__(self, pop_size, seed=None, chunk_size=None):
+        if seed is None:
+            seed = np.random.randint(0, 2**31 - 1)
+        self.pop_size = pop_size
+        self.chunk_size = pop_size if chunk_size is None else min(chunk_size, pop_size)
+        self.rng = np.random.default_rng(seed)
+        self.free = np.empty(self.chunk_size, dtype=bool)
+        self.mask = np.empty(self.chunk_size, dtype=bool)
+        self.scratch = np.empty(self.chunk_size, dtype=bool)
+        self.step = np.empty(self.chunk_size)
+
+    def update(self, population, xbounds, ybounds, speed=0.01, randomize=True,
+               heading_update_chance=0.02):
+        '''moves the population one time step
+
+        Keyword arguments
+        -----------------
+        population : ndarray
+            the array containing all the population information
+
+        xbounds, ybounds : list or tuple
+            contains the lower and upper bounds of the world [min, max]
+
+        speed : int or float
+            mean speed of population members
+
+        randomize : bool
+            whether to randomly update headings and speeds (False during lockdown)
+
+        heading_update_chance : float
+            the odds of updating heading and speed of each member, each time step
+        '''
+        if self.chunk_size >= self.pop_size:
+            return self._update_block(population, xbounds, ybounds, speed, randomize,
+                                      heading_update_chance)
+
+        in_memory = type(population) is np.ndarray
+        for start in range(0, self.pop_size, self.chunk_size):
+            stop = min(start + self.chunk_size, self.pop_size)
+            block = population[start:stop] if in_memory else np.array(population[start:stop])
+            self._update_block(block, xbounds, ybounds, speed, randomize, heading_update_chance)
+            if not in_memory:
+                population[start:stop] = block
+
+        return population
+
+    def _update_block(self, population, xbounds, ybounds, speed, randomize,
+                      heading_update_chance):
+        '''moves a block of (at most chunk_size) people, see update'''
+        n = len(population)
+        free, mask, step = self.free[:n], self.mask[:n], self.step[:n]
+
+        #out of bounds, only for those without a destination
+        np.equal(population[:,11], 0, out = free)
+        self._bounce(population[:,1], population[:,3], xbounds[0], xbounds[1], n)
+        self._bounce(population[:,2], population[:,4], ybounds[0], ybounds[1], n)
+
+        if randomize:
+            self._randomize(population[:,3], heading_update_chance, 0, 1/3)
+            self._randomize(population[:,4], heading_update_chance, 0, 1/3)
+            self._randomize(population[:,5], heading_update_chance, speed, speed / 3)
+            np.clip(population[:,5], 0.0001, 0.05, out = population[:,5])
+
+        #for dead ones: set heading to 0
+        np.equal(population[:,6], 3, out = mask)
+        np.copyto(population[:,3], 0, where = mask)
+        np.copyto(population[:,4], 0, where = mask)
+
+        #update positions
+        np.multiply(population[:,3], population[:,5], out = step)
+        np.add(population[:,1], step, out = population[:,1])
+        np.multiply(population[:,4], population[:,5], out = step)
+        np.add(population[:,2], step, out = population[:,2])
+
+        return population
+
+    def _bounce(self, position, heading, lower, upper, n):
+        '''turns those at a bound and heading outward back inward'''
+        free, mask, scratch = self.free[:n], self.mask[:n], self.scratch[:n]
+
+        #at lower bound and heading down: new positive heading
+        np.less_equal(position, lower, out = mask)
+        np.less(heading, 0, out = scratch)
+        np.logical_and(mask, scratch, out = mask)
+        np.logical_and(mask, free, out = mask)
+        count = np.count_nonzero(mask)
+        if count > 0:
+            heading[np.flatnonzero(mask)] = np.clip(self.rng.normal(0.5, 0.5/3, count), 0.05, 1)
+
+        #at upper bound and heading up: new negative heading
+        np.greater_equal(position, upper, out = mask)
+        np.greater(heading, 0, out = scratch)
+        np.logical_and(mask, scratch, out = mask)
+        np.logical_and(mask, free, out = mask)
+        count = np.count_nonzero(mask)
+        if count > 0:
+            heading[np.flatnonzero(mask)] = np.clip(-self.rng.normal(0.5, 0.5/3, count), -1, -0.05)
+
+    def _randomize(self, column, update_chance, loc, scale):
+        '''redraws column from a gaussian for a random selection of members'''
+        update = sample_indices(len(column), update_chance, self.rng)
+        column[update] = self.rng.normal(loc, scale, len(update))
@@ -4,8 +4,13 @@ parameters for the simulation
 '''
 
 from glob import glob
+import os
 import numpy as np
+from columns import Population_columns
 from motion import get_motion_parameters, update_randoms
+from scheduler import Recovery_Calendar
+from states import Population_states
+from trajectory import Trajectory_Writer
 from utils import check_folder
 
 class Population():
@@ -17,7 +22,15 @@ class Population():
                   'wander_factor',
                   'wander_factor_dest',
                   'population',
-                  'destinations']
+                  'destinations',
+                  'recovery_calendar',
+                  'motion_stage',
+                  'state_index',
+                  'column_store',
+                  'memmap_path',
+                  'chunk_size',
+                  'trajectory',
+                  'recorder']
         
     def __init__(self, 
                  pop_size   = 500,
@@ -28,6 +41,9 @@ class Population():
                  wander_range = 0.05,
                  wander_factor = 1 ,
                  wander_factor_dest = 1.5, #area around destination 
+                 column_store = False, #typed column per attribute in stead of a float64 matrix
+                 memmap_path = None, #file to keep the population matrix in, in stead of memory
+                 chunk_size = None, #number of people initialized and moved at once, None for all
                  ):
         '''initialized the population for the simulation
     
@@ -48,7 +64,12 @@ class Population():
         12 : at destination: whether arrived at destination (0=traveling, 1=arrived)
         13 : wander_range_x : wander ranges on x axis for those who are confined to a location
         14 : wander_range_y : wander ranges on y axis for those who are confined to a location
-        
+
+        With column_store the population is kept in a Population_columns
+        (see columns.py) that holds these columns as typed arrays, and can be
+        indexed like the matrix. The numba kernels (config.use_numba) need
+        the matrix and are not used with column_store.
+
         
         #average speed of population
         #when people have an active destination, the wander range defines the area
@@ -70,6 +91,19 @@ class Population():
     
         ybounds : 2d array
             lower and upper bounds of y axis
+
+        column_store : bool
+            whether to keep the population in a typed column store in stead of
+            a float64 matrix, to save memory in large populations
+
+        memmap_path : str
+            if given, the population matrix is a memory mapped .npy file at this
+            path, for populations larger than memory
+
+        chunk_size : int
+            the number of people initialized and moved at once. Bounds the memory
+            used by these steps, defaults to everyone at once (or 2**20 people
+            with memmap_path)
         '''
         
         # population properties
@@ -81,33 +115,84 @@ class Population():
         self.wander_range = wander_range
         self.wander_factor = wander_factor 
         self.wander_factor_dest = wander_factor_dest #area around destination
-    
+        self.recovery_calendar = Recovery_Calendar() #used if config.schedule_recoveries is set
+        self.motion_stage = None #Motion_Stage, built at the first time step
+        self.state_index = None #Population_states, built with the population matrix
+        self.trajectory = None #Trajectory_Writer, opened at the first saved frame
+        self.recorder = None #Event_Log that records state transitions, if set
+        self.column_store = column_store #whether to keep the population in a Population_columns
+        self.memmap_path = memmap_path
+        if chunk_size is None and memmap_path is not None:
+            chunk_size = 2**20 #never build or move a memory mapped population at once
+        self.chunk_size = chunk_size
+    
+    def new_population_matrix(self):
+        '''returns an empty population of pop_size people
+
+        A float64 matrix of 15 columns, or a Population_columns with the
+        same columns if column_store is set (see columns.py). If memmap_path
+        is set the matrix is a numpy memmap stored in that (.npy) file, so
+        it does not need to fit in memory.
+        '''
+        if self.memmap_path is not None:
+            if self.column_store:
+                raise ValueError('memmap_path needs the population matrix, it can not be combined with column_store')
+            return np.lib.format.open_memmap(self.memmap_path, mode = 'w+', 
+                                             dtype = np.float64, shape = (self.pop_size, 15))
+        if self.column_store:
+            return Population_columns(self.pop_size)
+        return np.zeros((self.pop_size, 15))
+
+
     #initialize population matrix
     def initialize_population_matrix(self):
-        self.population = np.zeros((self.pop_size, 15))
+        '''fills the population with random people
+
+        The population is generated in blocks of chunk_size people, that are
+        built in memory and then written to the population matrix, so a
+        memory mapped population never has to be in memory as a whole.
+        '''
+        self.population = self.new_population_matrix()
+        chunk_size = self.pop_size if self.chunk_size is None else self.chunk_size
+
+        for start in range(0, self.pop_size, max(chunk_size, 1)):
+            stop = min(start + chunk_size, self.pop_size)
+            self.population[start:stop] = self.initialize_population_chunk(start, stop)
+
+        if isinstance(self.population, np.memmap):
+            self.population.flush()
+        #build index sets of states
+        self.build_state_index()
+
+
+    def initialize_population_chunk(self, start, stop):
+        '''returns the rows start to stop of a new population matrix'''
+        size = stop - start
+        chunk = np.zeros((size, 15))
         #initalize unique IDs
-        self.population[:,0] = [x for x in range(self.pop_size)]
+        chunk[:,0] = np.arange(start, stop)
         #initialize random coordinates
-        self.population[:,1] = np.random.uniform(low = self.xbounds[0] + 0.05, high = self.xbounds[1] - 0.05, 
-                                            size = (self.pop_size,))
-        self.population[:,2] = np.random.uniform(low = self.ybounds[0] + 0.05, high = self.ybounds[1] - 0.05, 
-                                            size=(self.pop_size,))
+        chunk[:,1] = np.random.uniform(low = self.xbounds[0] + 0.05, high = self.xbounds[1] - 0.05, 
+                                       size = (size,))
+        chunk[:,2] = np.random.uniform(low = self.ybounds[0] + 0.05, high = self.ybounds[1] - 0.05, 
+                                       size=(size,))
         #initialize random headings -1 to 1
-        self.population[:,3] = np.random.normal(loc = 0, scale = 1/3, 
-                                           size=(self.pop_size,))
-        self.population[:,4] = np.random.normal(loc = 0, scale = 1/3, 
-                                           size=(self.pop_size,))
+        chunk[:,3] = np.random.normal(loc = 0, scale = 1/3, 
+                                      size=(size,))
+        chunk[:,4] = np.random.normal(loc = 0, scale = 1/3, 
+                                      size=(size,))
         #initialize random speeds
-        self.population[:,5] = np.random.normal(self.speed, self.speed / 3)
-        #initalize ages (on ly for stratified populations)
-        # std_age = (self.max_age - self.mean_age) / 3
-        # self.population[:,7] = np.int32(np.random.normal(loc = self.mean_age, 
-        #                                             scale = std_age, 
-        #                                             size=(self.pop_size,)))
-        # self.population[:,7] = np.clip(self.population[:,7], a_min = 0, 
-        #                           a_max = self.max_age) #clip those younger than 0 years
+        chunk[:,5] = np.random.normal(self.speed, self.speed / 3)
+        #initalize ages (only for stratified populations)
+        self.initialize_ages(chunk)
         #build recovery_vector
-        self.population[:,9] = np.random.normal(loc = 0.5, scale = 0.5 / 3, size=(self.pop_size,))
+        chunk[:,9] = np.random.normal(loc = 0.5, scale = 0.5 / 3, size=(size,))
+        return chunk
+
+
+    def initialize_ages(self, chunk):
+        '''sets the ages (column 7) of a chunk of new people, all 0 by default'''
+        pass
     
         
     
@@ -177,9 +262,74 @@ class Population():
         self.population[:,13] = x_wander
         self.population[:,14] = y_wander
     
-        self.population[:,11] = dest_no #set destination active
-        self.population[:,12] = 1 #set destination reached
+        self.set_active_destination(np.arange(len(self.population)), dest_no) #set destination active
+        self.set_at_destination(np.arange(len(self.population)), 1) #set destination reached
+    
+    
     
+    def build_state_index(self):
+        '''(re)builds the index sets and counts per state
+
+        Called when the population matrix is initialized. Needs to be called
+        again after writing columns 6, 10 or 12 without the methods below.
+        '''
+        self.state_index = Population_states(self.population)
+
+
+    def set_state(self, indices, state, infectors=None):
+        '''sets the state (column 6) of people and updates the state index
+
+        Keyword arguments
+        -----------------
+        indices : ndarray or list
+            unique indices of the people to update
+
+        state : int
+            the new state (0=healthy, 1=sick, 2=immune, 3=dead, 4=immune but infectious)
+
+        infectors : ndarray
+            the person that infected each of them, if known (for the recorder)
+        '''
+        if self.recorder is not None:
+            self._record(self.state_index.state, indices, 6, state, infectors)
+        self.population[indices,6] = state
+        self.state_index.state.move(indices, state)
+
+
+    def set_treatment(self, indices, in_treatment):
+        '''sets whether people are in treatment (column 10), see set_state'''
+        if self.recorder is not None:
+            self._record(self.state_index.treatment, indices, 10, int(in_treatment))
+        self.population[indices,10] = in_treatment
+        self.state_index.treatment.move(indices, int(in_treatment))
+
+
+    def set_at_destination(self, indices, arrived):
+        '''sets whether people arrived at their destination (column 12), see set_state'''
+        if self.recorder is not None:
+            self._record(self.state_index.destination, indices, 12, int(arrived))
+        self.population[indices,12] = arrived
+        self.state_index.destination.move(indices, int(arrived))
+
+
+    def set_active_destination(self, indices, dest_no):
+        '''sets the active destination (column 11) of people, 0 to wander freely'''
+        if self.recorder is not None:
+            indices = np.asarray(indices, dtype=np.int64)
+            changed = indices[self.population[indices,11] != dest_no]
+            self.recorder.record(changed, 11, dest_no)
+        self.population[indices,11] = dest_no
+
+
+    def _record(self, partition, indices, column, value, infectors=None):
+        '''passes the people whose value changes to the recorder, see events.py'''
+        indices = np.asarray(indices, dtype=np.int64)
+        #the partition still holds the old values, also when a numba kernel
+        #already wrote the column
+        changed = partition.group[indices] != value
+        if infectors is not None:
+            infectors = np.asarray(infectors)[changed]
+        self.recorder.record(indices[changed], column, value, infectors)
     
     
     def find_nearby(self, infection_zone, traveling_infects=False,
@@ -245,46 +395,60 @@ and path planning
 '''
 
 
-    def go_to_location(self,patient, destination, location_bounds, dest_no=1):
-        '''sends patient to defined location
+    def go_to_location(self, indices, location_bounds, dest_no=1, location_odds=1.0,
+                       location_draws=None):
+        '''sends people to defined location
     
-        Function that takes a patient an destination, and sets the location
-        as active for that patient.
+        Function that takes the indices of a group of people and a destination, 
+        and sets the location as active for all of them at once.
     
         Keyword arguments
         -----------------
-        patient : 1d array
-            1d array of the patient data, is a row from population matrix
-    
-        destination : 1d array
-            1d array of the destination data, is a row from destination matrix
+        indices : ndarray or list
+            the indices of the people in the population matrix
     
         location_bounds : list or tuple
-            defines bounds for the location the patient will be roam in when sent
+            defines bounds for the location the people will roam in when sent
             there. format: [xmin, ymin, xmax, ymax]
     
         dest_no : int
             the location number, used as index for destinations array if multiple possible
             destinations are defined`.
-    
-    
-        TODO: vectorize
-    
+
+        location_odds : float
+            the odds that someone goes to the location or not. Can be used to simulate 
+            non-compliance to for example self-isolation.
+
+        location_draws : ndarray
+            one uniform die roll per person, those with a roll <= location_odds are
+            sent. Drawn here if not given.
+
+        Returns
+        -------
+        the indices of the people that were sent to the location
         '''
+        indices = np.asarray(indices, dtype=np.int64)
+        if dest_no < 1 or self.destinations.shape[1] < dest_no * 2:
+            raise ValueError('destination %s does not exist! Initialize the destination matrix with at least %s destinations' 
+                             %(dest_no, dest_no))
+
+        if location_draws is None:
+            location_draws = np.random.uniform(size = len(indices))
+        sent = indices[location_draws <= location_odds]
     
         x_center, y_center, x_wander, y_wander = get_motion_parameters(location_bounds[0],
                                                                         location_bounds[1],
                                                                         location_bounds[2],
                                                                         location_bounds[3])
-        patient[13] = x_wander
-        patient[14] = y_wander
+        self.population[sent,13] = x_wander
+        self.population[sent,14] = y_wander
         
-        destination[(dest_no - 1) * 2] = x_center
-        destination[((dest_no - 1) * 2) + 1] = y_center
+        self.destinations[sent,(dest_no - 1) * 2] = x_center
+        self.destinations[sent,((dest_no - 1) * 2) + 1] = y_center
     
-        patient[11] = dest_no #set destination active
+        self.set_active_destination(sent, dest_no) #set destination active
     
-        return patient, destination
+        return sent
     
     
     def set_destination(self):
@@ -368,13 +532,12 @@ and path planning
             dest_y = destinations[:,int(((d - 1) * 2) + 1)]
     
             #see who arrived at destination and filter out who already was there
-            at_dest = population[(np.abs(population[:,1] - dest_x) < (population[:,13] * wander_factor)) & 
-                                    (np.abs(population[:,2] - dest_y) < (population[:,14] * wander_factor)) &
-                                    (population[:,12] == 0)]
+            arrived = np.flatnonzero((np.abs(population[:,1] - dest_x) < (population[:,13] * wander_factor)) & 
+                                     (np.abs(population[:,2] - dest_y) < (population[:,14] * wander_factor)) &
+                                     (population[:,12] == 0))
+            at_dest = population[arrived]
     
             if len(at_dest) > 0:
-                #mark those as arrived
-                at_dest[:,12] = 1
                 #insert random headings and speeds for those at destination
                 at_dest = update_randoms(at_dest, pop_size = len(at_dest), speed = speed,
                                          heading_update_chance = 1, speed_update_chance = 1)
@@ -382,9 +545,9 @@ and path planning
                 #at_dest[:,5] = 0.001
     
                 #reinsert into population
-                population[(np.abs(population[:,1] - dest_x) < (population[:,13] * wander_factor)) & 
-                            (np.abs(population[:,2] - dest_y) < (population[:,14] * wander_factor)) &
-                            (population[:,12] == 0)] = at_dest
+                population[arrived] = at_dest
+                #mark those as arrived
+                self.set_at_destination(arrived, 1)
     
     
         return population
@@ -483,14 +646,14 @@ and path planning
         
         if len(ids) == 0:
             #if ids empty, reset everyone
-            population[:,11] = 0
+            self.set_active_destination(np.arange(len(population)), 0)
         else:
             pass
             #else, reset id's
     
         
         pass
-    def save_data(self, pop_tracker):
+    def save_data(self, pop_tracker, writer=None):
         '''dumps simulation data to disk
     
         Function that dumps the simulation data to specific files on the disk.
@@ -507,16 +670,20 @@ and path planning
     
         fatalities : list or ndarray
             the array containing data of fatalities over time
+
+        writer : Background_Writer
+            if given, copies of the data are written in the background
         ''' 
         num_files = len(glob('data/*'))
         check_folder('data/%i' %num_files)
-        np.save('data/%i/population.npy' %num_files, self.population)
-        np.save('data/%i/infected.npy' %num_files, pop_tracker.infectious)
-        np.save('data/%i/recovered.npy' %num_files, pop_tracker.recovered)
-        np.save('data/%i/fatalities.npy' %num_files, pop_tracker.fatalities)
+        save = np.save if writer is None else writer.save_array
+        save('data/%i/population.npy' %num_files, self.population)
+        save('data/%i/infected.npy' %num_files, pop_tracker.infectious)
+        save('data/%i/recovered.npy' %num_files, pop_tracker.recovered)
+        save('data/%i/fatalities.npy' %num_files, pop_tracker.fatalities)
     
     
-    def save_population(self, tstep=0, folder='data_tstep'):
+    def save_population(self, tstep=0, folder='data_tstep', writer=None):
         '''dumps population data at given timestep to disk
     
         Function that dumps the simulation data to specific files on the disk.
@@ -530,9 +697,46 @@ and path planning
     
         tstep : int
             the timestep that will be saved
+
+        writer : Background_Writer
+            if given, a copy of the population is written in the background
         ''' 
         check_folder('%s/' %(folder))
-        np.save('%s/population_%i.npy' %(folder, tstep), self.population)
+        if writer is None:
+            np.save('%s/population_%i.npy' %(folder, tstep), self.population)
+        else:
+            writer.save_array('%s/population_%i.npy' %(folder, tstep), self.population)
+
+
+    def save_trajectory(self, tstep=0, folder='pop_data', writer=None, quantize=(0.0, 1.0)):
+        '''appends the population at given timestep to folder/trajectory.bin
+
+        Stores the dynamic columns of the population (see trajectory.py) in
+        one append-only file, in stead of a file per timestep as
+        save_population does.
+
+        Keyword arguments
+        -----------------
+        tstep : int
+            the timestep that will be saved
+
+        folder : str
+            folder of the trajectory file
+
+        writer : Background_Writer
+            if given, a copy of the population is appended in the background
+
+        quantize : tuple or None
+            (low, high) range of the 16 bit coordinates, see
+            trajectory.coordinate_range, or None to store them as float32
+        '''
+        path = os.path.join(folder, 'trajectory.bin')
+        if self.trajectory is None or self.trajectory.path != path:
+            self.trajectory = Trajectory_Writer(path, self.pop_size, quantize = quantize)
+        if writer is None:
+            self.trajectory.append(tstep, self.population)
+        else:
+            writer.submit(self.trajectory.append, tstep, np.array(self.population))
         
         
     def set_reduced_interaction(self, speed = 0.001):
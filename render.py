@@ -0,0 +1,213 @@
+'''
+offline renderer: draws the frames saved by a simulation (config.save_pop)
+to png files on a pool of worker processes, so plotting does not slow the
+simulation down and long runs are rendered in parallel, for example:
+
+    python -m run_model --steps 2000 --set config.save_pop=True --set config.save_pop_freq=1
+    python -m render pop_data/trajectory.bin --output render/ --animation run.gif
+
+the source is a trajectory file (see trajectory.py) or a folder with the
+population_<frame>.npy files of save_population. Every worker renders a
+range of frames with the Agg backend, with the same figure as the live
+plot (visualiser.Live_Renderer). The counts over time are computed from
+the saved states once, before rendering. Other arguments are passed to
+run_model and set the plot (--set config.plot_mode="default",
+--set society.self_isolate=True, ...).
+'''
+
+import argparse
+import glob
+import os
+import re
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import run_model
+from config import Configuration
+from population import Population
+from society import Society
+from tracker import Population_trackers
+from trajectory import Trajectory
+from utils import check_folder
+
+
+class Snapshot_Folder():
+    __slots__ = ['folder',
+                 'frames',
+                 'pop_size']
+
+    '''the population_<frame>.npy files of save_population, read like a Trajectory'''
+    def __init__(self, folder):
+        paths = glob.glob(os.path.join(folder, 'population_*.npy'))
+        if len(paths) == 0:
+            raise ValueError('%s not understood! It has no population_<frame>.npy files' %folder)
+        self.folder = folder
+        self.frames = np.sort([int(re.search(r'population_(\d+)\.npy$', path).group(1)) for path in paths])
+        self.pop_size = len(np.load(paths[0], mmap_mode = 'r'))
+
+    def __len__(self):
+        return len(self.frames)
+
+    def population(self, frame):
+        return np.load(os.path.join(self.folder, 'population_%i.npy' %frame))
+
+    def states(self, record):
+        return np.load(os.path.join(self.folder, 'population_%i.npy' %self.frames[record]),
+                       mmap_mode = 'r')[:,6]
+
+
+def open_source(path):
+    '''opens a trajectory file or a folder of population snapshots'''
+    if os.path.isdir(path):
+        return Snapshot_Folder(path)
+    return Trajectory(path)
+
+
+def state_counts(source):
+    '''the number of healthy, infected, immune and dead per frame, from frame 0
+
+    Frames that are not saved get the counts of the last saved frame before
+    them (or the first saved frame).
+    '''
+    counts = np.zeros((len(source), 4), dtype=np.int64)
+    for record in range(len(source)):
+        states = source.states(record) if isinstance(source, Snapshot_Folder) else source.column('state', record)
+        counts[record] = np.bincount(np.int64(states), minlength = 5)[:4]
+    frames = np.asarray(source.frames)
+    records = np.maximum(np.searchsorted(frames, np.arange(frames[-1] + 1), side='right') - 1, 0)
+    return counts[records]
+
+
+def render_frames(task):
+    '''renders a range of frames to png, in a worker process'''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from visualiser import Live_Renderer
+
+    path, frames, counts, scenario, output = task
+    source = open_source(path)
+    pop_size = source.pop_size if isinstance(source, Snapshot_Folder) else source.header['pop_size']
+    config = Configuration(**scenario['config'])
+    config.save_plot = True
+    config.plot_path = output
+    renderer = Live_Renderer(config, Society(**scenario['society']), Population(pop_size = pop_size))
+
+    tracker = Population_trackers()
+    for frame in frames:
+        tracker.infectious = counts[:frame + 1,1].tolist()
+        tracker.recovered = counts[:frame + 1,2].tolist()
+        tracker.fatalities = counts[:frame + 1,3].tolist()
+        tracker.susceptible = (pop_size - counts[:frame + 1,1:].sum(axis=1)).tolist()
+        renderer.draw(frame, source.population(frame), tracker)
+    plt.close(renderer.fig)
+    return len(frames)
+
+
+def render(path, output='render/', scenario=None, processes=None, frames=None, chunks_per_process=4):
+    '''renders the saved frames of a simulation to output/<frame>.png
+
+    Keyword arguments
+    -----------------
+    path : str
+        a trajectory file or a folder of population_<frame>.npy files
+
+    output : str
+        folder the png files are written to
+
+    scenario : dict
+        scenario with the plot settings (config and society), see
+        run_model.build_scenario. Defaults to the default scenario
+
+    processes : int
+        the number of worker processes, defaults to the number of cores
+
+    frames : slice
+        the frame numbers to render (a slice of frame numbers), all by default
+
+    chunks_per_process : int
+        frames are split in processes * chunks_per_process ranges of
+        consecutive frames, so workers that finish early get more work
+
+    Returns
+    -------
+    the rendered frame numbers
+    '''
+    if scenario is None:
+        scenario = run_model.build_scenario(run_model.parse_arguments([]))
+    source = open_source(path)
+    counts = state_counts(source)
+    selected = np.asarray(source.frames)
+    if frames is not None:
+        selected = selected[(selected >= (frames.start or 0)) &
+                            (selected < (frames.stop if frames.stop is not None else selected[-1] + 1))]
+
+    check_folder(output)
+    processes = processes or os.cpu_count()
+    ranges = [r for r in np.array_split(selected, processes * chunks_per_process) if len(r) > 0]
+    with ProcessPoolExecutor(max_workers = processes) as pool:
+        list(pool.map(render_frames, [(path, r.tolist(), counts, scenario, output) for r in ranges]))
+    return selected
+
+
+def write_animation(output, frames, path, fps=30):
+    '''joins the png files of frames into an animation
+
+    A .gif is written with Pillow, other formats (.mp4, ...) with ffmpeg,
+    which needs to be installed.
+    '''
+    images = ['%s/%i.png' %(output, frame) for frame in frames]
+    if path.lower().endswith('.gif'):
+        from PIL import Image
+        first = Image.open(images[0])
+        first.save(path, save_all = True, append_images = (Image.open(image) for image in images[1:]),
+                   duration = 1000 / fps, loop = 0)
+        return
+    if shutil.which('ffmpeg') is None:
+        raise ValueError('animation %s not understood! Only .gif can be written without ffmpeg' %path)
+    listing = '%s/frames.txt' %output
+    with open(listing, 'w') as f:
+        for image in images:
+            f.write('file \'%s\'\nduration %f\n' %(os.path.abspath(image), 1 / fps))
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', listing,
+                    '-pix_fmt', 'yuv420p', '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', path], check = True)
+
+
+def parse_frames(frames):
+    '''parses --frames START:STOP'''
+    start, separator, stop = frames.partition(':')
+    if not separator:
+        raise ValueError('--frames %s not understood! Use START:STOP' %frames)
+    return slice(int(start) if start else None, int(stop) if stop else None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog = 'python -m render',
+                                     description = 'renders saved frames, other arguments are passed to run_model')
+    parser.add_argument('source', help = 'trajectory file or folder with population_<frame>.npy files')
+    parser.add_argument('--output', default = 'render/', help = 'folder for the png files')
+    parser.add_argument('--processes', type = int, help = 'worker processes (default: all cores)')
+    parser.add_argument('--frames', metavar = 'START:STOP', help = 'range of frame numbers to render')
+    parser.add_argument('--animation', help = 'also join the frames into this file (.gif, or .mp4 with ffmpeg)')
+    parser.add_argument('--fps', type = float, default = 30, help = 'frames per second of the animation')
+    args, scenario_arguments = parser.parse_known_args(argv)
+
+    try:
+        scenario = run_model.build_scenario(run_model.parse_arguments(scenario_arguments))
+        frames = None if args.frames is None else parse_frames(args.frames)
+        rendered = render(args.source, args.output, scenario, args.processes, frames)
+        if args.animation is not None:
+            write_animation(args.output, rendered, args.animation, args.fps)
+    except ValueError as error:
+        print(error, file = sys.stderr)
+        return 2
+    print('rendered %i frames to %s' %(len(rendered), args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,43 +4,207 @@
 Created on Tue Apr  7 23:23:35 2020
 
 @author: beca4397
+
+command line entry point of the simulation
+
+runs a scenario built from the arguments and/or a scenario file, for example:
+
+    python -m run_model --pop-size 1000 --set society.lockdown=True --visualise
+    python -m run_model --scenario scenario.json --report json
+    python -m run_model --steps 20000 --checkpoint-every 1000 --resume
+
+a scenario file is a json file with the keyword arguments of each part of
+the simulation, all entries are optional:
+
+    {"population_type": "stratified", "virus_type": "lethal", "destinations": 1,
+     "seed": 100,
+     "population": {"pop_size": 1000, "mean_age": 45},
+     "society": {"lockdown": true, "lockdown_compliance": 0.95},
+     "virus": {"infection_chance": 0.03},
+     "config": {"simulation_steps": 20000}}
+
+matplotlib is only imported with --visualise, so headless runs start fast
 """
 
-from IPython import get_ipython
-get_ipython().magic('reset -sf') 
-get_ipython().magic('matplotlib auto') 
+import argparse
+import ast
+import json
+import os
+import sys
 
-from config import Configuration 
+import numpy as np
+
+from checkpoint import load_checkpoint
+from config import Configuration
 from population import Population
-from stratifiedPopulation import Stratified_Population
+from simulation import Console_Reporter, Plot_Renderer, Simulation
 from society import Society
+from stratifiedPopulation import Stratified_Population
 from virus import Virus
 from virusLethal import Virus_Lethal
-from tracker import Population_trackers
-from visualiser import build_fig
-from simulation import run 
 
-# vir = Virus()
-vir = Virus_Lethal()
+POPULATION_TYPES = {'basic': Population, 'stratified': Stratified_Population}
+VIRUS_TYPES = {'basic': Virus, 'lethal': Virus_Lethal}
+SECTIONS = ['population', 'society', 'virus', 'config']
+
+
+def parse_arguments(argv=None):
+    '''parses the command line arguments'''
+    parser = argparse.ArgumentParser(prog = 'python -m run_model',
+                                     description = 'runs a corona simulation scenario')
+    parser.add_argument('--scenario', help = 'json file describing the scenario')
+    parser.add_argument('--population-type', choices = sorted(POPULATION_TYPES),
+                        help = 'population model (default: stratified)')
+    parser.add_argument('--virus-type', choices = sorted(VIRUS_TYPES),
+                        help = 'virus model (default: lethal)')
+    parser.add_argument('--pop-size', type = int, help = 'number of people')
+    parser.add_argument('--steps', type = int, help = 'maximum number of time steps')
+    parser.add_argument('--destinations', type = int, help = 'number of destinations (default: 1)')
+    parser.add_argument('--seed', type = int, help = 'seed of numpy\'s random generator (default: 100)')
+    parser.add_argument('--set', action = 'append', default = [], metavar = 'SECTION.NAME=VALUE',
+                        help = 'sets a keyword argument of population, society, virus or config, '
+                               'for example --set society.lockdown=True (can be repeated)')
+    parser.add_argument('--checkpoint-every', type = int, metavar = 'N',
+                        help = 'checkpoint the full simulation state every N time steps')
+    parser.add_argument('--checkpoint', help = 'checkpoint file (default: checkpoint.npz)')
+    parser.add_argument('--resume', action = 'store_true',
+                        help = 'continue the run saved in the checkpoint file, '
+                               'the scenario needs to be the same as that of the checkpointed run')
+    parser.add_argument('--visualise', action = 'store_true', help = 'draw the simulation')
+    parser.add_argument('--report', choices = ['console', 'json', 'none'], default = 'console',
+                        help = 'console: counts every frame and outcomes at the end, '
+                               'json: the last record as json, none: nothing')
+    return parser.parse_args(argv)
+
+
+def parse_value(value):
+    '''interprets a --set value as a python literal, or else as a string'''
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+
+def section_arguments(scenario, section):
+    '''the keyword arguments of the class that a scenario section is passed to'''
+    classes = {'population' : POPULATION_TYPES.get(scenario['population_type']),
+               'society' : Society,
+               'virus' : VIRUS_TYPES.get(scenario['virus_type']),
+               'config' : Configuration}
+    if classes[section] is None:
+        raise ValueError('%s type %s not understood! Must be one of %s'
+                         %(section, scenario['%s_type' %section],
+                           ', '.join(sorted(POPULATION_TYPES if section == 'population' else VIRUS_TYPES))))
+    code = classes[section].__init__.__code__
+    return code.co_varnames[1:code.co_argcount]
+
+
+def check_setting(scenario, section, name, setting=None):
+    '''raises a ValueError if name is not a keyword argument of section'''
+    arguments = section_arguments(scenario, section)
+    if name not in arguments:
+        raise ValueError('%s not understood! %s has no setting %s, use one of %s'
+                         %(setting or '%s.%s' %(section, name), section, name, ', '.join(arguments)))
+
+
+def build_scenario(args):
+    '''returns the scenario (dict) from the scenario file, updated with the arguments'''
+    scenario = {'population_type': 'stratified', 'virus_type': 'lethal', 'destinations': 1,
+                'seed': 100}
+    for section in SECTIONS:
+        scenario[section] = {}
+
+    if args.scenario is not None:
+        with open(args.scenario) as scenario_file:
+            for key, value in json.load(scenario_file).items():
+                if key in SECTIONS:
+                    scenario[key].update(value)
+                else:
+                    scenario[key] = value
+
+    for key in ['population_type', 'virus_type', 'destinations', 'seed']:
+        if getattr(args, key) is not None:
+            scenario[key] = getattr(args, key)
+    if args.pop_size is not None:
+        scenario['population']['pop_size'] = args.pop_size
+    if args.steps is not None:
+        scenario['config']['simulation_steps'] = args.steps
+    if args.checkpoint_every is not None:
+        scenario['config']['checkpoint_freq'] = args.checkpoint_every
+    if args.checkpoint is not None:
+        scenario['config']['checkpoint_path'] = args.checkpoint
+
+    for setting in args.set:
+        name, separator, value = setting.partition('=')
+        section, dot, name = name.partition('.')
+        if not separator or not dot or section not in SECTIONS:
+            raise ValueError('--set %s not understood! Use SECTION.NAME=VALUE, with SECTION one of %s'
+                             %(setting, ', '.join(SECTIONS)))
+        check_setting(scenario, section, name, '--set %s' %setting)
+        scenario[section][name] = parse_value(value)
+
+    #typos would otherwise end in a TypeError when the simulation is built
+    for section in SECTIONS:
+        for name in scenario[section]:
+            check_setting(scenario, section, name)
+
+    scenario['config']['visualise'] = args.visualise or scenario['config'].get('visualise', False)
+    if args.report != 'console':
+        scenario['config'].setdefault('verbose', False)
+    return scenario
+
+
+def build_simulation(scenario, report='console'):
+    '''builds the Simulation of a scenario, see build_scenario'''
+    if scenario['seed'] is not None:
+        np.random.seed(scenario['seed'])
+
+    vir = VIRUS_TYPES[scenario['virus_type']](**scenario['virus'])
+    pop = POPULATION_TYPES[scenario['population_type']](**scenario['population'])
+    soc = Society(**scenario['society'])
+    config = Configuration(**scenario['config'])
+
+    pop.initialize_destination_matrix(total_destinations = scenario['destinations'])
+    pop.initialize_population_matrix()
+
+    observers = []
+    if config.visualise:
+        observers.append(Plot_Renderer())
+    if report == 'console':
+        observers.append(Console_Reporter())
 
+    return Simulation(config, vir, pop, soc, observers = observers)
 
-# pop = Population()
-pop = Stratified_Population(mean_age=45, pop_size = 1000)
-# pop = Stratified_Population(mean_age=45, pop_size = 1000)
 
-# pop.initialize_population_matrix()
+def main(argv=None):
+    args = parse_arguments(argv)
+    try:
+        scenario = build_scenario(args)
+    except ValueError as error:
+        print(error, file = sys.stderr)
+        return 2
+    checkpoint_path = scenario['config'].get('checkpoint_path', Configuration().checkpoint_path)
+    if args.resume and not os.path.isfile(checkpoint_path):
+        print('--resume not understood! There is no checkpoint %s' %checkpoint_path, file = sys.stderr)
+        return 2
+    sim = build_simulation(scenario, report = args.report)
 
-soc = Society()
-# soc = Society(self_isolate = True,self_isolate_proportion = .95, traveling_infects =False)
-soc = Society(lockdown = True, lockdown_compliance = 0.95, lockdown_percentage = 0.05)
+    steps = sim.config.simulation_steps
+    if args.resume:
+        load_checkpoint(sim, sim.config.checkpoint_path)
+        #run the frames the checkpointed run had left
+        steps = max(steps - sim.config.frame, 0)
 
-#initalise destinations vector
-pop.initialize_destination_matrix(total_destinations=1)
+    try:
+        record = sim.run(steps)
+    except KeyboardInterrupt:
+        print('\nCTRL-C caught, exiting')
+        return 1
 
-config = Configuration(simulation_steps = 20000)
-fig, spec, ax1, ax2 = build_fig(config,pop,figsize=(10,14))
+    if args.report == 'json':
+        print(json.dumps(record))
+    return 0
 
-pop.initialize_population_matrix()
-pop_tracker = Population_trackers()
 
-run(config,vir,pop,pop_tracker,soc, fig, spec, ax1, ax2 )
\ No newline at end of file
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+'''
+file that contains functions to randomly select population members,
+with random number work that scales with the expected number of
+selected members in stead of with the population size
+'''
+
+import numpy as np
+
+
+def sample_indices(n, chance, rng=None):
+    '''selects each of n members independently with the given chance
+
+    Same outcome as np.flatnonzero(np.random.random(n) < chance), but uses
+    geometric skip sampling: the gaps between selected members follow a
+    geometric distribution, so only about n * chance random numbers are
+    drawn in stead of n.
+
+    Keyword arguments
+    -----------------
+    n : int
+        the number of members to select from
+
+    chance : float
+        the odds that each member is selected (range 0 to 1)
+
+    rng : numpy Generator or RandomState
+        the random generator to use, defaults to numpy's global one
+
+    Returns
+    -------
+    sorted indices of the selected members
+    '''
+    if rng is None:
+        rng = np.random
+
+    if n <= 0 or chance <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if chance >= 1:
+        return np.arange(n, dtype=np.int64)
+
+    #draw a few more gaps than expected, so usually one batch is enough
+    expected = n * chance
+    batch = int(expected + 4 * np.sqrt(expected)) + 16
+    positions = np.cumsum(rng.geometric(chance, size = batch)) - 1
+    while positions[-1] < n:
+        positions = np.concatenate((positions, positions[-1] +
+                                    np.cumsum(rng.geometric(chance, size = batch))))
+
+    return positions[:np.searchsorted(positions, n)].astype(np.int64)
+
+
+def sample_bernoulli(chances, rng=None):
+    '''selects members independently, each with their own chance
+
+    Same outcome as np.flatnonzero(np.random.random(len(chances)) < chances).
+    Candidates are selected with the largest chance using sample_indices and
+    then accepted with chance / largest chance (thinning), so only about
+    len(chances) * max(chances) random numbers are drawn.
+
+    Keyword arguments
+    -----------------
+    chances : ndarray
+        the odds that each member is selected, values above 1 count as 1
+
+    rng : numpy Generator or RandomState
+        the random generator to use, defaults to numpy's global one
+
+    Returns
+    -------
+    sorted indices of the selected members
+    '''
+    if rng is None:
+        rng = np.random
+
+    chances = np.asarray(chances, dtype=np.float64)
+    if len(chances) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    largest = min(chances.max(), 1)
+    candidates = sample_indices(len(chances), largest, rng)
+    accept = rng.random(len(candidates)) * largest < chances[candidates]
+    return candidates[accept]
@@ -0,0 +1,84 @@
+'''
+file that contains the calendar queue used to schedule when the
+illness of infected people resolves
+'''
+
+import heapq
+
+import numpy as np
+
+
+class Recovery_Calendar():
+    __slots__ = ['buckets',
+                 'frames',
+                 'pending',
+                 'initialized']
+
+    '''bucketed calendar queue of recovery frames
+
+    Recovery timing is fully determined at infection time, so the frame in
+    which someone recovers or dies is computed once and the person is put
+    in the bucket of that frame. Each time step only the bucket that is due
+    is processed, so recovery work is O(resolved) in stead of O(infected).
+
+    People infected outside of Virus.infect (for example in the simulation
+    callback) need to be passed to add(), they are scheduled by the virus
+    at its next call of recover_or_die.
+    '''
+    def __init__(self):
+        self.buckets = {} #frame -> list of index arrays
+        self.frames = [] #heap of frames that have a bucket
+        self.pending = [] #infected people that still need a recovery frame
+        self.initialized = False
+
+    def add(self, indices):
+        '''adds newly infected people that still need to be scheduled'''
+        self.pending.append(np.asarray(indices, dtype=np.int64))
+
+    def take_pending(self):
+        '''returns and clears the people added since the last call'''
+        if len(self.pending) == 0:
+            return np.zeros(0, dtype=np.int64)
+        pending = np.concatenate(self.pending)
+        self.pending = []
+        return pending
+
+    def schedule(self, indices, frames):
+        '''puts each person in the bucket of the frame their illness resolves
+
+        Keyword arguments
+        -----------------
+        indices : ndarray
+            indices of the people to schedule
+
+        frames : ndarray
+            the frame in which each of them recovers or dies
+        '''
+        indices = np.asarray(indices, dtype=np.int64)
+        frames = np.int64(frames)
+        if len(indices) == 0:
+            return
+
+        order = np.argsort(frames, kind='stable')
+        frames, indices = frames[order], indices[order]
+        unique_frames, starts = np.unique(frames, return_index=True)
+
+        for frame, group in zip(unique_frames.tolist(), np.split(indices, starts[1:])):
+            if frame not in self.buckets:
+                self.buckets[frame] = []
+                heapq.heappush(self.frames, frame)
+            self.buckets[frame].append(group)
+
+    def pop_due(self, frame):
+        '''removes and returns everyone due at or before frame, sorted by index, once each'''
+        due = []
+        while len(self.frames) > 0 and self.frames[0] <= frame:
+            due.extend(self.buckets.pop(heapq.heappop(self.frames)))
+
+        if len(due) == 0:
+            return np.zeros(0, dtype=np.int64)
+        #a person can be scheduled twice (the seeded patients of callback), return each once
+        return np.unique(np.concatenate(due))
+
+    def __len__(self):
+        return sum(len(group) for bucket in self.buckets.values() for group in bucket)
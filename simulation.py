@@ -1,54 +1,53 @@
 # %matplotlib
 
-import os
 import sys
 
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
-
-from config import Configuration
-from environment import build_hospital
-from motion import update_positions, out_of_bounds, update_randoms,\
-get_motion_parameters
-from population import Population
+
+from checkpoint import save_checkpoint
+from events import Event_Log
+from motion import Motion_Stage
 from tracker import Population_trackers
-from visualiser import build_fig, draw_tstep, set_style
+from trajectory import coordinate_range
+from utils import jit_kernels
+from writer import Background_Writer
 
-#set seed for reproducibility
-np.random.seed(100)
+#matplotlib (visualiser) and numba (jit) are imported when they are used,
+#so headless runs start fast. Seed numpy's random generator before a run
+#for reproducibility (run_model.py does this with --seed)
 
 
    
 
 
     
-def tstep(config,vir,pop,pop_tracker,soc, fig, spec, ax1, ax2 ):
-    '''
-    takes a time step in the simulation
+def update(config,vir,pop,pop_tracker,soc, writer=None):
+    '''advances the model one time step, without visualising or reporting
+
+    Moves the population, finds new infections, recovers or kills the sick,
+    updates pop_tracker and saves the population if config.save_pop is set
+    (in the background if a Background_Writer is given).
+    Does not run the callback and does not increase config.frame, see tstep
+    and Simulation.step.
     '''
 
+    if pop.recorder is not None:
+        pop.recorder.begin_frame(config.frame, pop.population)
+
     #check destinations if active
     #define motion vectors if destinations active and not everybody is at destination
-    active_dests = len(pop.population[pop.population[:,11] != 0]) # look op this only once
+    active_dests = np.count_nonzero(pop.population[:,11] != 0) # look op this only once
 
-    if active_dests > 0 and len(pop.population[pop.population[:,12] == 0]) > 0:
+    if active_dests > 0 and pop.state_index.at_destination() < len(pop.population):
         pop.population = pop.set_destination()
         pop.population = pop.check_at_destination()
 
-    if active_dests > 0 and len(pop.population[pop.population[:,12] == 1]) > 0:
+    if active_dests > 0 and pop.state_index.at_destination() > 0:
         #keep them at destination
         pop.population = pop.keep_at_destination()
 
-    #out of bounds
-    #define bounds arrays, excluding those who are marked as having a custom destination
-    if len(pop.population[:,11] == 0) > 0:
-        _xbounds = np.array([[config.xbounds[0] + 0.02, config.xbounds[1] - 0.02]] * len(pop.population[pop.population[:,11] == 0]))
-        _ybounds = np.array([[config.ybounds[0] + 0.02, config.ybounds[1] - 0.02]] * len(pop.population[pop.population[:,11] == 0]))
-        pop.population[pop.population[:,11] == 0] = out_of_bounds(pop.population[pop.population[:,11] == 0], 
-                                                                    _xbounds, _ybounds)
-    
     #set randoms
+    randomize = True
     if soc.lockdown:
         if len(pop_tracker.infectious) == 0:
             mx = 0                
@@ -56,27 +55,32 @@ def tstep(config,vir,pop,pop_tracker,soc, fig, spec, ax1, ax2 ):
             #mx = np.max(pop_tracker.infectious)
             mx = pop_tracker.infectious[-1]  
             
-        if len(pop.population[pop.population[:,6] == 1]) >= len(pop.population) * soc.lockdown_percentage or\
+        if pop.state_index.count(1) >= len(pop.population) * soc.lockdown_percentage or\
            mx >= (len(pop.population) * soc.lockdown_percentage) or soc.lockdown_act:
             soc.lockdown_act =True
+            randomize = False
             #reduce speed of all members of society
             pop.population[:,5] = np.clip(pop.population[:,5], a_min = None, a_max = 0.00001)
             #set speeds of complying people to 0
             pop.population[:,5][soc.lockdown_vector == 0] = 0
-            if len(pop.population[pop.population[:,6] == 1]) <= len(pop.population) * soc.lockdown_percentage/2:
+            if pop.state_index.count(1) <= len(pop.population) * soc.lockdown_percentage/2:
                 soc.lockdown_act = False
-        else:
-            #update randoms
-            pop.population = update_randoms(pop.population, pop.pop_size, pop.speed)
-    else:
-        #update randoms
-        pop.population = update_randoms(pop.population, pop.pop_size, pop.speed)
 
-    #for dead ones: set speed and heading to 0
-    pop.population[:,3:5][pop.population[:,6] == 3] = 0
-    
-    #update positions
-    pop.population = update_positions(pop.population)
+    jit = jit_kernels(config, pop.population)
+    if jit is not None:
+        #out of bounds, randoms and positions in one compiled loop
+        pop.population = jit.update_motion(pop.population, 
+                                           [config.xbounds[0] + 0.02, config.xbounds[1] - 0.02],
+                                           [config.ybounds[0] + 0.02, config.ybounds[1] - 0.02],
+                                           pop.speed, randomize = randomize)
+    else:
+        #out of bounds, randoms and positions in place, with preallocated buffers
+        if pop.motion_stage is None or pop.motion_stage.pop_size != len(pop.population):
+            pop.motion_stage = Motion_Stage(len(pop.population), chunk_size = pop.chunk_size)
+        pop.population = pop.motion_stage.update(pop.population,
+                                                 [config.xbounds[0] + 0.02, config.xbounds[1] - 0.02],
+                                                 [config.ybounds[0] + 0.02, config.ybounds[1] - 0.02],
+                                                 pop.speed, randomize = randomize)
 
     #find new infections
     pop.population, pop.destinations = vir.infect(pop,soc,config,
@@ -92,26 +96,35 @@ def tstep(config,vir,pop,pop_tracker,soc, fig, spec, ax1, ax2 ):
     #send cured back to population if self isolation active
     #perhaps put in recover or die class
     #send cured back to population
-    pop.population[:,11][pop.population[:,6] == 2] = 0
+    pop.set_active_destination(pop.state_index.members(2), 0)
 
     #update population statistics
-    pop_tracker.update_counts(pop.population)
+    pop_tracker.update_counts(pop.population, pop.state_index)
+
+    #save popdata if required
+    if config.save_pop and (config.frame % config.save_pop_freq) == 0:
+        if config.save_pop_format == 'npy':
+            pop.save_population(config.frame, config.save_pop_folder, writer)
+        else:
+            pop.save_trajectory(config.frame, config.save_pop_folder, writer,
+                                quantize = coordinate_range(config, soc))
+
+
+def tstep(config,vir,pop,pop_tracker,soc, fig, spec, ax1, ax2 ):
+    '''
+    takes a time step in the simulation
+    '''
+    update(config,vir,pop,pop_tracker,soc)
 
     #visualise
     if config.visualise:
+        from visualiser import draw_tstep
         draw_tstep(config, soc, pop.pop_size, pop.population, pop_tracker, config.frame, 
-                   fig, spec, ax1, ax2)
+                   fig, spec, ax1, ax2, state_index = pop.state_index)
 
     #report stuff to console
-    sys.stdout.write('\r')
-    sys.stdout.write('%i: healthy: %i, infected: %i, immune: %i, in treatment: %i, \
-dead: %i, of total: %i' %(config.frame, pop_tracker.susceptible[-1], pop_tracker.infectious[-1],
-                    pop_tracker.recovered[-1], len(pop.population[pop.population[:,10] == 1]),
-                    pop_tracker.fatalities[-1], pop.pop_size))
+    report_tstep(config, pop, pop_tracker)
 
-    #save popdata if required
-    if config.save_pop and (config.frame % config.save_pop_freq) == 0:
-        pop.save_population(pop.population, config.frame, config.save_pop_folder)
     #run callback
     callback(pop,config)
 
@@ -127,49 +140,245 @@ def callback(pop,config):
     '''
 
     if config.frame == 1:
-        print('\ninfecting person')
-        pop.population[0][6] = 1
-        pop.population[0][8] = 50
-        pop.population[0][10] = 1
-        
-        pop.population[1][6] = 1
-        pop.population[1][8] = 20
-        pop.population[1][10] = 1
+        if config.verbose:
+            print('\ninfecting person')
+        pop.set_state([0, 1], 1)
+        pop.set_treatment([0, 1], 1)
+        pop.population[0,8] = 50
+        pop.population[1,8] = 20
 
+        #people infected outside of Virus.infect need to be queued for recovery
+        pop.recovery_calendar.add([0, 1])
 
-def run(config,vir,pop,pop_tracker,soc, fig, spec, ax1, ax2 ):
-    '''run simulation'''
 
-    i = 0
-    
-    while i < config.simulation_steps:
-        try:
-            tstep(config,vir,pop,pop_tracker,soc, fig, spec, ax1, ax2 )
-        except KeyboardInterrupt:
-            print('\nCTRL-C caught, exiting')
-            sys.exit(1)
-
-        #check whether to end if no infecious persons remain.
-        #check if self.frame is above some threshold to prevent early breaking when simulation
-        #starts initially with no infections.
-        if config.endif_no_infections and config.frame >= 500:
-            if len(pop.population[(pop.population[:,6] == 1) | 
-                                   (pop.population[:,6] == 4)]) == 0:
-                i = config.simulation_steps
-
-    if config.save_data:
-        pop.save_data(pop_tracker)
-
-    #report outcomes
+def report_tstep(config, pop, pop_tracker):
+    '''writes the counts of the current time step to the console, on one line'''
+    sys.stdout.write('\r')
+    sys.stdout.write('%i: healthy: %i, infected: %i, immune: %i, in treatment: %i, \
+dead: %i, of total: %i' %(config.frame, pop_tracker.susceptible[-1], pop_tracker.infectious[-1],
+                    pop_tracker.recovered[-1], pop.state_index.in_treatment(),
+                    pop_tracker.fatalities[-1], pop.pop_size))
+
+
+def report_outcomes(config, pop):
+    '''prints the outcomes of a finished simulation'''
     print('\n-----stopping-----\n')
     print('total timesteps taken: %i' %config.frame)
-    population = pop.population
-    print('total dead: %i' %len(population[population[:,6] == 3]))
-    print('total recovered: %i' %len(population[population[:,6] == 2]))
-    print('total infected: %i' %len(population[population[:,6] == 1]))
-    print('total infectious: %i' %len(population[(population[:,6] == 1) |
-                                                      (population[:,6] == 4)]))
-    print('total unaffected: %i' %len(population[population[:,6] == 0]))
+    states = pop.state_index
+    print('total dead: %i' %states.count(3))
+    print('total recovered: %i' %states.count(2))
+    print('total infected: %i' %states.count(1))
+    print('total infectious: %i' %(states.count(1) + states.count(4)))
+    print('total unaffected: %i' %states.count(0))
+
+
+class Simulation():
+    __slots__ = ['config',
+                 'virus',
+                 'population',
+                 'society',
+                 'tracker',
+                 'observers',
+                 'callback',
+                 'writer']
+
+    '''headless simulation engine
+
+    Owns the configuration, virus, population, society and tracker of a
+    simulation, and advances them one frame at a time. Each frame produces
+    a summary record (see record). Visualisation and console output are
+    optional observers: callables that are given the simulation and the
+    record of every frame. If an observer has a close method, it is called
+    when run finishes.
+
+    With config.background_io, snapshots, plots and data are written by a
+    Background_Writer (the writer slot), so the frames do not wait on disk:
+    the files are complete when run returns (which also stops the writer
+    thread), after writer.flush() when stepping by hand, and at the latest
+    when the interpreter exits.
+
+    step() advances one frame, frames(n) is a generator of the records of
+    the next n frames that stops early when the simulation is done (see
+    done), iterating over the simulation itself runs config.simulation_steps
+    frames, and run(n) runs to the end and returns the last record.
+
+    With config.checkpoint_freq the full state is checkpointed to
+    config.checkpoint_path every checkpoint_freq frames (see checkpoint.py),
+    restore it with checkpoint.load_checkpoint to resume the run. With
+    config.event_log_path an Event_Log is recorded (see events.py) and saved
+    when run finishes.
+    '''
+    def __init__(self, config, vir, pop, soc, pop_tracker=None, observers=[],
+                 callback=None):
+        '''
+        Keyword arguments
+        -----------------
+        config : Configuration
+            the configuration of the simulation, holds the current frame
+
+        vir : Virus
+            the virus
+
+        pop : Population
+            the population, its population matrix needs to be initialized
+
+        soc : Society
+            the society
+
+        pop_tracker : Population_trackers
+            tracks the counts over time, a new one is made if not given
+
+        observers : list
+            callables called as observer(simulation, record) after every frame,
+            for example Console_Reporter or Plot_Renderer
+
+        callback : function
+            called as callback(pop, config) after every frame, defaults to
+            the callback function of this module
+        '''
+        self.config = config
+        self.virus = vir
+        self.population = pop
+        self.society = soc
+        self.tracker = Population_trackers() if pop_tracker is None else pop_tracker
+        self.observers = list(observers)
+        self.callback = callback
+
+        #files are written by a background thread, see writer.py
+        self.writer = Background_Writer(config.io_queue_size) if config.background_io else None
+
+        if config.event_log_path is not None and pop.recorder is None:
+            pop.recorder = Event_Log(config.event_keyframe_freq)
+
+    def record(self):
+        '''summary of the current frame: the frame and the counts per state'''
+        states = self.population.state_index
+        return {'frame' : self.config.frame,
+                'healthy' : states.count(0),
+                'infectious' : states.count(1),
+                'recovered' : states.count(2),
+                'fatalities' : states.count(3),
+                'in_treatment' : states.in_treatment()}
+
+    def done(self):
+        '''whether the simulation ended because no infectious persons remain
+
+        Only with config.endif_no_infections, and not before frame 500 to 
+        prevent early breaking when the simulation starts without infections.
+        '''
+        states = self.population.state_index
+        return (self.config.endif_no_infections and self.config.frame >= 500 and
+                states.count(1) + states.count(4) == 0)
+
+    def step(self):
+        '''advances one frame and returns its record'''
+        update(self.config, self.virus, self.population, self.tracker, self.society, self.writer)
+        record = self.record()
+
+        for observer in self.observers:
+            observer(self, record)
+
+        if self.callback is None:
+            callback(self.population, self.config)
+        else:
+            self.callback(self.population, self.config)
+
+        self.config.frame += 1
+
+        if self.config.checkpoint_freq and self.config.frame % self.config.checkpoint_freq == 0:
+            #the saved frames up to here are on disk before the checkpoint says so
+            if self.writer is not None:
+                self.writer.flush()
+            save_checkpoint(self, self.config.checkpoint_path)
+        return record
+
+    def frames(self, n=None):
+        '''generator of the records of the next n frames (default simulation_steps)
+
+        Stops early when done() is True. The consumer can stop earlier by
+        breaking out of the loop, the simulation can be continued later.
+        '''
+        if n is None:
+            n = self.config.simulation_steps
+        for i in range(n):
+            if self.done():
+                return
+            yield self.step()
+
+    def __iter__(self):
+        return self.frames()
+
+    def run(self, n=None):
+        '''runs n frames (default simulation_steps) or until done, returns the last record'''
+        for record in self.frames(n):
+            pass
 
+        if self.config.save_data:
+            self.population.save_data(self.tracker, self.writer)
+        if self.config.event_log_path is not None:
+            self.population.recorder.save(self.config.event_log_path)
 
+        for observer in self.observers:
+            if hasattr(observer, 'close'):
+                observer.close(self)
 
+        #workers of fork.py and sweeps exit without atexit, the files must be complete here.
+        #The thread is stopped as well, a next run starts it again
+        if self.writer is not None:
+            self.writer.close()
+
+        return self.record()
+
+
+class Console_Reporter():
+    __slots__ = []
+
+    '''observer that reports every frame to the console and the outcomes at the end'''
+    def __call__(self, simulation, record):
+        report_tstep(simulation.config, simulation.population, simulation.tracker)
+
+    def close(self, simulation):
+        report_outcomes(simulation.config, simulation.population)
+
+
+class Plot_Renderer():
+    __slots__ = ['fig',
+                 'spec',
+                 'ax1',
+                 'ax2',
+                 'renderer']
+
+    '''observer that draws every frame, see visualiser.Live_Renderer
+
+    Uses the given figure and axes, or builds them (build_fig) at the first frame.
+    '''
+    def __init__(self, fig=None, spec=None, ax1=None, ax2=None):
+        self.fig = fig
+        self.spec = spec
+        self.ax1 = ax1
+        self.ax2 = ax2
+        self.renderer = None
+
+    def __call__(self, simulation, record):
+        from visualiser import Live_Renderer
+        pop = simulation.population
+        if self.renderer is None:
+            self.renderer = Live_Renderer(simulation.config, simulation.society, pop,
+                                          self.fig, self.ax1, self.ax2)
+            self.fig, self.ax1, self.ax2 = self.renderer.fig, self.renderer.ax1, self.renderer.ax2
+        self.renderer.draw(record['frame'], pop.population, simulation.tracker,
+                           state_index = pop.state_index, writer = simulation.writer)
+
+
+def run(config,vir,pop,pop_tracker,soc, fig, spec, ax1, ax2 ):
+    '''run simulation, visualised if config.visualise is set'''
+    observers = [Console_Reporter()]
+    if config.visualise:
+        observers.insert(0, Plot_Renderer(fig, spec, ax1, ax2))
+    sim = Simulation(config, vir, pop, soc, pop_tracker, observers = observers)
+
+    try:
+        sim.run()
+    except KeyboardInterrupt:
+        print('\nCTRL-C caught, exiting')
+        sys.exit(1)
@@ -4,6 +4,8 @@ parameters for the simulation
 '''
 import numpy as np
 
+from sampling import sample_indices
+
 class Society():
     __slots__ = ['self_isolate',
                  'traveling_infects',
@@ -73,7 +75,7 @@ class Society():
         self.lockdown_percentage = lockdown_percentage
         self.lockdown_vector = np.zeros((pop.pop_size,))
         #lockdown vector is 1 for those not complying
-        self.lockdown_vector[np.random.uniform(size=(pop.pop_size,)) >= lockdown_compliance] = 1
+        self.lockdown_vector[sample_indices(pop.pop_size, 1 - lockdown_compliance)] = 1
 
 
     def set_self_isolation(self, config, self_isolate_proportion=0.9,
@@ -0,0 +1,138 @@
+'''
+file that contains the per-state index sets of the population, so
+that counts are read in O(1) and only the members of a state need to
+be visited, in stead of scanning the population matrix every time
+'''
+
+import numpy as np
+
+
+class Index_Partition():
+    __slots__ = ['group',
+                 'slot',
+                 'dense',
+                 'size']
+
+    '''partition of the population into numbered groups
+
+    Every member is in exactly one group. The members of each group are
+    kept in a dense array (of which the first 'size' entries are used),
+    and 'slot' holds the position of each member in the dense array of
+    its group, so members can be moved between groups in batches by
+    swapping them with the end of the dense array. Dense arrays grow when
+    needed, and indices are int32 if the population is small enough, to
+    keep the memory per member low.
+    '''
+    def __init__(self, groups, group_count):
+        '''builds the partition
+
+        Keyword arguments
+        -----------------
+        groups : ndarray
+            the group of each member, for example column 6 (state)
+
+        group_count : int
+            the number of groups, groups are numbered 0 .. group_count - 1
+        '''
+        pop_size = len(groups)
+        index_type = np.int32 if pop_size < 2**31 else np.int64
+        self.group = np.array(groups, dtype=np.int8)
+        self.slot = np.zeros(pop_size, dtype=index_type)
+        self.dense = []
+        self.size = np.zeros(group_count, dtype=np.int64)
+
+        for g in range(group_count):
+            members = np.flatnonzero(self.group == g).astype(index_type)
+            self.dense.append(members)
+            self.slot[members] = np.arange(len(members))
+            self.size[g] = len(members)
+
+    def count(self, group):
+        '''number of members in group'''
+        return int(self.size[group])
+
+    def members(self, group):
+        '''indices of the members of group (unordered, do not modify)'''
+        return self.dense[group][:self.size[group]]
+
+    def move(self, indices, group):
+        '''moves members to group, members already in it are left alone
+
+        Keyword arguments
+        -----------------
+        indices : ndarray or list
+            unique indices of the members to move
+
+        group : int
+            the group to move them to
+        '''
+        indices = np.asarray(indices, dtype=np.int64)
+        old_groups = self.group[indices]
+        moving = indices[old_groups != group]
+        if len(moving) == 0:
+            return
+
+        for old_group in np.unique(old_groups[old_groups != group]):
+            self._remove(indices[old_groups == old_group], old_group)
+
+        #append to the new group
+        start = self.size[group]
+        if start + len(moving) > len(self.dense[group]):
+            grown = np.zeros(max(2 * len(self.dense[group]), start + len(moving)),
+                             dtype=self.slot.dtype)
+            grown[:start] = self.dense[group][:start]
+            self.dense[group] = grown
+        self.dense[group][start:start + len(moving)] = moving
+        self.slot[moving] = np.arange(start, start + len(moving))
+        self.size[group] += len(moving)
+        self.group[moving] = group
+
+    def _remove(self, indices, group):
+        '''removes members from group by filling their slots with members from the end'''
+        keep = self.size[group] - len(indices)
+        #mark the members that leave, so they can be told apart at the end
+        self.group[indices] = -1
+        tail = self.dense[group][keep:self.size[group]]
+        fillers = tail[self.group[tail] != -1]
+        holes = self.slot[indices]
+        holes = holes[holes < keep]
+
+        self.dense[group][holes] = fillers
+        self.slot[fillers] = holes
+        self.size[group] = keep
+
+
+class Population_states():
+    __slots__ = ['state',
+                 'treatment',
+                 'destination']
+
+    '''index sets and counts of the population per state
+
+    Keeps an Index_Partition of the state (column 6: 0=healthy, 1=sick,
+    2=immune, 3=dead, 4=immune but infectious), of being in treatment
+    (column 10) and of being at destination (column 12). The partitions
+    are updated by the transition methods of Population (set_state,
+    set_treatment and set_at_destination); code that writes those columns
+    directly needs to call Population.build_state_index afterwards.
+    '''
+    def __init__(self, population):
+        self.state = Index_Partition(population[:,6], 5)
+        self.treatment = Index_Partition(population[:,10], 2)
+        self.destination = Index_Partition(population[:,12], 2)
+
+    def count(self, state):
+        '''number of people in state'''
+        return self.state.count(state)
+
+    def members(self, state):
+        '''indices of the people in state, sorted'''
+        return np.sort(self.state.members(state))
+
+    def in_treatment(self):
+        '''number of people in treatment'''
+        return self.treatment.count(1)
+
+    def at_destination(self):
+        '''number of people that arrived at their destination'''
+        return self.destination.count(1)
@@ -6,6 +6,7 @@ parameters for the simulation
 import numpy as np
 
 from population import Population
+from scheduler import Recovery_Calendar
 
 class Stratified_Population(Population):
     __slots__ = [
@@ -32,6 +33,9 @@ class Stratified_Population(Population):
                  critical_age = 75, #age at and beyond which mortality risk reaches maximum
                  critical_mortality_chance = 0.2, #maximum mortality risk for older age
                  risk_increase = 'quadratic', #whether risk between risk and critical age increases 'linear' or 'quadratic'
+                 column_store = False, #typed column per attribute in stead of a float64 matrix
+                 memmap_path = None, #file to keep the population matrix in, in stead of memory
+                 chunk_size = None, #number of people initialized and moved at once, None for all
                  ):
         # Super class
         self.xbounds = xbounds
@@ -41,6 +45,16 @@ class Stratified_Population(Population):
         self.wander_range = wander_range
         self.wander_factor = wander_factor 
         self.wander_factor_dest = wander_factor_dest 
+        self.recovery_calendar = Recovery_Calendar() #used if config.schedule_recoveries is set
+        self.motion_stage = None #Motion_Stage, built at the first time step
+        self.state_index = None #Population_states, built with the population matrix
+        self.trajectory = None #Trajectory_Writer, opened at the first saved frame
+        self.recorder = None #Event_Log that records state transitions, if set
+        self.column_store = column_store #whether to keep the population in a Population_columns
+        self.memmap_path = memmap_path
+        if chunk_size is None and memmap_path is not None:
+            chunk_size = 2**20 #never build or move a memory mapped population at once
+        self.chunk_size = chunk_size
         
         # Actual class
         self.mean_age = mean_age         
@@ -51,32 +65,15 @@ class Stratified_Population(Population):
         self.risk_increase = risk_increase #whether risk between risk and critical age increases 'linear' or 'quadratic'
         
         
-    #Overwrite initialize_population_matrix function 
-    def initialize_population_matrix(self):
-        self.population = np.zeros((self.pop_size, 15))
-        #initalize unique IDs
-        self.population[:,0] = [x for x in range(self.pop_size)]
-        #initialize random coordinates
-        self.population[:,1] = np.random.uniform(low = self.xbounds[0] + 0.05, high = self.xbounds[1] - 0.05, 
-                                            size = (self.pop_size,))
-        self.population[:,2] = np.random.uniform(low = self.ybounds[0] + 0.05, high = self.ybounds[1] - 0.05, 
-                                            size=(self.pop_size,))
-        #initialize random headings -1 to 1
-        self.population[:,3] = np.random.normal(loc = 0, scale = 1/3, 
-                                           size=(self.pop_size,))
-        self.population[:,4] = np.random.normal(loc = 0, scale = 1/3, 
-                                           size=(self.pop_size,))
-        #initialize random speeds
-        self.population[:,5] = np.random.normal(self.speed, self.speed / 3)
-        #initalize ages
+    #Overwrite initialize_ages function 
+    def initialize_ages(self, chunk):
+        '''draws the ages (column 7) of a chunk of new people'''
         std_age = (self.max_age - self.mean_age) / 3
-        self.population[:,7] = np.int32(np.random.normal(loc = self.mean_age, 
-                                                    scale = std_age, 
-                                                    size=(self.pop_size,)))
-        self.population[:,7] = np.clip(self.population[:,7], a_min = 0, 
-                                  a_max = self.max_age) #clip those younger than 0 years
-        #build recovery_vector
-        self.population[:,9] = np.random.normal(loc = 0.5, scale = 0.5 / 3, size=(self.pop_size,))
+        ages = np.int32(np.random.normal(loc = self.mean_age, 
+                                         scale = std_age, 
+                                         size=(len(chunk),)))
+        chunk[:,7] = np.clip(ages, a_min = 0, 
+                             a_max = self.max_age) #clip those younger than 0 years
     
         
     
@@ -0,0 +1,256 @@
+'''
+parameter sweep engine: runs every point of a parameter grid a number
+of times (replicates) on a process pool, and writes the summaries in the
+format of the density studies in data/
+
+for each point the summary CSV holds the mean, median, max and min over
+the replicates of the mean number of infected and fatalities of a run,
+and {point}_infected.npy / {point}_fatalities.npy hold the mean time
+series of the replicates (zero padded to the longest run). Workers
+aggregate batches of runs in Ensemble_Aggregators (see ensemble.py) that
+are merged per point, so memory does not grow with the number of
+replicates (medians are within 1%). For example,
+the medium density study is reproduced with:
+
+    python -m sweep --output data/medium_density --replicates 20 \
+        --grid society.self_isolate_proportion=0.99,0.95,0.9,0.8,0.7,0.6,0.5,0.25,0.0 \
+        --set society.self_isolate=True --pop-size 1000
+
+all arguments of run_model (--scenario, --set, --pop-size, ...) describe
+the scenario that is shared by all points of the grid.
+'''
+
+import argparse
+import itertools
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import run_model
+from ensemble import Ensemble_Aggregator
+from utils import check_folder
+
+
+def parameter_grid(grid):
+    '''expands a grid into the list of its points
+
+    Keyword arguments
+    -----------------
+    grid : dict
+        maps 'section.name' (section is population, society, virus or config)
+        to the list of values to sweep, for example
+        {'society.self_isolate_proportion': [0.99, 0.5], 'population.pop_size': [600, 2000]}
+
+    Returns
+    -------
+    list of dicts that map each 'section.name' to one of its values
+    '''
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def run_seed(base_seed, point_number, replicate):
+    '''deterministic seed of a run, independent of the order runs are executed in'''
+    return int(np.random.SeedSequence([base_seed, point_number, replicate]).generate_state(1)[0])
+
+
+def point_scenario(scenario, point, seed):
+    '''returns a copy of scenario with the values of a grid point and the seed set'''
+    scenario = dict(scenario)
+    for section in run_model.SECTIONS:
+        scenario[section] = dict(scenario[section])
+    for key, value in point.items():
+        section, name = key.split('.', 1)
+        scenario[section][name] = value
+    scenario['seed'] = seed
+    return scenario
+
+
+def run_replicate(scenario):
+    '''runs one simulation, returns its infected and fatalities time series'''
+    sim = run_model.build_simulation(scenario, report = 'none')
+    sim.run()
+    return (np.asarray(sim.tracker.infectious, dtype=np.float64),
+            np.asarray(sim.tracker.fatalities, dtype=np.float64))
+
+
+def point_label(point):
+    '''name of a grid point, used in the summary and as file name prefix'''
+    return '_'.join('%s' %value for value in point.values())
+
+
+class Point_Aggregate():
+    __slots__ = ['infected',
+                 'fatalities',
+                 'infected_means',
+                 'fatalities_means']
+
+    '''streaming aggregate of the runs of a grid point
+
+    The infected and fatalities time series are zero padded (as the
+    original density studies did), only their mean is written, so they
+    keep no quantiles. The mean of each run over time is aggregated as a
+    series of one frame.
+    '''
+    def __init__(self):
+        self.infected = Ensemble_Aggregator(padding = 'zero', accuracy = None)
+        self.fatalities = Ensemble_Aggregator(padding = 'zero', accuracy = None)
+        self.infected_means = Ensemble_Aggregator()
+        self.fatalities_means = Ensemble_Aggregator()
+
+    def add(self, infected, fatalities):
+        '''adds the time series of one run'''
+        self.infected.add(infected)
+        self.fatalities.add(fatalities)
+        self.infected_means.add([np.mean(infected)])
+        self.fatalities_means.add([np.mean(fatalities)])
+
+    def merge(self, other):
+        self.infected.merge(other.infected)
+        self.fatalities.merge(other.fatalities)
+        self.infected_means.merge(other.infected_means)
+        self.fatalities_means.merge(other.fatalities_means)
+
+    def summary(self):
+        '''summary of the runs, as written by write_summaries'''
+        return {'infected_mean' : self.infected_means.mean[0],
+                'infected_median' : self.infected_means.median()[0],
+                'infected_max' : self.infected_means.maximum[0],
+                'infected_min' : self.infected_means.minimum[0],
+                'fatalities_mean' : self.fatalities_means.mean[0],
+                'fatalities_median' : self.fatalities_means.median()[0],
+                'fatalities_max' : self.fatalities_means.maximum[0],
+                'fatalities_min' : self.fatalities_means.minimum[0],
+                'infected_series' : self.infected.mean,
+                'fatalities_series' : self.fatalities.mean}
+
+
+def run_batch(task):
+    '''runs a batch of replicates of one point, returns the point number and their aggregate'''
+    point_number, scenarios = task
+    aggregate = Point_Aggregate()
+    for scenario in scenarios:
+        aggregate.add(*run_replicate(scenario))
+    return point_number, aggregate
+
+
+def write_summaries(output, points, summaries):
+    '''writes output.csv and the mean time series per point to the output folder'''
+    check_folder(output)
+    columns = ['infected_mean', 'infected_median', 'infected_max', 'infected_min',
+               'fatalities_mean', 'fatalities_median', 'fatalities_max', 'fatalities_min']
+
+    with open('%s.csv' %output, 'w') as f:
+        names = [key.split('.', 1)[1] for key in points[0]] if len(points[0]) > 0 else ['point']
+        f.write('%s,%s\n' %('_'.join(names), ','.join(columns)))
+        for point, summary in zip(points, summaries):
+            f.write('%s,%s\n' %(point_label(point), ','.join('%f' %summary[c] for c in columns)))
+
+    for point, summary in zip(points, summaries):
+        np.save('%s/%s_infected.npy' %(output, point_label(point)), summary['infected_series'])
+        np.save('%s/%s_fatalities.npy' %(output, point_label(point)), summary['fatalities_series'])
+
+
+def run_sweep(scenario, grid, replicates=10, processes=None, base_seed=100, output=None,
+              batch_size=None):
+    '''runs all points of a parameter grid, each replicates times, on a process pool
+
+    Keyword arguments
+    -----------------
+    scenario : dict
+        the scenario shared by all points, see run_model.build_scenario
+
+    grid : dict
+        the values to sweep per 'section.name', see parameter_grid
+
+    replicates : int
+        the number of runs per point
+
+    processes : int
+        the number of worker processes, defaults to the number of cores
+
+    base_seed : int
+        seed from which the seed of every run is derived (see run_seed), so
+        results do not depend on the number of processes
+
+    output : str
+        if given, the summaries are written to output.csv and to the folder
+        output (see write_summaries)
+
+    batch_size : int
+        the number of replicates a worker runs and aggregates before handing 
+        the aggregate to the reducer, defaults to the square root of replicates.
+        Does not depend on processes, so neither do the results
+
+    Returns
+    -------
+    the list of grid points and the list of their summaries (see Point_Aggregate.summary)
+    '''
+    points = parameter_grid(grid)
+    if batch_size is None:
+        batch_size = max(int(math.sqrt(replicates)), 1)
+    tasks = [(p, [point_scenario(scenario, point, run_seed(base_seed, p, r))
+                  for r in range(start, min(start + batch_size, replicates))])
+             for p, point in enumerate(points) for start in range(0, replicates, batch_size)]
+
+    #merge the aggregates of the batches per point, in task order
+    aggregates = [Point_Aggregate() for point in points]
+    with ProcessPoolExecutor(max_workers = processes or os.cpu_count()) as pool:
+        for point_number, aggregate in pool.map(run_batch, tasks):
+            aggregates[point_number].merge(aggregate)
+
+    summaries = [aggregate.summary() for aggregate in aggregates]
+
+    if output is not None:
+        write_summaries(output, points, summaries)
+    return points, summaries
+
+
+def parse_grid(settings):
+    '''parses --grid SECTION.NAME=V1,V2,.. arguments into a grid'''
+    grid = {}
+    for setting in settings:
+        key, separator, values = setting.partition('=')
+        if not separator or key.split('.', 1)[0] not in run_model.SECTIONS or '.' not in key:
+            raise ValueError('--grid %s not understood! Use SECTION.NAME=VALUE1,VALUE2,.., with SECTION one of %s'
+                             %(setting, ', '.join(run_model.SECTIONS)))
+        grid[key] = [run_model.parse_value(value) for value in values.split(',')]
+    return grid
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog = 'python -m sweep',
+                                     description = 'runs a parameter sweep, other arguments are passed to run_model')
+    parser.add_argument('--grid', action = 'append', default = [], metavar = 'SECTION.NAME=V1,V2,..',
+                        help = 'values to sweep of a keyword argument (can be repeated)')
+    parser.add_argument('--replicates', type = int, default = 10, help = 'runs per grid point')
+    parser.add_argument('--processes', type = int, help = 'worker processes (default: all cores)')
+    parser.add_argument('--output', help = 'summary is written to OUTPUT.csv and OUTPUT/')
+    args, scenario_arguments = parser.parse_known_args(argv)
+
+    scenario_args = run_model.parse_arguments(scenario_arguments + ['--report', 'none'])
+    try:
+        scenario = run_model.build_scenario(scenario_args)
+        grid = parse_grid(args.grid)
+        for key in grid:
+            run_model.check_setting(scenario, *key.split('.', 1), setting = '--grid %s' %key)
+    except ValueError as error:
+        print(error, file = sys.stderr)
+        return 2
+
+    #without a seed, the seeds of the runs are derived from fresh entropy
+    base_seed = scenario['seed'] if scenario['seed'] is not None else np.random.SeedSequence().entropy
+    points, summaries = run_sweep(scenario, grid, args.replicates, args.processes,
+                                  base_seed = base_seed, output = args.output)
+    for point, summary in zip(points, summaries):
+        print('%s: infected mean %f, fatalities mean %f' %(point_label(point) or 'scenario',
+                                                           summary['infected_mean'],
+                                                           summary['fatalities_mean']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
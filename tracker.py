@@ -26,13 +26,27 @@ class Population_trackers():
         #PLACEHOLDER - whether recovered individual can be reinfected
         self.reinfect = False 
 
-    def update_counts(self, population):
-        '''docstring
+    def update_counts(self, population, state_index=None):
+        '''appends the current counts per state
+
+        Keyword arguments
+        -----------------
+        population : ndarray
+            the array containing all the population information
+
+        state_index : Population_states
+            the index sets of the population (Population.state_index), if given
+            the counts are read from it in stead of scanning the population
         '''
         pop_size = population.shape[0]
-        self.infectious.append(len(population[population[:,6] == 1]))
-        self.recovered.append(len(population[population[:,6] == 2]))
-        self.fatalities.append(len(population[population[:,6] == 3]))
+        if state_index is None:
+            self.infectious.append(len(population[population[:,6] == 1]))
+            self.recovered.append(len(population[population[:,6] == 2]))
+            self.fatalities.append(len(population[population[:,6] == 3]))
+        else:
+            self.infectious.append(state_index.count(1))
+            self.recovered.append(state_index.count(2))
+            self.fatalities.append(state_index.count(3))
 
         if self.reinfect:
             self.susceptible.append(pop_size - (self.infectious[-1] +
@@ -0,0 +1,235 @@
+'''
+file that contains the trajectory store: one append-only file with the
+population of many frames, in stead of a population_<frame>.npy file per
+saved frame
+
+the file starts with a header (json, padded to HEADER_SIZE bytes) that
+describes the layout, followed by the static columns (stored once) and
+then one fixed size record per saved frame: the frame number and the
+dynamic columns, each in the dtype of the column store (see columns.py),
+with x and y optionally quantized to 16 bit. Because records have a fixed
+size, any frame is found without an index, and Trajectory reads the file
+lazily as a numpy memmap, for example in a notebook:
+
+    trajectory = Trajectory('pop_data/trajectory.bin')
+    trajectory.frames               #frame number of every record
+    trajectory.column('state')      #memmap of (records, pop_size), nothing read yet
+    trajectory.column('x', 100:200) #dequantized x of records 100 to 200
+    trajectory.population(500)      #population matrix of frame 500
+'''
+
+import json
+import os
+
+import numpy as np
+
+from columns import COLUMNS
+
+HEADER_SIZE = 4096
+MAGIC = 'population trajectory'
+TRAJECTORY_VERSION = 1
+
+#columns that change during a run and columns that are set once
+DYNAMIC_COLUMNS = ['x', 'y', 'state', 'infected_since', 'treatment', 'destination', 'at_destination']
+STATIC_COLUMNS = ['id', 'age']
+
+COLUMN_NUMBERS = {name: number for number, (name, dtype) in enumerate(COLUMNS)}
+COLUMN_TYPES = dict(COLUMNS)
+
+
+def coordinate_range(config, soc=None, margin=0.1):
+    '''(low, high) range for quantizing the coordinates of a simulation
+
+    Spans the roaming bounds, the plot extent and, with self isolation, the
+    isolation area of soc, widened by margin times its size on both sides.
+    '''
+    values = list(config.xbounds) + list(config.ybounds) + list(config.x_plot) + list(config.y_plot)
+    if soc is not None and soc.self_isolate and soc.isolation_bounds is not None:
+        values += list(soc.isolation_bounds)
+    low, high = min(values), max(values)
+    return (low - margin * (high - low), high + margin * (high - low))
+
+
+def _read_header(path):
+    with open(path, 'rb') as f:
+        header = json.loads(f.read(HEADER_SIZE).rstrip(b'\0').decode())
+    if header.get('magic') != MAGIC or header.get('version') != TRAJECTORY_VERSION:
+        raise ValueError('%s not understood! Not a trajectory file of version %i'
+                         %(path, TRAJECTORY_VERSION))
+    return header
+
+
+def _layout(header):
+    '''dtypes of the static block and of a frame record'''
+    pop_size = header['pop_size']
+    static = np.dtype([(name, np.dtype(dtype), (pop_size,))
+                       for name, dtype in zip(header['static'], header['static_dtypes'])])
+    record = np.dtype([('frame', np.int64)] +
+                      [(name, np.dtype(dtype), (pop_size,))
+                       for name, dtype in zip(header['columns'], header['dtypes'])])
+    return static, record
+
+
+class Trajectory_Writer():
+    __slots__ = ['path',
+                 'header',
+                 'record_type',
+                 'data_start']
+
+    '''appends frames of a population to a trajectory file
+
+    The file is opened per appended frame, so nothing stays open between
+    frames and a crash loses at most the frame that was being written (a
+    partial record at the end is ignored by Trajectory and overwritten by
+    the next append). Appending a frame that is not after the last stored
+    frame first truncates the file to the frames before it, so a run that
+    is restarted or resumed from a checkpoint continues the trajectory in
+    stead of duplicating frames.
+    '''
+    def __init__(self, path, pop_size, columns=DYNAMIC_COLUMNS, quantize=(0.0, 1.0)):
+        '''
+        Keyword arguments
+        -----------------
+        path : str
+            the trajectory file, continued if it exists with the same layout
+
+        pop_size : int
+            the size of the population
+
+        columns : list
+            names of the dynamic columns to store (see columns.COLUMNS)
+
+        quantize : tuple or None
+            (low, high) bounds of the coordinates: x and y are stored as 16 bit
+            integers over this range (a resolution of (high - low) / 65535),
+            or as float32 if None. See coordinate_range. Appending a frame
+            with coordinates outside the range raises a ValueError
+        '''
+        for name in columns:
+            if name not in COLUMN_TYPES:
+                raise ValueError('column %s not understood! Must be one of %s'
+                                 %(name, ', '.join(COLUMN_TYPES)))
+        dtypes = [np.dtype(np.uint16 if quantize is not None and name in ['x', 'y']
+                           else COLUMN_TYPES[name]).str for name in columns]
+        self.path = path
+        self.header = {'magic' : MAGIC,
+                       'version' : TRAJECTORY_VERSION,
+                       'pop_size' : pop_size,
+                       'columns' : list(columns),
+                       'dtypes' : dtypes,
+                       'quantize' : None if quantize is None else [float(quantize[0]), float(quantize[1])],
+                       'static' : STATIC_COLUMNS,
+                       'static_dtypes' : [np.dtype(COLUMN_TYPES[name]).str for name in STATIC_COLUMNS]}
+        static_type, self.record_type = _layout(self.header)
+        self.data_start = HEADER_SIZE + static_type.itemsize
+
+        if os.path.exists(path) and _read_header(path) != self.header:
+            raise ValueError('%s is a trajectory with an other layout, remove it or use an other folder' %path)
+
+    def _create(self, population):
+        '''writes the header and the static columns'''
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok = True)
+        static_type, record_type = _layout(self.header)
+        static = np.zeros(1, dtype=static_type)
+        for name in STATIC_COLUMNS:
+            static[name][0] = population[:,COLUMN_NUMBERS[name]]
+        with open(self.path, 'wb') as f:
+            f.write(json.dumps(self.header).encode().ljust(HEADER_SIZE, b'\0'))
+            static.tofile(f)
+
+    def _stored_frames(self):
+        '''frame numbers of the complete records in the file'''
+        records = (os.path.getsize(self.path) - self.data_start) // self.record_type.itemsize
+        if records <= 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.memmap(self.path, dtype=self.record_type, mode='r', offset=self.data_start,
+                         shape=(records,))['frame']
+
+    def append(self, frame, population):
+        '''appends the dynamic columns of population as frame'''
+        if not os.path.exists(self.path):
+            self._create(population)
+
+        record = np.zeros(1, dtype=self.record_type)
+        record['frame'] = frame
+        quantize = self.header['quantize']
+        for name in self.header['columns']:
+            values = population[:,COLUMN_NUMBERS[name]]
+            if quantize is not None and name in ['x', 'y']:
+                if len(values) > 0 and (values.min() < quantize[0] or values.max() > quantize[1]):
+                    raise ValueError('%s coordinates of frame %i not understood! Outside the quantize range %s of %s'
+                                     %(name, frame, quantize, self.path))
+                values = np.rint((values - quantize[0]) / (quantize[1] - quantize[0]) * 65535)
+            record[name][0] = values
+
+        #keep the frames before this one, drop partial and later records
+        frames = self._stored_frames()
+        keep = int(np.searchsorted(frames, frame))
+        with open(self.path, 'r+b') as f:
+            f.truncate(self.data_start + keep * self.record_type.itemsize)
+            f.seek(0, os.SEEK_END)
+            record.tofile(f)
+
+
+class Trajectory():
+    __slots__ = ['path',
+                 'header',
+                 'static',
+                 'records']
+
+    '''read only, lazy view of a trajectory file, see Trajectory_Writer'''
+    def __init__(self, path):
+        self.path = path
+        self.header = _read_header(path)
+        static_type, record_type = _layout(self.header)
+        data_start = HEADER_SIZE + static_type.itemsize
+        count = max((os.path.getsize(path) - data_start) // record_type.itemsize, 0)
+        self.static = np.memmap(path, dtype=static_type, mode='r', offset=HEADER_SIZE, shape=(1,))[0]
+        self.records = np.memmap(path, dtype=record_type, mode='r', offset=data_start, shape=(count,))
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def frames(self):
+        '''frame number of every record'''
+        return self.records['frame']
+
+    @property
+    def columns(self):
+        '''names of the stored columns, static and dynamic'''
+        return self.header['static'] + self.header['columns']
+
+    def record(self, frame):
+        '''the record number of a frame'''
+        record = int(np.searchsorted(self.frames, frame))
+        if record == len(self) or self.frames[record] != frame:
+            raise ValueError('frame %i not understood! It is not stored in %s' %(frame, self.path))
+        return record
+
+    def column(self, name, records=slice(None)):
+        '''values of a column in the selected records (all by default)
+
+        Returns the memmap itself (read lazily) for columns that are not
+        quantized, and the dequantized coordinates for x and y. Static
+        columns have one value per person.
+        '''
+        if name in self.header['static']:
+            return self.static[name]
+        if name not in self.header['columns']:
+            raise ValueError('column %s not understood! Stored are %s' %(name, ', '.join(self.columns)))
+        values = self.records[name][records]
+        quantize = self.header['quantize']
+        if quantize is not None and name in ['x', 'y']:
+            return quantize[0] + values * ((quantize[1] - quantize[0]) / 65535)
+        return values
+
+    def population(self, frame):
+        '''population matrix of a frame, with zeros in the columns that are not stored'''
+        record = self.record(frame)
+        population = np.zeros((self.header['pop_size'], 15))
+        for name in self.columns:
+            values = self.column(name, record)
+            population[:,COLUMN_NUMBERS[name]] = values
+        return population
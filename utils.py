@@ -7,4 +7,17 @@ import os
 def check_folder(folder='render/'):
     '''check if folder exists, make if not present'''
     if not os.path.exists(folder):
-            os.makedirs(folder)
\ No newline at end of file
+            os.makedirs(folder)
+
+
+def jit_kernels(config, population=None):
+    '''returns the jit module if its numba kernels are used, None otherwise
+
+    jit (and numba) are only imported when config.use_numba is set, so
+    runs without numba start fast. See jit.enabled for when the kernels
+    are used.
+    '''
+    if not config.use_numba:
+        return None
+    import jit
+    return jit if jit.enabled(config, population) else None
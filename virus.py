@@ -6,7 +6,11 @@ parameters for the simulation
 # See more on https://www.python-course.eu/python3_slots.php
 
 import numpy as np
+
+from infection import find_contacts
+from sampling import sample_bernoulli, sample_indices
 from stratifiedPopulation import Stratified_Population
+from utils import jit_kernels
 
 
 class Virus():
@@ -15,7 +19,7 @@ class Virus():
     # an instance of an object can possess.    
         
     __slots__ = ['infection_range', 'infection_chance',\
-                  'recovery_duration']
+                  'recovery_duration', '_mortality_table']
     
     # Constructor            
     def __init__(self,infection_range=0.01, infection_chance=0.02 , 
@@ -40,6 +44,7 @@ class Virus():
         self.infection_range   = infection_range 
         self.infection_chance  = infection_chance  
         self.recovery_duration = recovery_duration   
+        self._mortality_table = None #cached (key, table) of mortality_by_age
         
 
     def infect(self,pop,soc,config, 
@@ -48,7 +53,15 @@ class Virus():
         '''finds new infections.
         
         Function that finds new infections in an area around infected persons
-        defined by infection_range, and infects others with chance infection_chance
+        defined by infection_range, and infects others with chance infection_chance.
+        If config.schedule_recoveries is set, newly infected are put in the
+        recovery calendar (see schedule_recovery).
+        How nearby people are found is set by config.infection_backend: 'naive'
+        scans the population once per patient, 'grid' uses a cell list and 'tree'
+        a kd-tree, both built once per time step (see infection.py). All die rolls
+        of a time step are drawn at once (see sampling.py) and treatment beds are 
+        assigned in a single vectorized pass. The state changes go through
+        Population.set_state, so pop.state_index stays up to date.
         
         Keyword arguments
         -----------------
@@ -82,7 +95,8 @@ class Virus():
     
         destinations : list or ndarray
             the destinations vector containing destinations for each individual in the population.
-            Needs to be of same length as population
+            Needs to be of same length as population. Destinations are set on pop.destinations
+            (see Population.go_to_location), which is returned if this is not empty
     
         location_no : int
             the location number, used as index for destinations array if multiple possible
@@ -96,93 +110,80 @@ class Virus():
             whether infected people heading to a destination can still infect others on the way there
         '''
         population = pop.population
+        infectors = None #who infected whom, only known when contacts are rolled one by one
         
-        #mark those already infected first
-        infected_previous_step = population[population[:,6] == 1]
-        healthy_previous_step = population[population[:,6] == 0]
-    
-        new_infections = []
-    
-        #if less than half are infected, slice based on infected (to speed up computation)
-        if len(infected_previous_step) < (pop.pop_size // 2):
-            for patient in infected_previous_step:
-                #define infection zone for patient
-                infection_zone = [patient[1] - self.infection_range, patient[2] - self.infection_range,
-                                    patient[1] + self.infection_range, patient[2] + self.infection_range]
-    
-                #find healthy people surrounding infected patient
-                if soc.traveling_infects or patient[11] == 0:
-                    indices = pop.find_nearby(infection_zone, kind = 'healthy')
+        jit = jit_kernels(config, population)
+        if jit is not None:
+            #compiled kernel that finds contacts and rolls the dice in one loop
+            #(the kernel writes column 6, set_state below updates the state index)
+            new_infections = jit.find_infections(population, self.infection_range,
+                                                 self.infection_chance,
+                                                 traveling_infects = soc.traveling_infects,
+                                                 shape = config.infection_shape)
+
+        else:
+            #mark those already infected first
+            infected_previous_step = pop.state_index.members(1)
+            healthy_previous_step = pop.state_index.members(0)
+
+            #if less than half are infected, slice based on infected (to speed up computation)
+            if len(infected_previous_step) < (pop.pop_size // 2):
+                #find healthy people surrounding infected patients
+                if soc.traveling_infects:
+                    patients = infected_previous_step
                 else:
-                    indices = []
-    
-                for idx in indices:
-                    #roll die to see if healthy person will be infected
-                    if np.random.random() < self.infection_chance:
-                        population[idx][6] = 1
-                        population[idx][8] = config.frame
-                        if len(population[population[:,10] == 1]) <= soc.healthcare_capacity:
-                            population[idx][10] = 1
-                            if send_to_location:
-                                #send to location if die roll is positive
-                                if np.random.uniform() <= location_odds:
-                                    population[idx],\
-                                    destinations[idx] = pop.go_to_location(population[idx],
-                                                                       destinations[idx],
-                                                                       location_bounds, 
-                                                                       dest_no=location_no)
-                            else:
-                                pass
-                        new_infections.append(idx)
+                    patients = infected_previous_step[population[infected_previous_step,11] == 0]
+
+                sources, contacts = find_contacts(population, patients, healthy_previous_step,
+                                                  self.infection_range,
+                                                  backend = config.infection_backend,
+                                                  shape = config.infection_shape)
+
+                #roll one die per contact, a healthy person is infected at the
+                #first contact (in patient order) whose die roll is positive
+                positive = sample_indices(len(contacts), self.infection_chance)
+                new_infections, first_contact = np.unique(contacts[positive], return_index = True)
+                order = np.argsort(first_contact)
+                new_infections = new_infections[order]
+                infectors = sources[positive][first_contact[order]]
     
-        else:
-            #if more than half are infected slice based in healthy people (to speed up computation)
-                
-            
-            
-            for person in healthy_previous_step:
-                #define infecftion range around healthy person
-                infection_zone = [person[1] - self.infection_range, person[2] - self.infection_range,
-                                    person[1] + self.infection_range, person[2] + self.infection_range]
-    
-                if person[6] == 0: #if person is not already infected, find if infected are nearby
-                    #find infected nearby healthy person
-                    if soc.traveling_infects:
-                        poplen = pop.find_nearby(infection_zone, 
-                                             traveling_infects = True,
-                                             kind = 'infected')
-                    else:
-                        poplen = pop.find_nearby(infection_zone, 
-                                             traveling_infects = True,
-                                             kind = 'infected',
-                                             infected_previous_step = infected_previous_step)
-                    
-                    if poplen > 0:
-                        if np.random.random() < (self.infection_chance * poplen):
-                            #roll die to see if healthy person will be infected
-                            population[np.int32(person[0])][6] = 1
-                            population[np.int32(person[0])][8] = config.frame
-                            if len(population[population[:,10] == 1]) <= soc.healthcare_capacity:
-                                population[np.int32(person[0])][10] = 1
-                                if send_to_location:
-                                    #send to location and add to treatment if die roll is positive
-                                    if np.random.uniform() < location_odds:
-                                        population[np.int32(person[0])],\
-                                        destinations[np.int32(person[0])] = pop.go_to_location(population[np.int32(person[0])],
-                                                                                            destinations[np.int32(person[0])],
-                                                                                            location_bounds, 
-                                                                                            dest_no=location_no)
-    
-    
-                            new_infections.append(np.int32(person[0]))
+            else:
+                #if more than half are infected slice based in healthy people (to speed up computation)
+                near_healthy, _ = find_contacts(population, healthy_previous_step,
+                                                infected_previous_step,
+                                                self.infection_range,
+                                                backend = config.infection_backend,
+                                                shape = config.infection_shape)
+
+                #odds of infection scale with the number of infected nearby
+                infected_nearby = np.bincount(near_healthy, minlength = len(population))
+                at_risk = healthy_previous_step[infected_nearby[healthy_previous_step] > 0]
+                new_infections = at_risk[sample_bernoulli(self.infection_chance * infected_nearby[at_risk])]
+
+        pop.set_state(new_infections, 1, infectors)
+        population[new_infections,8] = config.frame
+
+        if config.schedule_recoveries:
+            self.schedule_recovery(pop, new_infections, config.frame)
+
+        #fill the remaining treatment beds in order of infection. A bed is given as long
+        #as the number in treatment before admission does not exceed capacity
+        beds = max(soc.healthcare_capacity - pop.state_index.in_treatment() + 1, 0)
+        treated = new_infections[:beds]
+        pop.set_treatment(treated, 1)
+
+        if send_to_location:
+            #send to location if die roll is positive
+            pop.go_to_location(treated, location_bounds, dest_no = location_no,
+                               location_odds = location_odds)
     
         if len(new_infections) > 0 and config.verbose:
-            print('\nat timestep %i these people got sick: %s' %(config.frame, new_infections))
+            print('\nat timestep %i these people got sick: %s' %(config.frame, new_infections.tolist()))
     
         if len(destinations) == 0:
             return population
         else:
-            return population, destinations
+            return population, pop.destinations
     
     
     def recover_or_die(self,pop,soc,config):
@@ -232,50 +233,129 @@ class Virus():
             whether to report to terminal the recoveries and deaths for each simulation step
         '''
         population = pop.population
-        #find infected people
-        infected_people = population[population[:,6] == 1]
-    
-        #define vector of how long everyone has been sick
-        illness_duration_vector = config.frame - infected_people[:,8]
-        
-        recovery_odds_vector = (illness_duration_vector - self.recovery_duration[0]) / np.ptp(self.recovery_duration)
-        recovery_odds_vector = np.clip(recovery_odds_vector, a_min = 0, a_max = None)
-    
-        #update states of sick people 
-        indices = infected_people[:,0][recovery_odds_vector >= infected_people[:,9]]
-    
-        recovered = []
-        fatalities = []
-    
-        #decide whether to die or recover
-        for idx in indices:
-            #Non-lethal virus
-            updated_mortality_chance = 0
-    
-            if infected_people[infected_people[:,0] == int(idx)][:,10] == 0 and soc.treatment_dependent_risk:
-                #if person is not in treatment, increase risk by no_treatment_factor
-                updated_mortality_chance = updated_mortality_chance * soc.no_treatment_factor
-            elif infected_people[infected_people[:,0] == int(idx)][:,10] == 1 and soc.treatment_dependent_risk:
-                #if person is in treatment, decrease risk by 
-                updated_mortality_chance = updated_mortality_chance * soc.treatment_factor
-    
-            if np.random.random() <= updated_mortality_chance:
-                #die
-                infected_people[:,6][infected_people[:,0] == idx] = 3
-                infected_people[:,10][infected_people[:,0] == idx] = 0
-                fatalities.append(np.int32(infected_people[infected_people[:,0] == idx][:,0][0]))
+
+        jit = jit_kernels(config, population)
+        if jit is not None and not config.schedule_recoveries:
+            recovered, fatalities = jit.recover_or_die(population, config.frame,
+                                                       self.recovery_duration,
+                                                       self.mortality_by_age(pop), soc)
+        else:
+            if config.schedule_recoveries:
+                #only process those whose illness resolves this frame
+                indices = self._due_recoveries(pop, config.frame)
             else:
-                #recover (become immune)
-                infected_people[:,6][infected_people[:,0] == idx] = 2
-                infected_people[:,10][infected_people[:,0] == idx] = 0
-                recovered.append(np.int32(infected_people[infected_people[:,0] == idx][:,0][0]))
+                #find infected people
+                infected_people = pop.state_index.members(1)
+            
+                #define vector of how long everyone has been sick
+                illness_duration_vector = config.frame - population[infected_people,8]
+                
+                recovery_odds_vector = (illness_duration_vector - self.recovery_duration[0]) / np.ptp(self.recovery_duration)
+                recovery_odds_vector = np.clip(recovery_odds_vector, a_min = 0, a_max = None)
+            
+                #update states of sick people 
+                indices = infected_people[recovery_odds_vector >= population[infected_people,9]]
+        
+            #look up mortality chance by age
+            mortality_table = self.mortality_by_age(pop)
+            ages = np.clip(np.int64(population[indices,7]), 0, len(mortality_table) - 1)
+            updated_mortality_chance = mortality_table[ages]
+        
+            if soc.treatment_dependent_risk:
+                #increase risk by no_treatment_factor if not in treatment, 
+                #decrease by treatment_factor if in treatment
+                updated_mortality_chance = updated_mortality_chance * np.where(population[indices,10] == 1,
+                                                                               soc.treatment_factor,
+                                                                               soc.no_treatment_factor)
+        
+            #decide whether to die or recover (become immune)
+            dies = np.random.random(len(indices)) <= updated_mortality_chance
+            fatalities = indices[dies]
+            recovered = indices[~dies]
+
+        pop.set_state(fatalities, 3)
+        pop.set_state(recovered, 2)
+        pop.set_treatment(np.concatenate((fatalities, recovered)), 0)
     
         if len(fatalities) > 0 and config.verbose:
-            print('\nat timestep %i these people died: %s' %(config.frame, fatalities))
+            print('\nat timestep %i these people died: %s' %(config.frame, fatalities.tolist()))
         if len(recovered) > 0 and config.verbose:
-            print('\nat timestep %i these people recovered: %s' %(config.frame, recovered))
+            print('\nat timestep %i these people recovered: %s' %(config.frame, recovered.tolist()))
     
-        #put array back into population
-        population[population[:,6] == 1] = infected_people
-    
-        return population 
\ No newline at end of file
+        return population
+
+
+    def schedule_recovery(self, pop, indices, frame):
+        '''puts newly infected people in the recovery calendar
+
+        The frame in which someone's illness resolves follows from column 8
+        (infected_since), column 9 (recovery vector) and recovery_duration:
+        it is the first frame where the recovery odds computed in
+        recover_or_die reach the recovery vector.
+
+        Keyword arguments
+        -----------------
+        pop : Population
+            the population, holds the calendar (pop.recovery_calendar)
+
+        indices : ndarray
+            indices of the people to schedule
+
+        frame : int
+            the current timestep, nobody is scheduled before it
+        '''
+        population = pop.population
+        infected_since = population[indices,8]
+        recovery_vector = population[indices,9]
+
+        def recovers(at_frame):
+            recovery_odds = (at_frame - infected_since - self.recovery_duration[0]) / np.ptp(self.recovery_duration)
+            return np.clip(recovery_odds, a_min = 0, a_max = None) >= recovery_vector
+
+        frames = np.ceil(infected_since + self.recovery_duration[0] + 
+                         recovery_vector * np.ptp(self.recovery_duration))
+        #correct for rounding, so the frame matches the test in recover_or_die exactly
+        frames[recovers(frames - 1)] -= 1
+        frames[~recovers(frames)] += 1
+        #a recovery vector below zero means recovery at the first opportunity
+        frames[recovers(frame)] = frame
+
+        pop.recovery_calendar.schedule(indices, np.maximum(frames, frame))
+
+
+    def _due_recoveries(self, pop, frame):
+        '''returns the (sorted) indices of everyone whose illness resolves at frame'''
+        calendar = pop.recovery_calendar
+
+        if not calendar.initialized:
+            #schedule those already infected when the calendar is first used
+            calendar.add(pop.state_index.members(1))
+            calendar.initialized = True
+
+        self.schedule_recovery(pop, calendar.take_pending(), frame)
+        indices = calendar.pop_due(frame)
+        #skip anyone whose state was changed by other means in the mean time
+        return indices[pop.population[indices,6] == 1]
+
+
+    def mortality_by_age(self, pop):
+        '''mortality chance for every age in the population
+
+        Returns an array indexed by age (column 7). The table is computed once
+        per population and virus pair and cached on the virus, later calls
+        return the cached table.
+        '''
+        key = self._mortality_key(pop)
+        if self._mortality_table is None or self._mortality_table[0] != key:
+            self._mortality_table = (key, self._compute_mortality_table(pop))
+        return self._mortality_table[1]
+
+
+    def _mortality_key(self, pop):
+        '''parameters the mortality table depends on'''
+        return None
+
+
+    def _compute_mortality_table(self, pop):
+        '''the base virus is not lethal, so the chance is zero at all ages'''
+        return np.zeros(1)
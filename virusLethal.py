@@ -41,6 +41,7 @@ class Virus_Lethal(Virus):
         self.infection_chance  = infection_chance  
         self.recovery_duration = recovery_duration       
         self.mortality_chance  = mortality_chance
+        self._mortality_table  = None #cached (key, table) of mortality_by_age
         
     @property
     def mortality_chance(self):
@@ -55,109 +56,27 @@ class Virus_Lethal(Virus):
         print("This is your challenge")
         
         
-    def recover_or_die(self,pop,soc,config):
-        '''see whether to recover or die
-    
-    
-        Keyword arguments
-        -----------------
-        population : ndarray
-            array containing all data on the population
-    
-        frame : int
-            the current timestep of the simulation
-    
-        recovery_duration : tuple
-            lower and upper bounds of duration of recovery, in simulation steps
-    
-        mortality_chance : float
-            the odds that someone dies in stead of recovers (between 0 and 1)
-    
-        risk_age : int or flaot
-            the age from which mortality risk starts increasing
-    
-        critical_age: int or float
-            the age where mortality risk equals critical_mortality_change
-    
-        critical_mortality_chance : float
-            the heightened odds that an infected person has a fatal ending
-    
-        risk_increase : string
-            can be 'quadratic' or 'linear', determines whether the mortality risk
-            between the at risk age and the critical age increases linearly or
-            exponentially
-    
-        no_treatment_factor : int or float
-            defines a change in mortality odds if someone cannot get treatment. Can
-            be larger than one to increase risk, or lower to decrease it.
-    
-        treatment_dependent_risk : bool
-            whether availability of treatment influences patient risk
-    
-        treatment_factor : int or float
-            defines a change in mortality odds if someone is in treatment. Can
-            be larger than one to increase risk, or lower to decrease it.
-    
-        verbose : bool
-            whether to report to terminal the recoveries and deaths for each simulation step
+    def _mortality_key(self, pop):
+        '''parameters the mortality table depends on'''
+        if not isinstance(pop, Stratified_Population):
+            return None
+        return (pop.max_age, pop.risk_age, pop.critical_age, 
+                pop.critical_mortality_chance, pop.risk_increase, self.mortality_chance)
+
+
+    def _compute_mortality_table(self, pop):
+        '''mortality chance for every age from 0 to max_age
+
+        Uses compute_mortality for stratified populations. Other populations
+        have no ages, so only the chance at age 0 is used.
         '''
-        population = pop.population
-        #find infected people
-        infected_people = population[population[:,6] == 1]
-    
-        #define vector of how long everyone has been sick
-        illness_duration_vector = config.frame - infected_people[:,8]
-        
-        recovery_odds_vector = (illness_duration_vector - self.recovery_duration[0]) / np.ptp(self.recovery_duration)
-        recovery_odds_vector = np.clip(recovery_odds_vector, a_min = 0, a_max = None)
-    
-        #update states of sick people 
-        indices = infected_people[:,0][recovery_odds_vector >= infected_people[:,9]]
-    
-        recovered = []
-        fatalities = []
-    
-        #decide whether to die or recover
-        for idx in indices:
-            #check if we want risk to be age dependent
-            #if age_dependent_risk:
-            
-            if isinstance(pop,Stratified_Population):
-                updated_mortality_chance = self.compute_mortality(infected_people[infected_people[:,0] == idx][:,7][0], 
-                                                                pop.risk_age, pop.critical_age, 
-                                                                pop.critical_mortality_chance, 
-                                                                pop.risk_increase)
-            
-            else:
-                updated_mortality_chance = 0
-    
-            if infected_people[infected_people[:,0] == int(idx)][:,10] == 0 and soc.treatment_dependent_risk:
-                #if person is not in treatment, increase risk by no_treatment_factor
-                updated_mortality_chance = updated_mortality_chance * soc.no_treatment_factor
-            elif infected_people[infected_people[:,0] == int(idx)][:,10] == 1 and soc.treatment_dependent_risk:
-                #if person is in treatment, decrease risk by 
-                updated_mortality_chance = updated_mortality_chance * soc.treatment_factor
-    
-            if np.random.random() <= updated_mortality_chance:
-                #die
-                infected_people[:,6][infected_people[:,0] == idx] = 3
-                infected_people[:,10][infected_people[:,0] == idx] = 0
-                fatalities.append(np.int32(infected_people[infected_people[:,0] == idx][:,0][0]))
-            else:
-                #recover (become immune)
-                infected_people[:,6][infected_people[:,0] == idx] = 2
-                infected_people[:,10][infected_people[:,0] == idx] = 0
-                recovered.append(np.int32(infected_people[infected_people[:,0] == idx][:,0][0]))
-    
-        if len(fatalities) > 0 and config.verbose:
-            print('\nat timestep %i these people died: %s' %(config.frame, fatalities))
-        if len(recovered) > 0 and config.verbose:
-            print('\nat timestep %i these people recovered: %s' %(config.frame, recovered))
-    
-        #put array back into population
-        population[population[:,6] == 1] = infected_people
-    
-        return population
+        if not isinstance(pop, Stratified_Population):
+            return np.zeros(1)
+
+        return np.array([self.compute_mortality(age, pop.risk_age, pop.critical_age,
+                                                pop.critical_mortality_chance,
+                                                pop.risk_increase)
+                         for age in range(int(pop.max_age) + 1)])
     
     
     def compute_mortality(self, age, risk_age=50,
@@ -2,6 +2,8 @@
 contains all methods for visualisation tasks
 '''
 
+import warnings
+
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 import numpy as np
@@ -38,8 +40,11 @@ def build_fig(Config, pop, figsize=(5,7)):
 
 
 def draw_tstep(Config, soc, pop_size, population, pop_tracker, frame,
-               fig, spec, ax1, ax2):
+               fig, spec, ax1, ax2, state_index=None, writer=None):
     #construct plot and visualise
+    #state_index (Population.state_index) is used to select the people per
+    #state, if not given the population is scanned for each state
+    #with a writer (Background_Writer) saved plots are encoded in the background
 
     #set plot style
     set_style(Config)
@@ -61,16 +66,21 @@ def draw_tstep(Config, soc, pop_size, population, pop_tracker, frame,
         
     #plot population segments
     sizeDot = 8
-    healthy = population[population[:,6] == 0][:,1:3]
+    if state_index is None:
+        members = lambda state: population[:,6] == state
+    else:
+        members = state_index.members
+
+    healthy = population[members(0),1:3]
     ax1.scatter(healthy[:,0], healthy[:,1], color=palette[0], s = sizeDot, label='healthy')
     
-    infected = population[population[:,6] == 1][:,1:3]
+    infected = population[members(1),1:3]
     ax1.scatter(infected[:,0], infected[:,1], color=palette[1], s = sizeDot, label='infected')
 
-    immune = population[population[:,6] == 2][:,1:3]
+    immune = population[members(2),1:3]
     ax1.scatter(immune[:,0], immune[:,1], color=palette[2], s = sizeDot, label='immune')
     
-    fatalities = population[population[:,6] == 3][:,1:3]
+    fatalities = population[members(3),1:3]
     ax1.scatter(fatalities[:,0], fatalities[:,1], color=palette[3], s = sizeDot, label='dead')
         
     
@@ -116,8 +126,277 @@ def draw_tstep(Config, soc, pop_size, population, pop_tracker, frame,
     plt.pause(0.0001)
 
     if Config.save_plot:
-        try:
+        check_folder(Config.plot_path)
+        if writer is None:
             plt.savefig('%s/%i.png' %(Config.plot_path, frame))
-        except:
-            check_folder(Config.plot_path)
-            plt.savefig('%s/%i.png' %(Config.plot_path, frame))
\ No newline at end of file
+        else:
+            writer.save_figure(fig, '%s/%i.png' %(Config.plot_path, frame))
+
+def density_histogram(x, y, states, x_plot, y_plot, bins):
+    '''counts the people per state in a grid over the plot extent
+
+    One np.bincount over a combined (state, row, column) bin number, so
+    the cost is a single pass over the population. People outside the
+    extent and in state 4 (immune but infectious, not drawn) are counted
+    in bins past the first four states, which are dropped.
+
+    Returns
+    -------
+    the counts, an array of (4, bins, bins), rows along y
+    '''
+    column = (x - x_plot[0]) * (bins / (x_plot[1] - x_plot[0]))
+    row = (y - y_plot[0]) * (bins / (y_plot[1] - y_plot[0]))
+    outside = (column < 0) | (column >= bins) | (row < 0) | (row >= bins)
+    cells = (states * bins + row.astype(np.int64)) * bins + column.astype(np.int64)
+    cells[outside] = 4 * bins * bins
+    return np.bincount(cells, minlength = 5 * bins * bins)[:4 * bins * bins].reshape(4, bins, bins)
+
+
+def density_image(histogram, colors):
+    '''composites a histogram of density_histogram into an RGBA image
+
+    The color of a bin is the mix of the state colors, weighted by the
+    number of people of each state in it. The opacity grows with the
+    logarithm of the number of people, so sparse bins stay visible next
+    to crowded ones. Empty bins are transparent.
+
+    Keyword arguments
+    -----------------
+    histogram : ndarray
+        counts per state, (4, rows, columns)
+
+    colors : ndarray
+        RGBA color per state, (4, 4)
+    '''
+    total = histogram.sum(axis=0)
+    image = np.tensordot(histogram, colors, axes = (0, 0)) / np.maximum(total, 1)[:,:,np.newaxis]
+    image[:,:,3] = np.log1p(total) / np.log1p(max(total.max(), 1))
+    return image
+
+
+class Live_Renderer():
+    __slots__ = ['config',
+                 'society',
+                 'pop_size',
+                 'fig',
+                 'ax1',
+                 'ax2',
+                 'blit',
+                 'background',
+                 'scatters',
+                 'label',
+                 'lines',
+                 'capacity',
+                 'span',
+                 'image',
+                 'colors',
+                 'sample']
+
+    '''draws the simulation like draw_tstep, with artists that are made once
+
+    The style, the axes, the hospital walls and the legend are drawn once.
+    Every frame only updates the animated artists: a scatter per state
+    (set_offsets), the counts text and the tracker lines (set_data). A
+    scatter of one color is drawn much faster by Agg than a scatter with a
+    color per point, so the states are not combined in one scatter. On
+    canvases that support it the animated artists are blitted over a saved
+    background, in stead of redrawing the figure. The background is saved
+    again after every full draw (for example when the window is resized,
+    or when the time axis grows).
+
+    With config.plot_density the people are counted per state in a grid of
+    config.density_bins by density_bins bins over the plot extent, and drawn
+    as one image (see density_image) of which only the data changes every
+    frame. This costs a pass over the population and a pass over the
+    bins, in stead of a marker per person. The scatters then only draw a
+    fixed random sample of config.density_sample people, if any.
+    '''
+    def __init__(self, config, soc, pop, fig=None, ax1=None, ax2=None):
+        '''
+        Keyword arguments
+        -----------------
+        config : Configuration
+            the configuration, holds the plot settings
+
+        soc : Society
+            the society, for the hospital walls and the healthcare capacity
+
+        pop : Population
+            the population
+
+        fig, ax1, ax2 : matplotlib figure and axes
+            as returned by build_fig, built if not given
+        '''
+        if fig is None:
+            fig, spec, ax1, ax2 = build_fig(config, pop)
+        else:
+            set_style(config)
+        self.config = config
+        self.society = soc
+        self.pop_size = pop.pop_size
+        self.fig = fig
+        self.ax1 = ax1
+        self.ax2 = ax2
+        self.blit = fig.canvas.supports_blit
+        self.background = None
+        self.span = 100 #frames on the time axis, doubled when full
+
+        ax1.clear()
+        ax2.clear()
+        ax1.set_xlim(config.x_plot[0], config.x_plot[1])
+        ax1.set_ylim(config.y_plot[0], config.y_plot[1])
+        if soc.self_isolate and soc.isolation_bounds != None:
+            build_hospital(soc.isolation_bounds[0], soc.isolation_bounds[2],
+                           soc.isolation_bounds[1], soc.isolation_bounds[3], ax1,
+                           addcross = False)
+        #people in state 4 (immune but infectious) are not drawn, as in draw_tstep
+        palette = config.get_palette()
+        self.image = None
+        self.sample = None
+        if config.plot_density:
+            bins = config.density_bins
+            self.colors = mpl.colors.to_rgba_array(palette[:4])
+            self.image = ax1.imshow(np.zeros((bins, bins, 4)), origin = 'lower', interpolation = 'nearest',
+                                    extent = (config.x_plot[0], config.x_plot[1],
+                                              config.y_plot[0], config.y_plot[1]),
+                                    aspect = 'auto', animated = self.blit)
+            #its own generator, drawing the sample does not change the simulation
+            rng = np.random.default_rng(0)
+            self.sample = np.sort(rng.choice(self.pop_size, min(config.density_sample, self.pop_size),
+                                             replace = False))
+        #sampled points get an outline, to stand out from the image
+        outline = {'edgecolors' : 'white', 'linewidths' : 0.3} if config.plot_density else {}
+        self.scatters = [ax1.scatter(np.zeros(0), np.zeros(0), color = palette[state], s = 8,
+                                     animated = self.blit, **outline) for state in range(4)]
+        self.label = ax1.text(config.x_plot[0],
+                              config.y_plot[1] + ((config.y_plot[1] - config.y_plot[0]) / 100),
+                              '', fontsize = 6, animated = self.blit)
+
+        ax2.set_title('number of infected')
+        ax2.text(0, self.pop_size * 0.05,
+                 'https://github.com/paulvangentcom/python-corona-simulation',
+                 fontsize=6, alpha=0.5)
+        ax2.set_ylim(0, self.pop_size + 200)
+        ax2.set_xlim(0, self.span)
+
+        self.capacity = None
+        if soc.treatment_dependent_risk:
+            self.capacity, = ax2.plot([], [], 'r:', label='healthcare capacity', animated = self.blit)
+
+        if config.plot_mode.lower() == 'default':
+            series = [('infectious', palette[1], None), ('fatalities', palette[3], 'fatalities')]
+        elif config.plot_mode.lower() == 'sir':
+            series = [('infectious', palette[1], 'infectious'), ('fatalities', palette[3], 'fatalities'),
+                      ('susceptible', palette[0], 'susceptible'), ('recovered', palette[2], 'recovered')]
+        else:
+            raise ValueError('incorrect plot_style specified, use \'sir\' or \'default\'')
+        self.lines = [(name, ax2.plot([], [], color = color, label = label, animated = self.blit)[0])
+                      for name, color, label in series]
+        #a fixed place, 'best' would depend on the lines at the last full draw
+        ax2.legend(loc = 'upper right', fontsize = 6)
+
+        if self.blit:
+            fig.canvas.mpl_connect('draw_event', self._save_background)
+        with warnings.catch_warnings():
+            #non interactive backends (Agg) can not show the figure
+            warnings.simplefilter('ignore')
+            plt.show(block = False)
+
+    def _save_background(self, event=None):
+        '''saves the figure without the animated artists'''
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+
+    def _draw_density(self, population, state_index=None):
+        '''updates the density image and the sampled points, returns the counts per state'''
+        states = np.int64(population[:,6])
+        histogram = density_histogram(population[:,1], population[:,2], states,
+                                      self.config.x_plot, self.config.y_plot, self.config.density_bins)
+        self.image.set_data(density_image(histogram, self.colors))
+
+        if state_index is None:
+            counts = np.bincount(states, minlength = 5)[:4].tolist()
+        else:
+            counts = [state_index.count(state) for state in range(4)]
+        sampled = states[self.sample]
+        for state, scatter in enumerate(self.scatters):
+            scatter.set_offsets(population[self.sample[sampled == state],1:3])
+        return counts
+
+    def draw(self, frame, population, pop_tracker, state_index=None, writer=None):
+        '''draws a frame
+
+        Keyword arguments
+        -----------------
+        frame : int
+            the frame number
+
+        population : ndarray
+            the population matrix
+
+        pop_tracker : Population_trackers
+            the counts over time
+
+        state_index : Population_states
+            used for the counts per state, if not given the population is scanned
+
+        writer : Background_Writer
+            if given (and config.save_plot is set), the png is encoded in the background
+        '''
+        canvas = self.fig.canvas
+        frames = len(pop_tracker.infectious)
+        if frames > self.span:
+            while frames > self.span:
+                self.span *= 2
+            self.ax2.set_xlim(0, self.span)
+            self.background = None
+
+        #update the artists
+        if self.image is not None:
+            counts = self._draw_density(population, state_index)
+        else:
+            if state_index is None:
+                members = lambda state: population[:,6] == state
+            else:
+                members = state_index.members
+            counts = []
+            for state, scatter in enumerate(self.scatters):
+                positions = population[members(state),1:3]
+                scatter.set_offsets(positions)
+                counts.append(len(positions))
+        self.label.set_text('timestep: %i, total: %i, healthy: %i infected: %i immune: %i fatalities: %i'
+                            %(frame, len(population), counts[0], counts[1], counts[2], counts[3]))
+        time_axis = np.arange(frames)
+        for name, line in self.lines:
+            line.set_data(time_axis, getattr(pop_tracker, name))
+        if self.capacity is not None:
+            self.capacity.set_data([0, max(frames - 1, 0)], [self.society.healthcare_capacity] * 2)
+
+        if self.blit:
+            if self.background is None:
+                canvas.draw() #saves the background, see _save_background
+            canvas.restore_region(self.background)
+            if self.image is not None:
+                self.ax1.draw_artist(self.image)
+            for scatter in self.scatters:
+                self.ax1.draw_artist(scatter)
+            self.ax1.draw_artist(self.label)
+            if self.capacity is not None:
+                self.ax2.draw_artist(self.capacity)
+            for name, line in self.lines:
+                self.ax2.draw_artist(line)
+            canvas.blit(self.fig.bbox)
+        else:
+            canvas.draw()
+        canvas.flush_events()
+
+        if self.config.save_plot:
+            check_folder(self.config.plot_path)
+            path = '%s/%i.png' %(self.config.plot_path, frame)
+            if not hasattr(canvas, 'buffer_rgba'):
+                #no pixel buffer (and no blitting), savefig draws everything
+                self.fig.savefig(path)
+            elif writer is None:
+                #the canvas holds the blitted frame, a savefig would redraw without the animated artists
+                plt.imsave(path, np.array(canvas.buffer_rgba()), format = 'png', dpi = self.fig.dpi)
+            else:
+                writer.save_pixels(path, np.array(canvas.buffer_rgba()), self.fig.dpi)
@@ -0,0 +1,131 @@
+'''
+file that contains the background writer: files the simulation saves
+(population snapshots, plots, tracker dumps) are written by a thread, so
+the time step loop does not wait on disk or on PNG encoding
+'''
+
+import atexit
+import functools
+import os
+import queue
+import threading
+
+import numpy as np
+
+
+class Background_Writer():
+    __slots__ = ['max_pending',
+                 'queue',
+                 'thread',
+                 'pid',
+                 'error',
+                 'lock']
+
+    '''bounded queue of write jobs, executed in order by a worker thread
+
+    The caller hands over copies of the data (see save_array and
+    save_figure), so the simulation can change its arrays right away. When
+    max_pending jobs are waiting, submit blocks until the worker catches
+    up (backpressure), which bounds the memory held by pending copies.
+    Pending jobs are written before the interpreter exits (atexit), or
+    earlier with flush or close. An error in a job is raised by the next
+    call of submit, flush or close. close stops the thread and removes the
+    exit hook, a later submit starts them again.
+
+    After a fork (for example in the workers of fork.py) the writer starts
+    a new thread in the child process, threads do not survive a fork.
+    Copies of a writer (copy.deepcopy of a Simulation) share it.
+    '''
+    def __init__(self, max_pending=8):
+        '''
+        Keyword arguments
+        -----------------
+        max_pending : int
+            the number of jobs that can wait before submit blocks
+        '''
+        self.max_pending = max_pending
+        self.thread = None
+        self.pid = None
+        self.error = None
+        self.lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def _start(self):
+        '''starts the worker thread, in this process'''
+        with self.lock:
+            if self.pid == os.getpid() and self.thread is not None:
+                return
+            self.queue = queue.Queue(maxsize = self.max_pending)
+            #a daemon, so interpreter exit does not wait for it before atexit closes it
+            self.thread = threading.Thread(target = self._work, name = 'background writer',
+                                           daemon = True)
+            self.thread.start()
+            self.pid = os.getpid()
+            #only while the thread runs, so closed writers are not kept alive
+            atexit.register(self.close)
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                function, args = job
+                if self.error is None:
+                    function(*args)
+            except BaseException as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, function, *args):
+        '''runs function(*args) in the background, blocks if max_pending jobs wait'''
+        self._raise()
+        if self.pid != os.getpid() or self.thread is None:
+            self._start()
+        self.queue.put((function, args))
+
+    def flush(self):
+        '''waits until all submitted jobs are done'''
+        if self.thread is not None and self.pid == os.getpid():
+            self.queue.join()
+        self._raise()
+
+    def close(self):
+        '''writes the pending jobs and stops the worker thread'''
+        if self.thread is not None and self.pid == os.getpid():
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            atexit.unregister(self.close)
+        self._raise()
+
+    def save_array(self, path, array):
+        '''np.save of a copy of array'''
+        self.submit(np.save, path, np.array(array))
+
+    def save_figure(self, fig, path):
+        '''saves a figure as png, only the encoding runs in the background
+
+        The figure is rendered now and its pixels are copied, so the figure
+        can be drawn on again right away. Falls back to fig.savefig for
+        canvases without a pixel buffer.
+        '''
+        canvas = fig.canvas
+        if not hasattr(canvas, 'buffer_rgba'):
+            fig.savefig(path)
+            return
+        canvas.draw()
+        self.save_pixels(path, np.array(canvas.buffer_rgba()), fig.dpi)
+
+    def save_pixels(self, path, pixels, dpi=100):
+        '''saves an (height, width, 4) RGBA array as png, the array is not copied'''
+        from matplotlib.image import imsave
+        self.submit(functools.partial(imsave, format = 'png', dpi = dpi), path, pixels)